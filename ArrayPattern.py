@@ -0,0 +1,187 @@
+import math
+
+try:
+    # The array patterns need numpy, which is not part of the standard library.
+    import numpy
+except ImportError:
+    numpy = None
+
+import Pattern
+
+# In a uint8 frame array, a channel at this level or above is on.
+ON_LEVEL = 128
+
+
+def _need_numpy():
+    """
+    Raises an exception if numpy is not installed.
+    :return: None
+    """
+    if numpy is None:
+        raise Exception('The numpy module is needed for array patterns.')
+
+
+def frame_times(frame_count: int, fps: float):
+    """
+    :param frame_count: The number of frames.
+    :param fps: The number of frames per second.
+    :return: A (frames x 1) array of the time of each frame in seconds, for
+    broadcasting against a (frames x channels) array.
+    """
+    _need_numpy()
+    return (numpy.arange(frame_count) / fps)[:, None]
+
+
+def chase(channel_count: int, frame_count: int, width: int = 1, step: int = 1):
+    """
+    A chase: a block of width channels that moves step channels along every frame
+    and wraps around.
+    :param channel_count: The number of channels (columns).
+    :param frame_count: The number of frames (rows).
+    :param width: How many channels are on at once.
+    :param step: How many channels the block moves each frame.  Negative runs
+    the chase backwards.
+    :return: A (frames x channels) bool array.
+    """
+    _need_numpy()
+    frames = numpy.arange(frame_count)[:, None]
+    channels = numpy.arange(channel_count)[None, :]
+    return (channels - frames * step) % channel_count < width
+
+
+def wave(channel_count: int, frame_count: int, fps: float, period_sec: float = 2, wavelength: float = None):
+    """
+    A sine wave of brightness that travels along the channels.
+    :param channel_count: The number of channels (columns).
+    :param frame_count: The number of frames (rows).
+    :param fps: The number of frames per second.
+    :param period_sec: How many seconds one channel takes to go through a whole wave.
+    :param wavelength: How many channels one wave spans.  All of the channels
+    if None.
+    :return: A (frames x channels) uint8 array of brightness from 0 to 255.
+    """
+    _need_numpy()
+    if wavelength is None:
+        wavelength = channel_count
+    phase = frame_times(frame_count, fps) / period_sec - numpy.arange(channel_count)[None, :] / wavelength
+    return ((numpy.sin(2 * numpy.pi * phase) + 1) * 127.5).astype(numpy.uint8)
+
+
+def twinkle(channel_count: int, frame_count: int, density: float = .2, seed: int = None):
+    """
+    Random twinkling: every channel is on in a frame with the same chance.
+    :param channel_count: The number of channels (columns).
+    :param frame_count: The number of frames (rows).
+    :param density: The chance of a channel being on, from 0 to 1.
+    :param seed: The random seed, for a twinkle that is the same every time.
+    :return: A (frames x channels) bool array.
+    """
+    _need_numpy()
+    return numpy.random.default_rng(seed).random((frame_count, channel_count)) < density
+
+
+def beats(frame_count: int, fps: float, bpm: float, hold_sec: float = .1, offset_sec: float = 0):
+    """
+    A beat mask that is on for hold_sec at the start of every beat.  AND it with
+    another pattern to flash that pattern on the beat.  Each beat starts on the
+    frame nearest to it and lasts the same whole number of frames, so the
+    flashes stay even when a beat is not a whole number of frames long.
+    :param frame_count: The number of frames (rows).
+    :param fps: The number of frames per second.
+    :param bpm: The beats per minute.
+    :param hold_sec: How many seconds the mask stays on after each beat.
+    :param offset_sec: The time of the first beat.
+    :return: A (frames x 1) bool array, which broadcasts against any number of
+    channels.
+    """
+    _need_numpy()
+    beat_frames = fps * 60 / bpm
+    offset_frames = offset_sec * fps
+    span = max(0, math.ceil(hold_sec * fps))
+    # Every beat that can reach into the frames, including one just before frame 0.
+    first = math.floor((-offset_frames - span) / beat_frames)
+    last = math.ceil((frame_count - offset_frames) / beat_frames)
+    starts = numpy.rint(numpy.arange(first, last + 1) * beat_frames + offset_frames).astype(numpy.int64)
+    # +1 where a flash starts and -1 where it ends, summed up to each frame.
+    edges = numpy.zeros(frame_count + 1, dtype=numpy.int64)
+    numpy.add.at(edges, numpy.clip(starts, 0, frame_count), 1)
+    numpy.add.at(edges, numpy.clip(starts + span, 0, frame_count), -1)
+    return (numpy.cumsum(edges[:-1]) > 0)[:, None]
+
+
+def on_off(frames: object):
+    """
+    :param frames: A (frames x channels) bool or uint8 array.  uint8 values of
+    ON_LEVEL and up are on.
+    :return: A (frames x channels) bool array of the channels that are on.
+    """
+    _need_numpy()
+    frames = numpy.asarray(frames)
+    if frames.dtype != numpy.bool_:
+        frames = frames >= ON_LEVEL
+    return frames
+
+
+def to_masks(frames: object):
+    """
+    Packs a frame array into one channel bitmask per frame.  Column 0 is channel 1.
+    :param frames: A (frames x channels) bool or uint8 array, see on_off().
+    :return: A list of ints, one bitmask per frame.
+    """
+    frames = on_off(frames)
+    packed = numpy.packbits(frames, axis=1, bitorder='little')
+    return [int.from_bytes(row.tobytes(), 'little') for row in packed]
+
+
+def changes(frames: object):
+    """
+    Finds the frames that turn a channel on or off compared to the frame before
+    them.  A uint8 frame whose levels change without crossing ON_LEVEL is not
+    a change.
+    :param frames: A (frames x channels) bool or uint8 array, see on_off().
+    :return: An array of the indexes of the changed frames.  Frame 0 is always
+    in it.
+    """
+    frames = on_off(frames)
+    if len(frames) == 0:
+        return numpy.arange(0)
+    changed = numpy.any(frames[1:] != frames[:-1], axis=1)
+    return numpy.concatenate(([0], numpy.nonzero(changed)[0] + 1))
+
+
+class ArrayPattern(Pattern.Pattern):
+    """
+    Parent class for PatternKit objects that compute their frames all at once
+    as a numpy array instead of turning channels on and off one at a time.  A
+    subclass implements frames(), and play() shows them.  For example, a 200
+    channel chase for a minute at 10 frames per second:
+
+        def frames(self):
+            return ArrayPattern.chase(200, 600, width=3), 10
+    """
+
+    def frames(self):
+        """
+        A virtual method that all ArrayPattern objects will implement to compute
+        their frames.
+        :return: A tuple of a (frames x channels) bool or uint8 array (see to_masks())
+        and the number of frames per second.
+        """
+        return None, 1
+
+    def play(self):
+        """
+        Shows the frames from frames().  Only the frames that change anything are
+        sent to the Lights, and the sleeps in between cover the frames that do not.
+        :return: None
+        """
+        frames, fps = self.frames()
+        if frames is None or len(frames) == 0:
+            return
+        frames = on_off(frames)
+        indexes = changes(frames)
+        masks = to_masks(frames[indexes])
+        ends = list(indexes[1:]) + [len(frames)]
+        for mask, start, end in zip(masks, indexes, ends):
+            self.lights.set_frame(mask)
+            self.sleep((end - start) / fps)
@@ -0,0 +1,152 @@
+import asyncio
+
+import KitRegistry
+import Pattern
+import PatternDriver
+import Scheduler
+
+
+class AsyncPatternDriver(PatternDriver.PatternDriver):
+    """
+    A PatternDriver that runs on an asyncio event loop.  Each PatternKit's turn is
+    a task that is cancelled at the timeout, and other coroutines ("services",
+    like a control socket) run on the same loop while the show plays.
+
+    PatternKits that derive from Pattern.AsyncPattern run directly on the event
+    loop.  The older PatternKits that derive from Pattern.Pattern block in
+    play(), so they run in a worker thread and are stopped through their
+    Scheduler.
+    """
+    def __init__(self, clock: object = None):
+        """
+        Sets up the AsyncPatternDriver the same way as the PatternDriver.
+        :param clock: The Clock object to run the show on.
+        """
+        super().__init__(clock)
+        # Coroutine functions that run for as long as the show runs.
+        self._services = []
+        # The task playing the current PatternKit, so skip() can cancel it.
+        self._current_task = None
+
+    def add_service(self, service: object):
+        """
+        Adds a coroutine function that runs alongside the show.  It is started when
+        run_async() starts and cancelled when run_async() ends.
+        :param service: A coroutine function that takes no arguments.
+        :return: None
+        """
+        self._services.append(service)
+
+    def skip(self):
+        """
+        Ends the current PatternKit's turn early.  Meant to be called from a service.
+        :return: None
+        """
+        if self._current_task is not None:
+            self._current_task.cancel()
+
+    def _play_blocking(self, pattern_object: object):
+        """
+        Plays an old blocking PatternKit until its Scheduler says its turn is over.
+        This runs in a worker thread.
+        :param pattern_object: The PatternKit object to play.
+        :return: None
+        """
+        try:
+            while not self.scheduler.expired():
+                pattern_object.play()
+        except Scheduler.KitTimeout:
+            pass
+
+    async def play_kit(self, pattern_object: object):
+        """
+        Plays one PatternKit until its turn is over or the task is cancelled.
+        :param pattern_object: The PatternKit object to play.
+        :return: None
+        """
+        if isinstance(pattern_object, Pattern.AsyncPattern):
+            try:
+                while not self.scheduler.expired():
+                    await pattern_object.play()
+            except Scheduler.KitTimeout:
+                pass
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, self._play_blocking, pattern_object)
+        try:
+            await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # A thread cannot be cancelled.  End its turn so its next sleep()
+            # raises KitTimeout, and wait for it so two PatternKits never
+            # drive the lights at the same time.
+            self.scheduler.preempt()
+            await future
+            raise
+
+    async def run_async(self, timeout_sec: int = PatternDriver.FIVE_MINUTES_IN_SECONDS):
+        """
+        Loops forever on the running event loop, running each of the PatternKits
+        in succession for timeout_sec seconds each.
+        :param timeout_sec: Number of seconds to run a PatternKit before
+        starting another PatternKit
+        :return: None (Never returns)
+        """
+        services = [asyncio.create_task(service()) for service in self._services]
+        try:
+            while True:
+                played = False
+                for name in self.pattern_objects.keys():
+                    self.reload_kits()
+                    if name not in self.pattern_objects:
+                        continue
+                    try:
+                        pattern_object = self.pattern_objects[name]
+                    except KitRegistry.KitLoadError:
+                        # Skipped, the error is in pattern_objects.reload_errors.
+                        continue
+                    played = True
+                    self.lights.reset()
+                    self.scheduler.stats = self.lateness_stats(name)
+                    self.scheduler.start(timeout_sec)
+                    self._current_task = asyncio.create_task(self.play_kit(pattern_object))
+                    try:
+                        await asyncio.wait_for(asyncio.shield(self._current_task), timeout_sec)
+                    except asyncio.TimeoutError:
+                        self._current_task.cancel()
+                    except asyncio.CancelledError:
+                        if not self._current_task.cancelled():
+                            # run_async() itself was cancelled.
+                            self._current_task.cancel()
+                            raise
+                    if not self._current_task.done():
+                        try:
+                            await self._current_task
+                        except asyncio.CancelledError:
+                            pass
+                    self._current_task = None
+                if not played:
+                    # Every PatternKit failed to load.  Stay dark for a turn, and
+                    # let the services run, instead of trying them all again right away.
+                    self.lights.reset()
+                    await asyncio.sleep(timeout_sec)
+        finally:
+            for task in services:
+                task.cancel()
+
+    def run_schedule(self, playlist: object, start_time: float = None):
+        """
+        Not supported: the turns of a Playlist are not played on the event loop.
+        :param playlist: The Playlist.Playlist object.
+        :param start_time: The time the show's clock starts at.
+        :return: None
+        """
+        raise Exception('The AsyncPatternDriver cannot run a playlist.')
+
+    def run(self, timeout_sec: int = PatternDriver.FIVE_MINUTES_IN_SECONDS):
+        """
+        Starts an event loop and runs the show on it.
+        :param timeout_sec: Number of seconds to run a PatternKit before
+        starting another PatternKit
+        :return: None (Never returns)
+        """
+        asyncio.run(self.run_async(timeout_sec))
@@ -1,9 +1,80 @@
 
+import AsyncPatternDriver
+import Clock
+import Compositor
+import KitProcess
 import PatternDriver
+import Playlist
+import RenderAhead
+import ShowEngine
+import Transition
 
 DEBUG = False
 
+# When True, each PatternKit is recorded once and replayed from its Timeline
+# instead of calling play() over and over.
+USE_SHOW_ENGINE = False
+
+# How the ShowEngine blends one PatternKit into the next: None to go dark in
+# between, or one of Transition.KINDS ('cut', 'wipe', 'dissolve', 'crossfade').
+TRANSITION = None
+
+# How many seconds a transition takes.
+TRANSITION_SEC = Transition.TRANSITION_SEC
+
+# To play several PatternKits at once, a list of (PatternKit name, channel
+# numbers, blend) tuples from the bottom layer to the top, where the channel
+# numbers are the channels the PatternKit owns (None for all) and the blend is
+# one of Compositor.BLENDS.  For example:
+#     [('MyPatternKit', range(1, 9), 'or'), ('MyPatternKit2', range(9, 17), 'override')]
+# The layers are played by the ShowEngine.  None to play one PatternKit at a time.
+LAYERS = None
+
+# When True, the show runs on an asyncio event loop so other coroutines can
+# run alongside it.
+USE_ASYNCIO = False
+
+# When True, each PatternKit runs in a process of its own that is killed and
+# restarted if it hangs, so one bad PatternKit cannot stop the show.
+USE_PROCESSES = False
+
+# When True, the PatternKits render up to RenderAhead.BUFFER_SEC of frames ahead
+# in a process of their own, and a separate output loop plays them on time.
+USE_RENDER_AHEAD = False
+
+# When True, PatternKit files that are edited, added or removed while the show
+# runs are picked up between play() calls, without restarting the show.
+USE_HOT_RELOAD = False
+
+# The filename of a playlist JSON file (see Playlist.Playlist) to run the show
+# from, or None to take turns through all of the PatternKits.
+PLAYLIST = None
+
+# How many times faster than real time to run the show.  Handy for previewing
+# a show in the simulator.
+SPEED = 1
+
 
 if __name__ == '__main__':
-    pattern_driver = PatternDriver.PatternDriver()
-    pattern_driver.run(timeout_sec=10)
+    clock = Clock.AcceleratedClock(SPEED) if SPEED != 1 else None
+    if USE_SHOW_ENGINE or LAYERS is not None:
+        pattern_driver = ShowEngine.ShowEngine(clock)
+        if TRANSITION is not None:
+            pattern_driver.transition = Transition.Transition(TRANSITION, TRANSITION_SEC,
+                                                              pattern_driver.lights.channel_numbers)
+    elif USE_PROCESSES:
+        pattern_driver = KitProcess.ProcessPatternDriver(clock)
+    elif USE_RENDER_AHEAD:
+        pattern_driver = RenderAhead.RenderAheadDriver(clock)
+    elif USE_ASYNCIO:
+        pattern_driver = AsyncPatternDriver.AsyncPatternDriver(clock)
+    else:
+        pattern_driver = PatternDriver.PatternDriver(clock)
+    if USE_HOT_RELOAD:
+        pattern_driver.watch_kits()
+    if LAYERS is not None:
+        pattern_driver.run_layers(Compositor.Compositor([Compositor.Layer(*layer) for layer in LAYERS]), timeout_sec=10)
+    elif PLAYLIST is not None:
+        pattern_driver.run_schedule(Playlist.Playlist.load(PLAYLIST))
+    else:
+        pattern_driver.run(timeout_sec=10)
@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+NS_PER_SECOND = 1000000000
+
+# How close to a deadline the Scheduler stops sleeping and starts spinning.
+# time.sleep() can oversleep by a millisecond or more on a loaded Raspberry Pi,
+# so the last stretch is spent polling the clock instead.
+SPIN_NS = 1000000
+
+
+class RealClock:
+    """
+    The wall clock.  PatternKits paced by a RealClock run in real time.
+    """
+    # How many nanoseconds before a deadline the Scheduler should spin on this clock.
+    spin_ns = SPIN_NS
+    # True for clocks that move by themselves, so a background loop can run on them.
+    realtime = True
+
+    def now(self):
+        """
+        :return: The current time in seconds.  Only useful for measuring time
+        between two calls.
+        """
+        return time.monotonic()
+
+    def monotonic_ns(self):
+        """
+        :return: The current time in nanoseconds.
+        """
+        return time.monotonic_ns()
+
+    def sleep(self, seconds: float):
+        """
+        Sleeps.
+        :param seconds: Number of seconds to sleep.
+        :return: None
+        """
+        if seconds > 0:
+            time.sleep(seconds)
+
+    async def async_sleep(self, seconds: float):
+        """
+        Sleeps without blocking other asyncio tasks.
+        :param seconds: Number of seconds to sleep.
+        :return: None
+        """
+        await asyncio.sleep(max(0, seconds))
+
+
+class AcceleratedClock(RealClock):
+    """
+    A clock that runs factor times faster than the wall clock.  A PatternKit that
+    sleeps for one second on a 10x AcceleratedClock really sleeps for 0.1 seconds.
+    """
+    def __init__(self, factor: float):
+        """
+        Initializes the AcceleratedClock.
+        :param factor: How many times faster than the wall clock to run.
+        """
+        self.factor = factor
+        self._start_ns = time.monotonic_ns()
+
+    def now(self):
+        """
+        :return: The current accelerated time in seconds.
+        """
+        return self.monotonic_ns() / NS_PER_SECOND
+
+    def monotonic_ns(self):
+        """
+        :return: The current accelerated time in nanoseconds.
+        """
+        return self._start_ns + int((time.monotonic_ns() - self._start_ns) * self.factor)
+
+    def sleep(self, seconds: float):
+        """
+        Sleeps for seconds of accelerated time.
+        :param seconds: Number of accelerated seconds to sleep.
+        :return: None
+        """
+        if seconds > 0:
+            time.sleep(seconds / self.factor)
+
+    async def async_sleep(self, seconds: float):
+        """
+        Sleeps for seconds of accelerated time without blocking other asyncio tasks.
+        :param seconds: Number of accelerated seconds to sleep.
+        :return: None
+        """
+        await asyncio.sleep(max(0, seconds) / self.factor)
+
+
+class VirtualClock:
+    """
+    A clock that only moves when something sleeps on it.  sleep() returns right
+    away after moving the clock forward, so a PatternKit that sleeps for an hour
+    finishes in no time.
+    """
+    # There is nothing to spin on, the clock never moves by itself.
+    spin_ns = 0
+    realtime = False
+
+    def __init__(self):
+        """
+        Initializes the VirtualClock at time 0.
+        """
+        self._now_ns = 0
+
+    def now(self):
+        """
+        :return: The virtual time in seconds.
+        """
+        return self._now_ns / NS_PER_SECOND
+
+    def monotonic_ns(self):
+        """
+        :return: The virtual time in nanoseconds.
+        """
+        return self._now_ns
+
+    def sleep(self, seconds: float):
+        """
+        Moves the virtual time forward.
+        :param seconds: Number of seconds to move forward.
+        :return: None
+        """
+        if seconds > 0:
+            # Rounded, so that a sleep to an exact deadline lands on it.
+            self._now_ns += round(seconds * NS_PER_SECOND)
+
+    async def async_sleep(self, seconds: float):
+        """
+        Moves the virtual time forward and lets the other asyncio tasks run once.
+        :param seconds: Number of seconds to move forward.
+        :return: None
+        """
+        self.sleep(seconds)
+        await asyncio.sleep(0)
@@ -0,0 +1,398 @@
+import heapq
+import multiprocessing
+import queue
+import threading
+
+import Clock
+import KitProcess
+import KitRegistry
+import Lights
+import Scheduler
+import ShowEngine
+
+# How a Layer's frame is put over the layers below it, inside the Layer's
+# channel mask.  Outside of its mask a Layer changes nothing.  OR adds its
+# channels, AND only keeps the channels below that it has on too (a gate), XOR
+# flips the channels it has on, and OVERRIDE replaces the channels below.
+OR = 'or'
+AND = 'and'
+XOR = 'xor'
+OVERRIDE = 'override'
+
+BLENDS = (OR, AND, XOR, OVERRIDE)
+
+# How many blocks the layer render process can have ready ahead of the one
+# playing.
+BLOCKS_AHEAD = 1
+
+# How often the show checks that the layer render process is still running
+# while it waits for a block, in seconds.
+POLL_SEC = .1
+
+
+def blend(below: int, frame: int, mask: int, mode: str):
+    """
+    Puts one frame over another.
+    :param below: The bitmask of the channels that are on in the layers below.
+    :param frame: The bitmask of the channels that are on in this layer.
+    :param mask: The bitmask of the channels this layer owns.
+    :param mode: One of BLENDS.
+    :return: The bitmask of the channels that are on.
+    """
+    frame &= mask
+    if mode == OR:
+        return below | frame
+    if mode == AND:
+        return below & (frame | ~mask)
+    if mode == XOR:
+        return below ^ frame
+    return (below & ~mask) | frame
+
+
+class Layer:
+    """
+    One PatternKit in a layered show, and the channels it owns.
+    """
+    def __init__(self, name: str, channels: list = None, mode: str = OR):
+        """
+        Initializes the Layer.
+        :param name: The name of the PatternKit module.
+        :param channels: The channel numbers the PatternKit owns, or None for all
+        of them.  Whatever it does to other channels is thrown away.
+        :param mode: How it is put over the layers below it, one of BLENDS.
+        """
+        if mode not in BLENDS:
+            raise Exception('Unknown blend "%s" for "%s".  It must be one of %s.' % (mode, name, ', '.join(BLENDS)))
+        self.name = name
+        self.mode = mode
+        self.mask = -1
+        if channels is not None:
+            self.mask = 0
+            for num in channels:
+                self.mask |= Lights.channel_bit(num)
+
+
+class Compositor:
+    """
+    Runs several PatternKits at once by compositing their frames.  Each Layer's
+    PatternKit plays into a Timeline of its own (see ShowEngine.record()), so
+    the PatternKits never touch each other's channels, and the Timelines are
+    merged frame by frame with bitwise operations on the channel bitmasks.
+    """
+    def __init__(self, layers: list):
+        """
+        Initializes the Compositor.
+        :param layers: A list of Layer objects, from the bottom layer to the top.
+        """
+        if not layers:
+            raise Exception('A Compositor needs at least one Layer.')
+        self.layers = layers
+        self.name = ' + '.join(layer.name for layer in layers)
+
+    def composite(self, frames: list):
+        """
+        :param frames: A list of the bitmask of each Layer's frame, bottom first.
+        :return: The bitmask of the channels that are on.
+        """
+        mask = 0
+        for layer, frame in zip(self.layers, frames):
+            mask = blend(mask, frame, layer.mask, layer.mode)
+        return mask
+
+    @staticmethod
+    def _frames(index: int, timeline: object, duration: float):
+        """
+        :param index: The index of the Layer.
+        :param timeline: The Layer's Timeline.
+        :param duration: The number of seconds to go on for, looping the Timeline.
+        :return: A generator of (offset, index, mask) tuples in offset order.
+        """
+        start = 0
+        while start < duration:
+            for offset, mask in timeline:
+                if start + offset >= duration:
+                    return
+                yield start + offset, index, mask
+            if timeline.duration <= 0:
+                return
+            start += timeline.duration
+
+    def merge(self, timelines: list, duration: float):
+        """
+        Composites the Layers' Timelines into one.
+        :param timelines: A list of the Timeline of each Layer, bottom first.
+        :param duration: The length of the composited Timeline in seconds.  Shorter
+        Timelines loop.
+        :return: A ShowEngine.Timeline object.
+        """
+        frames = [0] * len(self.layers)
+        composited = []
+        streams = [self._frames(index, timeline, duration) for index, timeline in enumerate(timelines)]
+        for offset, index, mask in heapq.merge(*streams):
+            frames[index] = mask
+            if composited and composited[-1][0] == offset:
+                # Layers that change at the same moment make one frame.
+                composited.pop()
+            composited.append((offset, self.composite(frames)))
+        return ShowEngine.Timeline(composited, duration)
+
+    def render(self, pattern_objects: dict, seconds: float):
+        """
+        Renders every Layer's PatternKit ahead for seconds and composites them.
+        :param pattern_objects: The PatternKit objects keyed by name, like
+        PatternDriver.pattern_objects.
+        :param seconds: How many seconds to render.
+        :return: A ShowEngine.Timeline object.  A Layer whose PatternKit could not
+        be loaded is left dark.
+        """
+        timelines = []
+        for layer in self.layers:
+            try:
+                timelines.append(ShowEngine.record(pattern_objects[layer.name], seconds))
+            except KitRegistry.KitLoadError:
+                timelines.append(ShowEngine.Timeline([], seconds))
+        return self.merge(timelines, seconds)
+
+    def renderer(self, kit_directories: list, watch: bool, seconds: float):
+        """
+        :param kit_directories: The directories to find PatternKit files in.
+        :param watch: If True, PatternKit files edited while the show runs are reloaded.
+        :param seconds: How many seconds each block lasts.
+        :return: A LayerRenderer (not started yet) that renders this Compositor's
+        Layers block after block, each carrying on from the last.
+        """
+        return LayerRenderer(self, kit_directories, watch, seconds)
+
+
+class LayerStopped(Exception):
+    """
+    Raised out of a PatternKit's sleep() when its LayerRecorder is closed, to end
+    its thread.
+    """
+    pass
+
+
+class BlockClock(Clock.VirtualClock):
+    """
+    A VirtualClock that only runs up to the end of the block being recorded.  A
+    sleep() that would reach the end of the block waits there, in the middle of
+    the PatternKit's play(), until the next block is asked for.
+    """
+    def __init__(self):
+        """
+        Initializes the BlockClock at time 0, with no block to run in yet.
+        """
+        super().__init__()
+        self._condition = threading.Condition()
+        self._end_ns = 0
+        # True while the PatternKit waits at the end of the block, or is done.
+        self._paused = False
+        self._done = False
+        self._stopping = False
+
+    def sleep(self, seconds: float):
+        """
+        Moves the virtual time forward, waiting at the end of the block first if
+        the sleep reaches it.
+        :param seconds: Number of seconds to move forward.
+        :return: None
+        """
+        if seconds <= 0:
+            return
+        deadline_ns = self._now_ns + round(seconds * Clock.NS_PER_SECOND)
+        with self._condition:
+            while deadline_ns >= self._end_ns or self._stopping:
+                if self._stopping:
+                    raise LayerStopped()
+                self._now_ns = self._end_ns
+                self._paused = True
+                self._condition.notify_all()
+                self._condition.wait()
+            self._now_ns = deadline_ns
+
+    def run_until(self, end_ns: int):
+        """
+        Lets the PatternKit run up to the end of the next block, and waits until it
+        gets there.
+        :param end_ns: The virtual time the block ends at.
+        :return: None
+        """
+        with self._condition:
+            self._end_ns = end_ns
+            self._paused = False
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: self._paused or self._done)
+
+    def finish(self):
+        """
+        Marks the PatternKit as done, so run_until() does not wait on it.
+        :return: None
+        """
+        with self._condition:
+            self._done = True
+            self._condition.notify_all()
+
+    def stop(self):
+        """
+        Makes the PatternKit's next sleep() raise LayerStopped.
+        :return: None
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+
+class LayerRecorder:
+    """
+    Records one Layer's PatternKit a block at a time.  The PatternKit plays on in
+    a thread of its own, paused in its sleep() between blocks, so each block
+    carries on from where the last one stopped, channels and all, instead of
+    starting play() over from all off.
+    """
+    def __init__(self, pattern_object: object):
+        """
+        Initializes the LayerRecorder.  The PatternKit is played into it from now on.
+        :param pattern_object: The PatternKit object to record.
+        """
+        self._clock = BlockClock()
+        self._lights = ShowEngine.RecordingLights(self._clock)
+        pattern_object.lights = self._lights
+        pattern_object.clock = self._clock
+        # A Scheduler of its own with no timeout, so play() is never cut short.
+        pattern_object.scheduler = Scheduler.Scheduler(self._clock)
+        # The exception play() raised, if it did.
+        self.error = None
+        self._thread = threading.Thread(target=self._run, args=(pattern_object,), daemon=True)
+        self._thread.start()
+
+    def _run(self, pattern_object: object):
+        """
+        The body of the PatternKit's thread.
+        :param pattern_object: The PatternKit object.
+        :return: None
+        """
+        try:
+            while True:
+                pattern_object.play()
+        except LayerStopped:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self._clock.finish()
+
+    def record(self, seconds: float):
+        """
+        Records the next block.
+        :param seconds: How many seconds the block lasts.
+        :return: A ShowEngine.Timeline object.
+        """
+        self._clock.run_until(self._clock.monotonic_ns() + round(seconds * Clock.NS_PER_SECOND))
+        if self.error is not None:
+            raise self.error
+        return self._lights.split()
+
+    def close(self):
+        """
+        Ends the PatternKit's thread.
+        :return: None
+        """
+        self._clock.stop()
+        self._thread.join()
+
+
+def _layers_worker(compositor: object, kit_directories: list, watch: bool, seconds: float, blocks: object):
+    """
+    The body of the layer render process.  Records every Layer's PatternKit a
+    block at a time and puts the composited blocks on a queue, which holds up
+    the process once BLOCKS_AHEAD blocks are waiting.
+    :param compositor: The Compositor.
+    :param kit_directories: The directories to find PatternKit files in.
+    :param watch: If True, PatternKit files edited while the show runs are reloaded.
+    :param seconds: How many seconds each block lasts.
+    :param blocks: The multiprocessing.Queue to put the blocks on.
+    :return: None (Never returns)
+    """
+    registry = KitRegistry.KitRegistry(kit_directories)
+    # The PatternKits are handed the LayerRecorders' RecordingLights to play into.
+    pattern_objects = KitRegistry.LazyKits(registry, ShowEngine.RecordingLights(Clock.VirtualClock()), None, None)
+    watcher = KitRegistry.KitWatcher(registry) if watch else None
+    # The LayerRecorder of each Layer, or None until its PatternKit loads.
+    recorders = [None] * len(compositor.layers)
+    while True:
+        if watcher is not None:
+            names = watcher.changes()
+            if names:
+                registry.scan()
+                names = pattern_objects.reload(names)
+                for index, layer in enumerate(compositor.layers):
+                    if layer.name in names and recorders[index] is not None:
+                        # The new code starts from its beginning.
+                        recorders[index].close()
+                        recorders[index] = None
+        timelines = []
+        for index, layer in enumerate(compositor.layers):
+            if recorders[index] is None and layer.name in pattern_objects:
+                try:
+                    recorders[index] = LayerRecorder(pattern_objects[layer.name])
+                except KitRegistry.KitLoadError:
+                    pass
+            if recorders[index] is None:
+                timelines.append(ShowEngine.Timeline([], seconds))
+            else:
+                timelines.append(recorders[index].record(seconds))
+        timeline = compositor.merge(timelines, seconds)
+        blocks.put((timeline.frames, timeline.duration))
+
+
+class LayerRenderer:
+    """
+    Renders the blocks of a Compositor in a process of its own, one block ahead
+    of the block that is playing, so the lights never wait on a render.
+    """
+    def __init__(self, compositor: object, kit_directories: list, watch: bool, seconds: float):
+        """
+        Initializes the LayerRenderer.
+        :param compositor: The Compositor.
+        :param kit_directories: The directories to find PatternKit files in.
+        :param watch: If True, PatternKit files edited while the show runs are reloaded.
+        :param seconds: How many seconds each block lasts.
+        """
+        self._blocks = multiprocessing.Queue(BLOCKS_AHEAD)
+        self._process = multiprocessing.Process(
+            target=_layers_worker, name='LayerRenderer', daemon=True,
+            args=(compositor, kit_directories, watch, seconds, self._blocks))
+
+    def start(self):
+        """
+        Starts the render process.
+        :return: None
+        """
+        self._process.start()
+
+    def next_block(self):
+        """
+        :return: The next block as a ShowEngine.Timeline object, waiting for it
+        only if the render process has fallen behind.
+        """
+        while True:
+            try:
+                frames, duration = self._blocks.get(timeout=POLL_SEC)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    raise Exception('The layer render process failed with exit code %s.' % (self._process.exitcode))
+                continue
+            return ShowEngine.Timeline(frames, duration)
+
+    def stop(self):
+        """
+        Stops the render process, killing it if it does not exit right away.
+        :return: None
+        """
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join(KitProcess.STOP_TIMEOUT_SEC)
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join()
+        self._blocks.close()
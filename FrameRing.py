@@ -0,0 +1,122 @@
+import struct
+from multiprocessing import shared_memory
+
+# The header holds two counters: how many frames have ever been pushed (head)
+# and how many have ever been popped (tail).  Only the producer writes head and
+# only the consumer writes tail, so no lock is needed between them.
+HEADER = struct.Struct('<QQ')
+
+# Each slot starts with the frame's time in nanoseconds, followed by the bytes
+# of its channel bitmask.
+TIME = struct.Struct('<q')
+
+
+class FrameRing:
+    """
+    A single-producer, single-consumer ring buffer of timestamped channel
+    frames in shared memory.  One process (or thread) pushes frames and another
+    pops them, without locks.
+    """
+    def __init__(self, capacity: int, mask_bytes: int, name: str = None):
+        """
+        Creates a new FrameRing, or attaches to an existing one.
+        :param capacity: The number of frames the ring holds.
+        :param mask_bytes: The number of bytes in each frame's channel bitmask.
+        :param name: The name of an existing FrameRing's shared memory to attach to,
+        or None to create a new one.
+        """
+        self.capacity = capacity
+        self.mask_bytes = mask_bytes
+        self._slot_size = TIME.size + mask_bytes
+        size = HEADER.size + capacity * self._slot_size
+        self._owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size)
+        self._buf = self._shm.buf
+        if self._owner:
+            HEADER.pack_into(self._buf, 0, 0, 0)
+
+    @property
+    def name(self):
+        """
+        :return: The name of the shared memory, for attaching from another process.
+        """
+        return self._shm.name
+
+    def _counters(self):
+        """
+        :return: The (head, tail) counters.
+        """
+        return HEADER.unpack_from(self._buf, 0)
+
+    def __len__(self):
+        """
+        :return: The number of frames waiting to be popped.
+        """
+        head, tail = self._counters()
+        return head - tail
+
+    def full(self):
+        """
+        :return: True if there is no room to push a frame.
+        """
+        return len(self) >= self.capacity
+
+    def push(self, time_ns: int, mask: int):
+        """
+        Adds a frame.  Only the producer calls this.
+        :param time_ns: The time of the frame in nanoseconds.
+        :param mask: The channel bitmask of the frame.
+        :return: True if the frame was added, False if the ring is full.
+        """
+        head, tail = self._counters()
+        if head - tail >= self.capacity:
+            return False
+        offset = HEADER.size + (head % self.capacity) * self._slot_size
+        TIME.pack_into(self._buf, offset, time_ns)
+        self._buf[offset + TIME.size:offset + self._slot_size] = mask.to_bytes(self.mask_bytes, 'little')
+        # The slot is written before head moves, so the consumer never sees half a frame.
+        struct.pack_into('<Q', self._buf, 0, head + 1)
+        return True
+
+    def peek(self):
+        """
+        Looks at the oldest frame without removing it.  Only the consumer calls this.
+        :return: A (time_ns, mask) tuple, or None if the ring is empty.
+        """
+        head, tail = self._counters()
+        if head == tail:
+            return None
+        offset = HEADER.size + (tail % self.capacity) * self._slot_size
+        time_ns = TIME.unpack_from(self._buf, offset)[0]
+        mask = int.from_bytes(self._buf[offset + TIME.size:offset + self._slot_size], 'little')
+        return (time_ns, mask)
+
+    def pop(self):
+        """
+        Removes the oldest frame.  Only the consumer calls this.
+        :return: A (time_ns, mask) tuple, or None if the ring is empty.
+        """
+        frame = self.peek()
+        if frame is not None:
+            tail = self._counters()[1]
+            struct.pack_into('<Q', self._buf, 8, tail + 1)
+        return frame
+
+    def clear(self):
+        """
+        Drops every waiting frame.  Only the consumer calls this.
+        :return: None
+        """
+        head = self._counters()[0]
+        struct.pack_into('<Q', self._buf, 8, head)
+
+    def close(self):
+        """
+        Detaches from the shared memory.  The FrameRing that created the shared
+        memory also frees it.
+        :return: None
+        """
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
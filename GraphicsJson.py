@@ -1,10 +1,14 @@
-import json
 import time
 
 import graphics
+import MapCache
 
 DEBUG = True
 
+# The most times per second the simulator window is repainted.  Changes that
+# come faster than this are coalesced into the next repaint.
+MAX_FPS = 30
+
 
 class GShape:
     """
@@ -39,6 +43,48 @@ class GShape:
         self._graphics_object.setOutline('black')
         self._graphics_object.setFill(self._current_color)
         self._graphics_object.draw(self._win)
+        # Group the shape by channel, and tag it by channel and color, so that a
+        # whole channel can be recolored with one itemconfig per color.
+        self._win.addToGroup(self.group(), self._graphics_object)
+        self._win.addtag_withtag(self.color_tag(), self._graphics_object.id)
+
+    def group(self):
+        """
+        :return: The name of the graphics window group (and Tk tag) of every shape
+        in this shape's channel.
+        """
+        return ChannelCollection.group(self._channel)
+
+    def color_tag(self):
+        """
+        :return: The Tk tag of every shape in this shape's channel that has the same
+        color as this shape.
+        """
+        return ChannelCollection.color_tag(self._channel, self._color)
+
+    def remember_color(self, color: str):
+        """
+        Records the fill color of this shape after it was changed on the canvas by
+        its tag.
+        :param color: The X11 name of the new color as a string.
+        :return: None
+        """
+        self._current_color = color
+        self._graphics_object.config['fill'] = color
+
+    def recolor(self, color: str):
+        """
+        Changes the fill color of the shape that is already drawn.  The canvas item
+        is kept and only its fill is changed.  The window is not updated, so a
+        whole channel can be recolored before one update.
+        :param color: The X11 name of the new color as a string.
+        :return: None
+        """
+        if color == self._current_color:
+            return
+        self.remember_color(color)
+        if self._graphics_object.canvas is not None:
+            self._win.itemconfig(self._graphics_object.id, fill=color)
 
     def on(self):
         """
@@ -46,9 +92,7 @@ class GShape:
         color this object was initialized to be.
         :return: None
         """
-        self._graphics_object.undraw()
-        self._current_color = self._color
-        self.draw()
+        self.recolor(self._color)
 
     def off(self):
         """
@@ -56,18 +100,17 @@ class GShape:
         color this object was initialized to be.
         :return: None
         """
-        self._graphics_object.undraw()
         # We do not turn off channel 0 (background stuff, etc.)
         if self._channel != 0:
-            self._current_color = ChannelCollection.GRAY
-        self.draw()
+            self.recolor(ChannelCollection.GRAY)
 
 
 class Triangle(GShape):
     """
     A shape that is an equilateral triangle that points up.
     """
-    def __init__(self, win: object, name: str, channel: int, x: int, y: int, color: str, height: int, width: int):
+    def __init__(self, win: object, name: str, channel: int, x: int, y: int, color: str, height: int, width: int,
+                 points: tuple = None):
         """
         Initializes this Triangle GShape object.
         :param win: The graphics window.
@@ -79,14 +122,14 @@ class Triangle(GShape):
         :param height: The height of this Rectangle (from the base to the vertex between the
         equal-length sides at the top.
         :param width: The width of the base of this Triangle.
+        :param points: The corners from MapCache.geometry(), worked out here if None.
         """
         super().__init__(win, name, channel, x, y, color)
         self._height = height
         self._width = width
-        bottom_left = graphics.Point(self._x, self._y + self._height)
-        top_center = graphics.Point(self._x + self._width/2, self._y)
-        bottom_right = graphics.Point(self._x + self._width, self._y + self._height)
-        self._graphics_object = graphics.Polygon(bottom_left, top_center, bottom_right)
+        if points is None:
+            points = MapCache.geometry(MapCache.TRIANGLE, x, y, (height, width))
+        self._graphics_object = graphics.Polygon(*[graphics.Point(*point) for point in points])
         if DEBUG: print('Triangle created (%s)' % (name))
 
 
@@ -94,7 +137,8 @@ class Circle(GShape):
     """
     A shape that is a circle.
     """
-    def __init__(self, win: object, name: str, channel: int, x: int, y: int, color: str, radius: int):
+    def __init__(self, win: object, name: str, channel: int, x: int, y: int, color: str, radius: int,
+                 points: tuple = None):
         """
         Initializes this Circle GShape object.
         :param win: The graphics window.
@@ -104,11 +148,13 @@ class Circle(GShape):
         :param y: The y coordinate of the top left of box containing the shape.
         :param color: The X11 name of the color as a string of the shape when it is on.
         :param radius: The radius of this Circle.
+        :param points: The center from MapCache.geometry(), worked out here if None.
         """
         super().__init__(win, name, channel, x, y, color)
         self._radius = radius
-        center_point = graphics.Point(self._x + self._radius/2, self._y + self._radius/2)
-        self._graphics_object = graphics.Circle(center_point, self._radius)
+        if points is None:
+            points = MapCache.geometry(MapCache.CIRCLE, x, y, (radius,))
+        self._graphics_object = graphics.Circle(graphics.Point(*points[0]), self._radius)
         if DEBUG: print('Circle created (%s)' % (name))
 
 
@@ -116,7 +162,8 @@ class Rectangle(GShape):
     """
     A shape that is a rectangle.
     """
-    def __init__(self, win: object, name: str, channel: int, x: int, y: int, color: str, height: int, width: int):
+    def __init__(self, win: object, name: str, channel: int, x: int, y: int, color: str, height: int, width: int,
+                 points: tuple = None):
         """
         Initializes this Rectangle GShape object.
         :param win: The graphics window.
@@ -127,13 +174,14 @@ class Rectangle(GShape):
         :param color: The X11 name of the color as a string of the shape when it is on.
         :param height: The height of this Rectangle.
         :param width: The width of this Rectangle.
+        :param points: The corners from MapCache.geometry(), worked out here if None.
         """
         super().__init__(win, name, channel, x, y, color)
         self._height = height
         self._width = width
-        top_left = graphics.Point(self._x , self._y)
-        bottom_right = graphics.Point(self._x + self._width, self._y + self._height)
-        self._graphics_object = graphics.Rectangle(top_left, bottom_right)
+        if points is None:
+            points = MapCache.geometry(MapCache.RECTANGLE, x, y, (height, width))
+        self._graphics_object = graphics.Rectangle(*[graphics.Point(*point) for point in points])
         if DEBUG: print('Rectangle created (%s)' % (name))
 
 
@@ -141,7 +189,8 @@ class Line(GShape):
     """
     A shape that is a line segment.
     """
-    def __init__(self, win: object, name: str, channel: int, x: int, y: int, color: str, x2: int, y2: int):
+    def __init__(self, win: object, name: str, channel: int, x: int, y: int, color: str, x2: int, y2: int,
+                 points: tuple = None):
         """
         Initializes this Line GShape object.
         :param win: The graphics window.
@@ -152,13 +201,14 @@ class Line(GShape):
         :param color: The X11 name of the color as a string of the shape when it is on.
         :param x2: The x coordinate of the other end of the line.
         :param y2: The y coordinate of the other end of the line.
+        :param points: The ends from MapCache.geometry(), worked out here if None.
         """
         super().__init__(win, name, channel, x, y, color)
         self._x2 = x2
         self._y2 = y2
-        point1 = graphics.Point(self._x, self._y)
-        point2 = graphics.Point(self._x2, self._y2)
-        self._graphics_object = graphics.Line(point1, point2)
+        if points is None:
+            points = MapCache.geometry(MapCache.LINE, x, y, (x2, y2))
+        self._graphics_object = graphics.Line(*[graphics.Point(*point) for point in points])
         if DEBUG: print('Line created (%s)' % (name))
 
 
@@ -169,17 +219,49 @@ class ChannelCollection:
     # The color of a GShape that is turned off.
     GRAY = "Gray41"
 
-    def __init__(self):
+    @staticmethod
+    def group(channel_number: int):
+        """
+        :param channel_number: The channel number.
+        :return: The name of the graphics window group (and Tk tag) of every GShape
+        object in the channel.
         """
-        Initializes the ChannelCollection with 17 channels.  Channel 0 is for anything
+        return 'channel%d' % (channel_number)
+
+    @staticmethod
+    def color_tag(channel_number: int, color: str):
+        """
+        :param channel_number: The channel number.
+        :param color: The X11 name of the color of the GShape objects when they are on.
+        :return: The Tk tag of every GShape object in the channel with that color.
+        """
+        return 'channel%d:%s' % (channel_number, color.replace(' ', '_'))
+
+    def __init__(self, max_fps: int = MAX_FPS):
+        """
+        Initializes an empty ChannelCollection.  Channels are added as GShape objects
+        are added, so there can be any number of them.  Channel 0 is for anything
         that does not turn off and on.  Channel 0 is always on.  There can be multiple
         GShape objects in each channel.
-        """
-        self._channels = []
-        self._iter_index = 1
-        # We will have channels 0 - 16.  0 does not blink.
-        for i in range(0, 17):
-            self._channels.append([])
+        :param max_fps: The most times per second to repaint the window.
+        """
+        # The GShape objects in each channel, keyed by channel number.
+        self._channels = {}
+        # The GShape objects in each channel keyed by their color, keyed by channel number.
+        self._colors = {}
+        # True if a channel is on, False if it is off, None if it is dimmed or
+        # unknown, keyed by channel number.
+        self._states = {}
+        # The brightness (1 to 254) of the dimmed channels, keyed by channel number.
+        self._levels = {}
+        # The (r, g, b) of every color used so far, keyed by X11 color name.
+        self._rgb = {}
+        self._iter_numbers = []
+        self._iter_index = 0
+        self._max_fps = max_fps
+        # True when shapes have been recolored since the last repaint.
+        self._dirty = False
+        self._last_repaint = 0
 
     def add(self, shape_object: object):
         """
@@ -188,7 +270,111 @@ class ChannelCollection:
         :param shape_object: The GShape object to add.
         :return: None
         """
-        self._channels[shape_object._channel].append(shape_object)
+        self._channels.setdefault(shape_object._channel, []).append(shape_object)
+        self._colors.setdefault(shape_object._channel, {}).setdefault(shape_object._color, []).append(shape_object)
+        self._states[shape_object._channel] = None
+
+    def add_group(self, channel_number: int, shapes_by_color: dict):
+        """
+        Adds the GShape objects of one channel at once, already grouped by the color
+        they have when they are on (see MapCache.compile_map()).
+        :param channel_number: The channel number.
+        :param shapes_by_color: A dictionary of lists of GShape objects keyed by color.
+        :return: None
+        """
+        shapes = self._channels.setdefault(channel_number, [])
+        colors = self._colors.setdefault(channel_number, {})
+        for color, color_shapes in shapes_by_color.items():
+            shapes.extend(color_shapes)
+            colors.setdefault(color, []).extend(color_shapes)
+        self._states[channel_number] = None
+
+    def _set(self, channel_number: int, state: bool):
+        """
+        Turns on or off every GShape object in the requested channel number with one
+        itemconfig per color in the channel.  Does nothing if the channel is already
+        in that state.
+        :param channel_number: The channel number.
+        :param state: True for on, False for off.
+        :return: None
+        """
+        shapes = self._channels.get(channel_number)
+        if not shapes or self._states[channel_number] == state:
+            return
+        # We do not turn off channel 0 (background stuff, etc.)
+        if channel_number == 0 and not state:
+            return
+        self._states[channel_number] = state
+        self._levels.pop(channel_number, None)
+        win = shapes[0]._win
+        if state:
+            for color, color_shapes in self._colors[channel_number].items():
+                win.itemconfig(self.color_tag(channel_number, color), fill=color)
+                for a_shape in color_shapes:
+                    a_shape.remember_color(color)
+        else:
+            win.itemconfig(self.group(channel_number), fill=self.GRAY)
+            for a_shape in shapes:
+                a_shape.remember_color(self.GRAY)
+        self._dirty = True
+
+    def add_rgb(self, color: str, rgb: tuple):
+        """
+        Remembers the (r, g, b) of a color, so that blend() does not have to ask Tk.
+        :param color: The X11 name of the color.
+        :param rgb: The (r, g, b) of the color as Tk gives it, with 16 bits per component.
+        :return: None
+        """
+        self._rgb[color] = tuple(c >> 8 for c in rgb)
+
+    def blend(self, color: str, level: int):
+        """
+        Mixes a color with GRAY, to show a dimmed channel.
+        :param color: The X11 name of the color when the channel is on.
+        :param level: The brightness from 0 (GRAY) to 255 (color).
+        :return: The mixed color as a "#rrggbb" string.
+        """
+        for name in (color, self.GRAY):
+            if name not in self._rgb:
+                self.add_rgb(name, graphics._root.winfo_rgb(name))
+        on, off = self._rgb[color], self._rgb[self.GRAY]
+        return '#%02x%02x%02x' % tuple((a * level + b * (255 - level)) // 255 for a, b in zip(on, off))
+
+    def _set_level(self, channel_number: int, level: int):
+        """
+        Dims every GShape object in the requested channel number by blending its
+        color toward GRAY, with one itemconfig per color in the channel.
+        :param channel_number: The channel number.
+        :param level: The brightness from 0 (off) to 255 (on).
+        :return: None
+        """
+        if level <= 0 or level >= 255:
+            self._set(channel_number, level >= 255)
+            return
+        shapes = self._channels.get(channel_number)
+        # Channel 0 is always on.
+        if not shapes or channel_number == 0 or self._levels.get(channel_number) == level:
+            return
+        self._states[channel_number] = None
+        self._levels[channel_number] = level
+        win = shapes[0]._win
+        for color, color_shapes in self._colors[channel_number].items():
+            fill = self.blend(color, level)
+            win.itemconfig(self.color_tag(channel_number, color), fill=fill)
+            for a_shape in color_shapes:
+                a_shape.remember_color(fill)
+        self._dirty = True
+
+    def apply_levels(self, levels: dict):
+        """
+        Dims every GShape object in several channels, then repaints the window at
+        most once.
+        :param levels: A dictionary of channel number to brightness (0 to 255).
+        :return: None
+        """
+        for channel_number, level in levels.items():
+            self._set_level(channel_number, level)
+        self._changed()
 
     def on(self, channel_number: int):
         """
@@ -196,8 +382,8 @@ class ChannelCollection:
         :param channel_number: The channel number to turn on.
         :return: None
         """
-        for a_shape in self._channels[channel_number]:
-            a_shape.on()
+        self._set(channel_number, True)
+        self._changed()
 
     def off(self, channel_number: int):
         """
@@ -205,8 +391,40 @@ class ChannelCollection:
         :param channel_number: The channel number to turn off.
         :return: None
         """
-        for a_shape in self._channels[channel_number]:
-            a_shape.off()
+        self._set(channel_number, False)
+        self._changed()
+
+    def apply(self, states: dict):
+        """
+        Turns on or off every GShape object in several channels, then repaints the
+        window at most once.
+        :param states: A dictionary of channel number to True (on) or False (off).
+        :return: None
+        """
+        for channel_number, state in states.items():
+            self._set(channel_number, state)
+        self._changed()
+
+    def _changed(self):
+        """
+        Repaints the window right away if anything changed and the last repaint was
+        at least one frame ago.  Otherwise the change waits for the next repaint.
+        :return: None
+        """
+        if self._dirty and time.time() - self._last_repaint >= 1 / self._max_fps:
+            self.flush()
+
+    def flush(self):
+        """
+        Repaints the window if anything changed since the last repaint.  Waits first
+        if needed so the window is never repainted more than max_fps times per second.
+        :return: None
+        """
+        if not self._dirty:
+            return
+        graphics.update(self._max_fps)
+        self._dirty = False
+        self._last_repaint = time.time()
 
     def __iter__(self):
         """
@@ -215,7 +433,8 @@ class ChannelCollection:
         a nested for loop where both for loops are iterating over this object.
         :return: A reference to this iterable object.
         """
-        self._iter_index = 1
+        self._iter_numbers = self.channel_numbers()
+        self._iter_index = 0
         return self
 
     def __next__(self):
@@ -225,10 +444,27 @@ class ChannelCollection:
         (One channel in the ChannelCollection contains a list of GShape objects that should
         all turn on or off when a channel is turned on or off.)
         """
-        list = self._channels[self._iter_index]
+        if self._iter_index >= len(self._iter_numbers):
+            raise StopIteration
+        list = self._channels[self._iter_numbers[self._iter_index]]
         self._iter_index += 1
         return list
 
+    def channel_numbers(self):
+        """
+        :return: A sorted list of the channel numbers that turn on and off (every
+        channel with a GShape object except channel 0).
+        """
+        return sorted(num for num in self._channels.keys() if num != 0)
+
+
+# The GShape class for each kind of shape in a compiled map.
+SHAPE_CLASSES = {
+    MapCache.TRIANGLE: Triangle,
+    MapCache.CIRCLE: Circle,
+    MapCache.RECTANGLE: Rectangle,
+    MapCache.LINE: Line,
+}
 
 
 class GraphicsJson:
@@ -241,22 +477,25 @@ class GraphicsJson:
         :param filename: The filename of the JSON file to read in.
         :param channel_collection: The ChannelCollection object to populate.
         """
-        json_file = open(filename, 'r')
-        self._json_data = json.load(json_file)
-        json_file.close()
-        self._width = self._json_data["window_width"]
-        self._height = self._json_data["window_height"]
-        self._win = graphics.GraphWin("Map", self._width, self._height)
-        self._win.setBackground(self._json_data['bg_color'])
+        # Colors are checked against Tk when the map is compiled.
+        self._map = MapCache.load(filename, graphics._root.winfo_rgb)
+        self._width = self._map["window_width"]
+        self._height = self._map["window_height"]
+        # Nothing is drawn until the ChannelCollection repaints the window.
+        self._win = graphics.GraphWin("Map", self._width, self._height, autoflush=False)
+        self._win.setBackground(self._map['bg_color'])
         self._channel_collection = channel_collection
-        if DEBUG: print(f'Using Map: { self._json_data["name"] }')
-        channels = self._json_data['channels']
-        for one_channel in channels:
-            # Create a GShape based on the dictionary for this one "channel".
-            shape = self.shape_factory(one_channel)
-            self._channel_collection.add(shape)
+        if DEBUG: print(f'Using Map: { self._map["name"] }')
+        # Create a GShape based on the compiled entry for each one "channel".
+        shapes = [self.build_shape(entry) for entry in self._map['entries']]
+        for channel, colors in self._map['channels'].items():
+            self._channel_collection.add_group(
+                channel, {color: [shapes[index] for index in indexes] for color, indexes in colors.items()})
+        # Drawn in the order of the map, so later shapes are on top.
+        for shape in shapes:
             shape.draw()
         self._channel_collection.on(0)
+        self._channel_collection.flush()
 
     def __del__(self):
         """
@@ -272,6 +511,18 @@ class GraphicsJson:
         """
         self._win.close()
 
+    def build_shape(self, entry: tuple):
+        """
+        Creates a GShape object from a compiled map entry.
+        :param entry: A compiled entry from MapCache.compile_entry().
+        :return: A GShape object.
+        """
+        kind, name, channel, x, y, color, rgb, extra, points = entry
+        if rgb is not None:
+            # The color was already looked up when the map was compiled.
+            self._channel_collection.add_rgb(color, rgb)
+        return SHAPE_CLASSES[kind](self._win, name, channel, x, y, color, *extra, points=points)
+
     def shape_factory(self, channel_entry: dict):
         """
         Takes in a dictionary member from the "channels" array in the JSON file and
@@ -279,38 +530,14 @@ class GraphicsJson:
         :param channel_entry: A dictionary member from the "channels" array in the JSON file.
         :return: A GShape object based on the input JSON data.
         """
-        name = channel_entry['name']
-        channel = channel_entry['channel']
-        if channel > 16:
-            channel = 0
-        elif channel < 0:
-            channel = 0
-        shape = channel_entry['shape']
-        x = channel_entry['x']
-        y = channel_entry['y']
-        color = channel_entry['color']
-        if shape.lower() == 'triangle':
-            height = channel_entry['height']
-            width = channel_entry['width']
-            return Triangle(self._win, name, channel, x, y, color, height, width)
-        elif shape.lower() == 'circle':
-            radius = channel_entry['radius']
-            return Circle(self._win, name, channel, x, y, color, radius)
-        elif shape.lower() == 'rectangle':
-            height = channel_entry['height']
-            width = channel_entry['width']
-            return Rectangle(self._win, name, channel, x, y, color, height, width)
-        elif shape.lower() == 'line':
-            x2 = channel_entry['x2']
-            y2 = channel_entry['y2']
-            return Line(self._win, name, channel, x, y, color, x2, y2)
+        return self.build_shape(MapCache.compile_entry(channel_entry))
 
     def all_on(self):
         """
         Turns on all of the channels in the ChannelCollection.
         :return: None
         """
-        for i in range(1, 17):
+        for i in self._channel_collection.channel_numbers():
             self._channel_collection.on(i)
 
     def all_off(self):
@@ -318,7 +545,7 @@ class GraphicsJson:
         Turns off all of the channels in the ChannelCollection.
         :return: None
         """
-        for i in range(1, 17):
+        for i in self._channel_collection.channel_numbers():
             self._channel_collection.off(i)
 
 
@@ -326,12 +553,14 @@ if __name__ == '__main__':
     # Tests GraphicsJson without using any of the rest of the ChristmasLights code.
     channel_collection = ChannelCollection()
     graphics_json = GraphicsJson('MapData.json', channel_collection)
-    for i in range(1, 17):
-        for j in range(1, 17):
+    for i in channel_collection.channel_numbers():
+        for j in channel_collection.channel_numbers():
             if i == j:
                 channel_collection.on(j)
             else:
                 channel_collection.off(j)
+        channel_collection.flush()
         time.sleep(.5)
     graphics_json.all_off()
+    channel_collection.flush()
     graphics_json._win.getMouse()
@@ -0,0 +1,154 @@
+import os
+import sys
+
+import Clock
+
+# Set this environment variable to "headless" to use this module instead of
+# Simulator.py when gpiozero is not available.
+SIMULATOR_ENV = 'CHRISTMAS_LIGHTS_SIMULATOR'
+
+HEADLESS = 'headless'
+
+# The one VirtualClock shared by the headless LED objects and the PatternDriver.
+CLOCK = Clock.VirtualClock()
+
+
+class Recording:
+    """
+    Records every channel transition with the virtual time it happened at.
+    """
+    def __init__(self, clock: object):
+        """
+        Initializes an empty Recording.
+        :param clock: The clock to time stamp the transitions with.
+        """
+        self._clock = clock
+        # A list of (time_ns, channel number, state) tuples in the order they happened.
+        self.transitions = []
+        # The current state of each channel, keyed by channel number.
+        self.states = {}
+        # A list of (time_ns, channel number, level) tuples for every time a channel
+        # was dimmed, in the order they happened.
+        self.levels = []
+
+    def set(self, num: int, state: bool):
+        """
+        Records one channel turning on or off.  Nothing is recorded if the channel
+        is already in that state.
+        :param num: The channel number.
+        :param state: True for on, False for off.
+        :return: None
+        """
+        if self.states.get(num) == state:
+            return
+        self.states[num] = state
+        self.transitions.append((self._clock.monotonic_ns(), num, state))
+
+    def set_level(self, num: int, level: int):
+        """
+        Records one channel being dimmed.  The channel counts as on.
+        :param num: The channel number.
+        :param level: The brightness from 0 to 255.
+        :return: None
+        """
+        self.set(num, level > 0)
+        self.levels.append((self._clock.monotonic_ns(), num, level))
+
+    def clear(self):
+        """
+        Forgets every transition recorded so far.
+        :return: None
+        """
+        self.transitions = []
+        self.states = {}
+        self.levels = []
+
+    def summary(self):
+        """
+        :return: A string with the number of times each channel turned on, one
+        channel per line.
+        """
+        counts = {}
+        for time_ns, num, state in self.transitions:
+            counts.setdefault(num, 0)
+            if state:
+                counts[num] += 1
+        lines = []
+        for num in sorted(counts.keys()):
+            lines.append('channel %d turned on %d times' % (num, counts[num]))
+        return '\n'.join(lines)
+
+
+# The one Recording shared by all of the headless LED objects.
+RECORDING = Recording(CLOCK)
+
+
+def use_headless():
+    """
+    :return: True if the environment asks for the headless simulator.
+    """
+    return os.environ.get(SIMULATOR_ENV, '').lower() == HEADLESS
+
+
+class LED:
+    """
+    A bogus LED class with the same name and interface as the LED class from the
+    gpiozero module.  Instead of drawing anything, it records the channel's
+    transitions in RECORDING.
+    """
+    def __init__(self, num: int):
+        """
+        Initializes this instance of the LED class.
+        :param num: The channel number that this LED object will control.
+        """
+        self._num = num
+
+    def on(self):
+        """
+        Records that the channel associated with this LED object turned on.
+        :return: None
+        """
+        RECORDING.set(self._num, True)
+
+    def off(self):
+        """
+        Records that the channel associated with this LED object turned off.
+        :return: None
+        """
+        RECORDING.set(self._num, False)
+
+    @staticmethod
+    def apply_frame(changes: list):
+        """
+        Records several LED objects turning on or off at once.
+        :param changes: A list of (LED object, state) tuples, where state is True
+        for on and False for off.
+        :return: None
+        """
+        for led, state in changes:
+            RECORDING.set(led._num, state)
+
+    @staticmethod
+    def apply_levels(changes: list):
+        """
+        Records several LED objects being dimmed at once.
+        :param changes: A list of (LED object, level) tuples, where level is the
+        brightness from 0 to 255.
+        :return: None
+        """
+        for led, level in changes:
+            RECORDING.set_level(led._num, level)
+
+
+if __name__ == '__main__':
+    # Plays every PatternKit once for the number of virtual seconds given on the
+    # command line (default one hour each) and prints what every channel did.
+    os.environ[SIMULATOR_ENV] = HEADLESS
+    import HeadlessSimulator
+    import PatternDriver
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3600
+    pattern_driver = PatternDriver.PatternDriver()
+    pattern_driver.run(timeout_sec=seconds, cycles=1)
+    print('%.1f virtual seconds, %d transitions' % (
+        HeadlessSimulator.CLOCK.now(), len(HeadlessSimulator.RECORDING.transitions)))
+    print(HeadlessSimulator.RECORDING.summary())
@@ -0,0 +1,374 @@
+import importlib
+import multiprocessing
+import sys
+import time
+
+import Clock
+import FrameRing
+import Lights
+import Pattern
+import PatternDriver
+import Scheduler
+
+# How many frames a PatternKit process can render ahead of the lights.
+RING_CAPACITY = 256
+
+# How long a PatternKit process can go without sending a frame the lights need
+# before it is killed and restarted.
+STALL_SEC = 2
+
+# How long to wait for a PatternKit process to exit before killing it.
+STOP_TIMEOUT_SEC = .5
+
+# How long the driver waits between looks at an empty FrameRing.
+POLL_SEC = .001
+
+
+class RingLights:
+    """
+    A stand-in for the Lights object inside a PatternKit process.  Every frame the
+    PatternKit finishes is pushed into a FrameRing, time stamped with the process's
+    VirtualClock.
+    """
+    def __init__(self, ring: object, clock: object, channel_numbers: list):
+        """
+        Initializes the RingLights object.
+        :param ring: The FrameRing to push frames into.
+        :param clock: The VirtualClock the PatternKit runs on.
+        :param channel_numbers: The channel numbers of the real Lights object.
+        """
+        self._ring = ring
+        self._clock = clock
+        self._channel = {}
+        for i in channel_numbers:
+            self._channel[i] = RingChannel(self, i)
+        self._mask = 0
+        # The frame the PatternKit is building, pushed when it sleeps.
+        self._pending = True
+
+    def channel(self, num: int):
+        """
+        Returns a reference to the requested channel.
+        :param num: The number of the channel to return.
+        :return: A RingChannel object.
+        """
+        return self._channel[num]
+
+    def set_frame(self, mask: int):
+        """
+        Turns every channel on or off to match a bitmask.
+        :param mask: A bitmask of the channels that should be on.
+        :return: None
+        """
+        if mask != self._mask:
+            self._mask = mask
+            self._pending = True
+
+    def apply(self, states: dict):
+        """
+        Turns some of the channels on or off.
+        :param states: A dictionary of channel number to True (on) or False (off).
+        :return: None
+        """
+        mask = self._mask
+        for num, state in states.items():
+            if state:
+                mask |= Lights.channel_bit(num)
+            else:
+                mask &= ~Lights.channel_bit(num)
+        self.set_frame(mask)
+
+    def reset(self):
+        """
+        Turns off all of the channels.
+        :return: None
+        """
+        self.set_frame(0)
+
+    def flush(self):
+        """
+        Pushes the finished frame into the FrameRing.  Called by the Scheduler just
+        before the PatternKit sleeps.  Waits while the FrameRing is full, which is
+        what keeps the PatternKit from rendering too far ahead.
+        :return: None
+        """
+        if not self._pending:
+            return
+        while not self._ring.push(self._clock.monotonic_ns(), self._mask):
+            time.sleep(POLL_SEC)
+        self._pending = False
+
+
+class RingChannel:
+    """
+    One channel of the RingLights object.
+    """
+    def __init__(self, lights: object, num: int):
+        """
+        Initializes this RingChannel.
+        :param lights: The RingLights object that owns this channel.
+        :param num: The channel number.
+        """
+        self._lights = lights
+        self._num = num
+
+    def on(self):
+        """
+        Turns on this channel.
+        :return: None
+        """
+        self._lights.apply({self._num: True})
+
+    def off(self):
+        """
+        Turns off this channel.
+        :return: None
+        """
+        self._lights.apply({self._num: False})
+
+
+def setup_worker(ring_name: str, capacity: int, mask_bytes: int, channel_numbers: list,
+                 lights_class: object = None, *lights_args):
+    """
+    Sets up the inside of a process that renders PatternKits.  Attaches to the
+    FrameRing and creates the VirtualClock, the RingLights object and the
+    Scheduler the PatternKits play on.
+    :param ring_name: The name of the FrameRing's shared memory.
+    :param capacity: The number of frames the FrameRing holds.
+    :param mask_bytes: The number of bytes in each frame's channel bitmask.
+    :param channel_numbers: The channel numbers of the real Lights object.
+    :param lights_class: The RingLights class (or subclass) to create.  RingLights if None.
+    :param lights_args: More arguments for the lights_class, after the channel numbers.
+    :return: A tuple of (lights, clock, scheduler).
+    """
+    if lights_class is None:
+        lights_class = RingLights
+    ring = FrameRing.FrameRing(capacity, mask_bytes, ring_name)
+    clock = Clock.VirtualClock()
+    lights = lights_class(ring, clock, channel_numbers, *lights_args)
+    scheduler = Scheduler.Scheduler(clock)
+    scheduler.add_idle_callback(lights.flush)
+    return lights, clock, scheduler
+
+
+def _worker(directory: str, module_name: str, ring_name: str, capacity: int, mask_bytes: int, channel_numbers: list):
+    """
+    The body of a PatternKit process.  Imports the PatternKit and plays it on a
+    VirtualClock forever, pushing its frames into the FrameRing.  The driver
+    kills the process when the PatternKit's turn is over.
+    :param directory: The directory the PatternKit module is in.
+    :param module_name: The name of the PatternKit module.
+    :param ring_name: The name of the FrameRing's shared memory.
+    :param capacity: The number of frames the FrameRing holds.
+    :param mask_bytes: The number of bytes in each frame's channel bitmask.
+    :param channel_numbers: The channel numbers of the real Lights object.
+    :return: None
+    """
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    lights, clock, scheduler = setup_worker(ring_name, capacity, mask_bytes, channel_numbers)
+    pattern_kit = importlib.import_module(module_name)
+    pattern_object = Pattern.create_pattern_kit(pattern_kit, lights, clock, scheduler)
+    while True:
+        pattern_object.play()
+        # A PatternKit that finishes a play() without sleeping still has a frame.
+        lights.flush()
+
+
+class KitProcess:
+    """
+    Runs one PatternKit in a process of its own.  The process renders frames
+    ahead of time into a FrameRing, and the driver that owns the Lights plays
+    them and can kill the process at any time.
+    """
+    def __init__(self, module_name: str, directory: str, channel_numbers: list, capacity: int = RING_CAPACITY):
+        """
+        Initializes the KitProcess.  The process is not started yet.
+        :param module_name: The name of the PatternKit module.
+        :param directory: The directory the PatternKit module is in.
+        :param channel_numbers: The channel numbers of the Lights object.
+        :param capacity: The number of frames the process can render ahead.
+        """
+        self.name = module_name
+        self._directory = directory
+        self._channel_numbers = list(channel_numbers)
+        self._capacity = capacity
+        self._mask_bytes = (max(self._channel_numbers, default=1) + 7) // 8
+        self._process = None
+        self.ring = None
+
+    def start(self):
+        """
+        Starts the process with an empty FrameRing.
+        :return: None
+        """
+        self.stop()
+        self.ring = FrameRing.FrameRing(self._capacity, self._mask_bytes)
+        self._process = multiprocessing.Process(
+            target=_worker, name=self.name, daemon=True,
+            args=(self._directory, self.name, self.ring.name, self._capacity, self._mask_bytes, self._channel_numbers))
+        self._process.start()
+
+    def is_alive(self):
+        """
+        :return: True if the process is running.
+        """
+        return self._process is not None and self._process.is_alive()
+
+    def stop(self):
+        """
+        Stops the process, killing it if it does not exit right away, and frees the
+        FrameRing.
+        :return: None
+        """
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(STOP_TIMEOUT_SEC)
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join()
+            self._process = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+class ProcessPatternDriver(PatternDriver.PatternDriver):
+    """
+    A PatternDriver that runs every PatternKit in a process of its own.  The
+    driver owns the Lights and plays the frames the process sends at their
+    deadlines.  A PatternKit that hangs, crashes or stops sending frames is
+    killed and restarted, and every PatternKit is killed exactly at the end of
+    its turn.
+    """
+    def __init__(self, clock: object = None, stall_sec: float = STALL_SEC):
+        """
+        Sets up the ProcessPatternDriver the same way as the PatternDriver, except
+        that the PatternKits are not imported into this process.
+        :param clock: The Clock object to run the show on.
+        :param stall_sec: How long a PatternKit can go without sending a needed
+        frame before it is restarted.
+        """
+        self.stall_sec = stall_sec
+        # The number of times each PatternKit was restarted, keyed by PatternKit name.
+        self.restarts = {}
+        super().__init__(clock)
+
+    def load_pattern_kits(self):
+        """
+        Creates a KitProcess for each PatternKit in the registry.  Nothing is
+        imported until the KitProcess starts.
+        :return: None
+        """
+        for entry in self.registry.entries():
+            self.pattern_objects[entry.name] = KitProcess(entry.name, entry.directory, self.lights.channel_numbers)
+
+    def reload_kits(self):
+        """
+        Creates and drops KitProcess objects for the PatternKit files that were
+        added or removed since the last call.  An edited PatternKit needs nothing
+        more, because its process imports it afresh every time it starts.
+        :return: A set of the names of the PatternKits that were added or removed.
+        """
+        if self.watcher is None:
+            return set()
+        names = self.watcher.changes()
+        if not names:
+            return set()
+        self.registry.scan()
+        changed = set()
+        for name in names:
+            if name in self.registry.names():
+                if name not in self.pattern_objects:
+                    entry = self.registry.entry(name)
+                    self.pattern_objects[name] = KitProcess(name, entry.directory, self.lights.channel_numbers)
+                    changed.add(name)
+            elif self.pattern_objects.pop(name, None) is not None:
+                changed.add(name)
+        return changed
+
+    def play_kit(self, kit_process: object, timeout_sec: float):
+        """
+        Plays one PatternKit's frames until its turn is over, restarting its process
+        when it dies or stalls.
+        :param kit_process: The KitProcess to play.
+        :param timeout_sec: Number of seconds the PatternKit's turn lasts.
+        :return: None
+        """
+        start_ns = self.scheduler.now_ns()
+        end_ns = start_ns + int(timeout_sec * Scheduler.NS_PER_SECOND)
+        # The watchdog runs on wall time, so a stalled PatternKit is caught the same
+        # way whether the show runs on a real, accelerated or virtual clock.
+        stall_ns = int(self.stall_sec * Scheduler.NS_PER_SECOND)
+        kit_process.start()
+        last_frame_ns = time.monotonic_ns()
+        # The show time of the last frame, so a stall takes at least stall_sec of
+        # show time even on a VirtualClock, which only moves when slept on.
+        last_show_ns = start_ns
+        # The first frame after the process (re)starts sets when the PatternKit's
+        # time 0 is, so the time the process takes to start is not counted as lateness.
+        first_frame = True
+        try:
+            while True:
+                now_ns = self.scheduler.now_ns()
+                if now_ns >= end_ns:
+                    return
+                frame = kit_process.ring.pop()
+                if frame is None:
+                    if not kit_process.is_alive() or time.monotonic_ns() - last_frame_ns > stall_ns:
+                        # Restart the PatternKit from its beginning, after holding the
+                        # last frame for stall_sec.
+                        self.restarts[kit_process.name] = self.restarts.get(kit_process.name, 0) + 1
+                        kit_process.start()
+                        last_show_ns = start_ns = min(end_ns, max(now_ns, last_show_ns + stall_ns))
+                        self.scheduler.sleep_until(start_ns)
+                        last_frame_ns = time.monotonic_ns()
+                        first_frame = True
+                    else:
+                        time.sleep(POLL_SEC)
+                    continue
+                last_frame_ns = time.monotonic_ns()
+                time_ns, mask = frame
+                if first_frame:
+                    start_ns = max(start_ns, now_ns - time_ns)
+                    first_frame = False
+                deadline_ns = start_ns + time_ns
+                if deadline_ns >= end_ns:
+                    self.scheduler.sleep_until(end_ns)
+                    return
+                self.scheduler.sleep_until(deadline_ns)
+                self.lights.set_frame(mask)
+                last_show_ns = deadline_ns
+        finally:
+            kit_process.stop()
+
+    def run(self, timeout_sec: int = PatternDriver.FIVE_MINUTES_IN_SECONDS, cycles: int = None):
+        """
+        Loops forever, running each of the PatternKits in its own process for
+        timeout_sec seconds each.
+        :param timeout_sec: Number of seconds to run a PatternKit before
+        starting another PatternKit
+        :param cycles: Number of times to run through all of the PatternKits, or
+        None to loop forever.
+        :return: None (Never returns unless cycles is given)
+        """
+        cycle = 0
+        while cycles is None or cycle < cycles:
+            cycle += 1
+            for name in list(self.pattern_objects.keys()):
+                self.reload_kits()
+                if name not in self.pattern_objects:
+                    # Its file was removed.
+                    continue
+                self.play_turn(name, timeout_sec)
+
+    def play_turn(self, name: str, timeout_sec: float):
+        """
+        Runs one PatternKit in its own process for timeout_sec seconds.
+        :param name: The name of the PatternKit module.
+        :param timeout_sec: Number of seconds the PatternKit's turn lasts.
+        :return: None
+        """
+        self.lights.reset()
+        self.scheduler.stats = self.lateness_stats(name)
+        self.play_kit(self.pattern_objects[name], timeout_sec)
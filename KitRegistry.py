@@ -0,0 +1,463 @@
+import ast
+import collections.abc
+import importlib
+import importlib.util
+import os
+import pickle
+import sys
+import time
+
+import Pattern
+
+try:
+    # inotify_simple is not part of the standard library.  Without it (or off
+    # Linux) the KitWatcher polls the modification times instead.
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+# A PatternKit file has this in its name and a class of this name in it.
+PATTERN_KIT = 'PatternKit'
+
+# Set this environment variable to the directories to find PatternKit files in,
+# separated like PATH.  The directory of this file if it is not set.
+KITS_ENV = 'CHRISTMAS_LIGHTS_KITS'
+
+# Bump this whenever the layout of the index changes, so old index files are
+# rebuilt instead of misread.
+INDEX_VERSION = 1
+
+# The index of each directory is kept in it under this name.
+INDEX_FILENAME = '.PatternKits.index.cache'
+
+# How often a KitWatcher without inotify looks at the modification times, in seconds.
+POLL_SEC = 1
+
+
+class KitLoadError(Exception):
+    """
+    Raised by LazyKits when a PatternKit module fails to import or to create its
+    PatternKit object.  The show skips the PatternKit's turn and carries on.
+    """
+    pass
+
+
+def default_directories():
+    """
+    :return: A list of the directories named by the KITS_ENV environment variable,
+    or the directory of this file if it is not set.
+    """
+    directories = os.environ.get(KITS_ENV, '')
+    if directories:
+        return [directory for directory in directories.split(os.pathsep) if directory]
+    return [os.path.dirname(os.path.abspath(__file__))]
+
+
+class KitEntry:
+    """
+    What the index knows about one PatternKit file, found without importing it.
+    """
+    def __init__(self, name: str, path: str, mtime_ns: int, size: int):
+        """
+        Initializes the KitEntry.  parse() fills in the rest.
+        :param name: The module name.
+        :param path: The absolute filename of the module.
+        :param mtime_ns: The modification time of the file when it was parsed.
+        :param size: The size of the file when it was parsed.
+        """
+        self.name = name
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        # True if the file has a PatternKit class in it.
+        self.is_kit = False
+        # The name the PatternKit passes to Pattern.__init__(), if it is a literal.
+        self.title = None
+        # The docstring of the PatternKit class, or of the module if the class has none.
+        self.doc = None
+        # The UPPER_CASE constants of the module and the literal class attributes of
+        # the PatternKit class (which win), e.g. audio_filename for a MusicPattern.
+        self.metadata = {}
+        # Why the file could not be parsed, or None.
+        self.error = None
+
+    @property
+    def directory(self):
+        """
+        :return: The directory the module is in.
+        """
+        return os.path.dirname(self.path)
+
+    def parse(self):
+        """
+        Reads the file's metadata from its syntax tree.  Nothing in the file is run.
+        :return: None
+        """
+        try:
+            with open(self.path, 'rb') as kit_file:
+                tree = ast.parse(kit_file.read(), self.path)
+        except (OSError, SyntaxError, ValueError) as e:
+            self.error = str(e)
+            return
+        self.doc = ast.get_docstring(tree)
+        for node in tree.body:
+            if isinstance(node, ast.Assign):
+                self._add_constants(node, upper_only=True)
+            elif isinstance(node, ast.ClassDef) and node.name == PATTERN_KIT:
+                self.is_kit = True
+                self.doc = ast.get_docstring(node) or self.doc
+                for class_node in node.body:
+                    if isinstance(class_node, ast.Assign):
+                        self._add_constants(class_node, upper_only=False)
+                    elif isinstance(class_node, ast.FunctionDef) and class_node.name == '__init__':
+                        self.title = self._find_title(class_node)
+
+    def _add_constants(self, node: object, upper_only: bool):
+        """
+        Adds the names an assignment sets to a literal value to the metadata.
+        :param node: An ast.Assign node.
+        :param upper_only: True to only add UPPER_CASE names.
+        :return: None
+        """
+        try:
+            value = ast.literal_eval(node.value)
+        except ValueError:
+            return
+        for target in node.targets:
+            if isinstance(target, ast.Name) and (target.id.isupper() or not upper_only):
+                self.metadata[target.id] = value
+
+    @staticmethod
+    def _find_title(function: object):
+        """
+        :param function: The ast.FunctionDef of the PatternKit's __init__().
+        :return: The first argument of a super().__init__() call in it if it is a
+        string literal, otherwise None.
+        """
+        for node in ast.walk(function):
+            if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == '__init__'
+                    and isinstance(node.func.value, ast.Call) and isinstance(node.func.value.func, ast.Name)
+                    and node.func.value.func.id == 'super' and node.args
+                    and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+                return node.args[0].value
+        return None
+
+
+class KitRegistry:
+    """
+    Finds the PatternKit files in a list of directories and indexes them without
+    importing them.  Each directory's index is cached in INDEX_FILENAME, so only
+    files that changed since the last scan are parsed again, and a kit is only
+    imported by load_module() when it is about to play.
+    """
+    def __init__(self, directories: list = None):
+        """
+        Initializes the KitRegistry and scans its directories.
+        :param directories: A list of directories to find PatternKit files in.  The
+        first directory wins when two have a module of the same name.  See
+        default_directories() if None.
+        """
+        if directories is None:
+            directories = default_directories()
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        # KitEntry objects of the PatternKits, keyed by module name, in order.
+        self._entries = {}
+        # KitEntry objects of the files that could not be parsed, keyed by module name.
+        self.errors = {}
+        self.scan()
+
+    def scan(self):
+        """
+        Looks for new, changed and removed PatternKit files in the directories.
+        :return: None
+        """
+        entries = {}
+        errors = {}
+        for directory in self.directories:
+            for entry in self._scan_directory(directory):
+                if entry.name in entries or entry.name in errors:
+                    continue
+                if entry.error is not None:
+                    errors[entry.name] = entry
+                    # A kit that was fine until an edit broke it keeps its old entry,
+                    # so it stays in the show with its old code.
+                    if entry.name in self._entries:
+                        entries[entry.name] = self._entries[entry.name]
+                elif entry.is_kit:
+                    entries[entry.name] = entry
+        self._entries = entries
+        self.errors = errors
+
+    @staticmethod
+    def _scan_directory(directory: str):
+        """
+        Indexes the PatternKit files in one directory, reusing the entries of its
+        index file for the files whose size and modification time have not changed.
+        :param directory: The absolute name of the directory.
+        :return: A list of KitEntry objects, sorted by name.
+        """
+        index_name = os.path.join(directory, INDEX_FILENAME)
+        cached = {}
+        try:
+            with open(index_name, 'rb') as index_file:
+                index = pickle.load(index_file)
+            if index.get('version') == INDEX_VERSION:
+                cached = index['entries']
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, KeyError):
+            # A missing or damaged index is just rebuilt.
+            pass
+        try:
+            items = [item for item in os.scandir(directory)
+                     if item.name.endswith('.py') and PATTERN_KIT in item.name and item.is_file()]
+        except OSError:
+            return []
+        entries = {}
+        changed = len(cached) != len(items)
+        for item in items:
+            stat = item.stat()
+            entry = cached.get(item.name)
+            if entry is None or entry.mtime_ns != stat.st_mtime_ns or entry.size != stat.st_size:
+                entry = KitEntry(os.path.splitext(item.name)[0], item.path, stat.st_mtime_ns, stat.st_size)
+                entry.parse()
+                changed = True
+            entries[item.name] = entry
+        if changed:
+            temp_name = index_name + '.tmp'
+            try:
+                with open(temp_name, 'wb') as index_file:
+                    pickle.dump({'version': INDEX_VERSION, 'entries': entries}, index_file,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_name, index_name)
+            except OSError:
+                # A read-only directory just means no index.
+                pass
+        return sorted(entries.values(), key=lambda entry: entry.name)
+
+    def names(self):
+        """
+        :return: A list of the PatternKit module names, in the order they play.
+        """
+        return list(self._entries.keys())
+
+    def entry(self, name: str):
+        """
+        :param name: The name of a PatternKit module.
+        :return: Its KitEntry.
+        """
+        if name not in self._entries:
+            raise Exception('No PatternKit named "%s" in %s.' % (name, os.pathsep.join(self.directories)))
+        return self._entries[name]
+
+    def entries(self):
+        """
+        :return: A list of the KitEntry objects of the PatternKits, in the order they play.
+        """
+        return list(self._entries.values())
+
+    def load_module(self, name: str):
+        """
+        Imports a PatternKit module, if it has not been imported already.
+        :param name: The name of the PatternKit module.
+        :return: The module.
+        """
+        directory = self.entry(name).directory
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+        return importlib.import_module(name)
+
+    def reload_module(self, name: str):
+        """
+        Imports a fresh copy of a PatternKit module from its file.  The module in
+        sys.modules is only replaced once the new copy has run without an error,
+        so a broken edit leaves the old module (and its PatternKit) untouched.
+        :param name: The name of the PatternKit module.
+        :return: The new module.
+        """
+        spec = importlib.util.spec_from_file_location(name, self.entry(name).path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[name] = module
+        return module
+
+
+class KitWatcher:
+    """
+    Watches the directories of a KitRegistry for PatternKit files that are
+    written, added or removed.  Uses inotify when the inotify_simple module is
+    installed, otherwise compares modification times every POLL_SEC seconds.
+    """
+    def __init__(self, registry: object, poll_sec: float = POLL_SEC):
+        """
+        Initializes the KitWatcher.  Changes from now on are reported by changes().
+        :param registry: The KitRegistry whose directories to watch.
+        :param poll_sec: How often to look at the modification times without inotify.
+        """
+        self.registry = registry
+        self._poll_ns = int(poll_sec * 1e9)
+        self._inotify = None
+        if inotify_simple is not None:
+            try:
+                self._inotify = inotify_simple.INotify()
+                watch_flags = (inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO |
+                               inotify_simple.flags.MOVED_FROM | inotify_simple.flags.DELETE)
+                for directory in registry.directories:
+                    self._inotify.add_watch(directory, watch_flags)
+            except OSError:
+                # Out of watches, or no inotify in this kernel.
+                self._inotify = None
+        self._next_poll_ns = time.monotonic_ns() + self._poll_ns
+        self._files = self._stat_files() if self._inotify is None else {}
+
+    def _stat_files(self):
+        """
+        :return: A dictionary of (modification time, size) tuples of the PatternKit
+        files in the watched directories, keyed by filename.
+        """
+        files = {}
+        for directory in self.registry.directories:
+            try:
+                for item in os.scandir(directory):
+                    if item.name.endswith('.py') and PATTERN_KIT in item.name and item.is_file():
+                        stat = item.stat()
+                        files[item.path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                pass
+        return files
+
+    def changes(self):
+        """
+        Returns right away, so it can be called between every play().
+        :return: A set of the module names of the PatternKit files that changed
+        since the last call.
+        """
+        if self._inotify is not None:
+            return {os.path.splitext(event.name)[0] for event in self._inotify.read(timeout=0)
+                    if event.name.endswith('.py') and PATTERN_KIT in event.name}
+        now_ns = time.monotonic_ns()
+        if now_ns < self._next_poll_ns:
+            return set()
+        self._next_poll_ns = now_ns + self._poll_ns
+        files = self._stat_files()
+        changed = {path for path in files.keys() | self._files.keys() if files.get(path) != self._files.get(path)}
+        self._files = files
+        return {os.path.splitext(os.path.basename(path))[0] for path in changed}
+
+    def close(self):
+        """
+        Stops watching.
+        :return: None
+        """
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+class LazyKits(collections.abc.Mapping):
+    """
+    A read-only dictionary of PatternKit objects keyed by module name, like
+    PatternDriver.pattern_objects always was, except that each PatternKit is
+    imported and created the first time it is looked up.  Looping over items()
+    only creates each PatternKit as its turn comes.
+    """
+    def __init__(self, registry: object, lights: object, clock: object, scheduler: object):
+        """
+        Initializes the LazyKits.
+        :param registry: The KitRegistry to load the PatternKits from.
+        :param lights: The Lights object to give the PatternKits.
+        :param clock: The Clock object to give the PatternKits.
+        :param scheduler: The Scheduler to give the PatternKits.
+        """
+        self.registry = registry
+        self.lights = lights
+        self.clock = clock
+        self.scheduler = scheduler
+        self._objects = {}
+        # The exception from the last failed load or reload of each PatternKit, keyed by name.
+        self.reload_errors = {}
+
+    def __getitem__(self, name: str):
+        """
+        :param name: The name of a PatternKit module.
+        :return: Its PatternKit object, created now if it does not exist yet.
+        Raises KitLoadError (and records the error in reload_errors) if the module
+        fails to import or to create its PatternKit.  It is tried again the next
+        time it is looked up.
+        """
+        if name not in self._objects:
+            try:
+                pattern_kit = self.registry.load_module(name)
+                pattern_object = Pattern.create_pattern_kit(pattern_kit, self.lights, self.clock, self.scheduler)
+            except Exception as e:
+                self.reload_errors[name] = e
+                # Imported again from the file next time, in case it gets fixed.
+                sys.modules.pop(name, None)
+                raise KitLoadError('The PatternKit "%s" could not be loaded: %s' % (name, e)) from e
+            self._objects[name] = pattern_object
+            self.reload_errors.pop(name, None)
+        return self._objects[name]
+
+    def __contains__(self, name: str):
+        """
+        :param name: The name of a PatternKit module.
+        :return: True if the registry has it, without creating its PatternKit object.
+        """
+        return name in self.registry.names()
+
+    def __iter__(self):
+        """
+        :return: An iterator over the PatternKit names.
+        """
+        return iter(self.registry.names())
+
+    def __len__(self):
+        """
+        :return: The number of PatternKits.
+        """
+        return len(self.registry.names())
+
+    def is_loaded(self, name: str):
+        """
+        :param name: The name of a PatternKit module.
+        :return: True if its PatternKit object has been created.
+        """
+        return name in self._objects
+
+    def reload(self, names: set):
+        """
+        Swaps the PatternKit objects of changed modules for new ones made from the
+        new code.  The Lights are left alone, so the show does not go dark, and a
+        module that fails to import or create its PatternKit keeps its old object.
+        Call KitRegistry.scan() first so new and removed files are known.
+        :param names: The names of the changed PatternKit modules.
+        :return: A set of the names whose PatternKit objects were replaced or removed.
+        """
+        swapped = set()
+        for name in names:
+            if name not in self.registry.names():
+                if self._objects.pop(name, None) is not None:
+                    swapped.add(name)
+                sys.modules.pop(name, None)
+                continue
+            if name not in self._objects:
+                # Not created yet, so it is imported from the new file when its turn comes.
+                sys.modules.pop(name, None)
+                continue
+            try:
+                pattern_kit = self.registry.reload_module(name)
+                pattern_object = Pattern.create_pattern_kit(pattern_kit, self.lights, self.clock, self.scheduler)
+            except Exception as e:
+                self.reload_errors[name] = e
+                continue
+            self._objects[name] = pattern_object
+            self.reload_errors.pop(name, None)
+            swapped.add(name)
+        return swapped
+
+
+if __name__ == '__main__':
+    # Lists the PatternKits the PatternDriver would find, without importing them.
+    registry = KitRegistry(sys.argv[1:] or None)
+    for kit_entry in registry.entries():
+        print('%s: %s (%s)' % (kit_entry.name, kit_entry.title or '', kit_entry.path))
+    for kit_entry in registry.errors.values():
+        print('%s: %s' % (kit_entry.name, kit_entry.error))
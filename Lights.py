@@ -1,11 +1,31 @@
+import os
+import threading
+
+import Clock
+import HeadlessSimulator
+import SoftPwm
+import Topology
+
 try:
     # If we run this on the Raspberry Pi, then we will use the GPIO module.
     from gpiozero import LED
     use_simulator = False
+    use_headless = False
 except:
-    # Otherwise, we will use the Simulator that uses a little GUI.
-    from Simulator import LED
     use_simulator = True
+    if HeadlessSimulator.use_headless():
+        # Without a display (CI, etc.) we record the channels in memory.
+        from HeadlessSimulator import LED
+        use_headless = True
+    else:
+        # Otherwise, we will use the Simulator that uses a little GUI.
+        from Simulator import LED
+        use_headless = False
+
+# If this file exists in the current directory, it describes the channels and
+# the OutputDevices that drive them (see Topology.Topology.from_config()).
+# Otherwise the 16 GPIO outlets below are used.
+TOPOLOGY_FILENAME = 'Topology.json'
 
 # The mapping of the numbered power outlet (in brackets []) to the GPIO
 # pin number (on the right).
@@ -41,36 +61,452 @@ def map_to_gpio(number):
     if use_simulator == True:
         return number
 
-    return gpio_mapping(number)
+    return gpio_mapping[number]
+
+
+def default_topology():
+    """
+    Creates the Topology to use when the Lights object is not given one.  That is
+    the topology in TOPOLOGY_FILENAME if it exists, otherwise the 16 GPIO outlets
+    in gpio_mapping.  On a PC every channel is shown by the simulator.
+    :return: A Topology.Topology object.
+    """
+    if os.path.isfile(TOPOLOGY_FILENAME):
+        return Topology.Topology.load(TOPOLOGY_FILENAME, LED, simulate=use_simulator)
+    numbers = sorted(gpio_mapping.keys())
+    if use_simulator:
+        return Topology.Topology.simulated(numbers, LED)
+    config = {'devices': [{'name': 'outlets', 'type': 'gpio', 'pins': [map_to_gpio(i) for i in numbers]}]}
+    return Topology.Topology.from_config(config, LED)
+
+
+def channel_bit(num: int):
+    """
+    Returns the bit that represents a channel in a channel bitmask.  Channel 1
+    is the least significant bit.
+    :param num: The channel number.
+    :return: An int with only the bit for the requested channel set.
+    """
+    return 1 << (num - 1)
+
+
+class Channel:
+    """
+    One channel of the Lights object.  Turning it on or off goes through the
+    Lights object so that the Lights object always knows which channels are on.
+    """
+    def __init__(self, lights: object, num: int):
+        """
+        Initializes this Channel.
+        :param lights: The Lights object that owns this channel.
+        :param num: The channel number.
+        """
+        self._lights = lights
+        self._num = num
+        device, pin = lights.topology.locate(num)
+        # The LED object (gpiozero or a simulator's) behind this channel, or None
+        # if the channel is on a device without LED objects.
+        self.led = device.led(pin)
+
+    def on(self):
+        """
+        Turns on this channel.
+        :return: None
+        """
+        self._lights.apply({self._num: True})
+
+    def off(self):
+        """
+        Turns off this channel.
+        :return: None
+        """
+        self._lights.apply({self._num: False})
+
+    def set_level(self, level: int):
+        """
+        Sets the brightness of this channel.
+        :param level: The brightness from 0 (off) to 255 (on).
+        :return: None
+        """
+        self._lights.set_level(self._num, level)
+
+    def fade(self, level: int, seconds: float):
+        """
+        Fades this channel to a brightness.
+        :param level: The brightness to end at, from 0 (off) to 255 (on).
+        :param seconds: How many seconds the fade takes.
+        :return: None
+        """
+        self._lights.fade(self._num, level, seconds)
+
+    def __getattr__(self, name: str):
+        """
+        Gets the requested attribute from the LED object, so anything else the
+        LED object can do is still available.
+        :param name: Name of the attribute to return.
+        :return: The value of the requested attribute.
+        """
+        if self.led is None:
+            raise AttributeError(name)
+        return getattr(self.led, name)
 
 
 class Lights:
     """
-    A class that contains the list of 16 channels that can be turned on or off.
+    A class that contains the channels that can be turned on or off.  The
+    Lights object keeps a bitmask of which channels are on, so a whole frame
+    can be written with set_frame() and only the channels that changed are
+    touched.  The changes are handed to each OutputDevice in one write().
+
+    Channels can also be dimmed (0 to 255) and faded.  OutputDevices that can dim
+    their pins are handed the levels, the others are dimmed in software by one
+    SoftPwm.PwmProcess (or, with the simulator, a SoftPwm.PwmEngine thread).
+    The PwmProcess writes the pins it dims, and every pin of an OutputDevice that
+    rewrites every pin at once while any of them is dimmed.  A dimmed channel
+    counts as on in the bitmask, and turning it on or off (or a set_frame()) ends
+    the dimming.
     """
-    def __init__(self):
+    def __init__(self, topology: object = None, clock: object = None):
         """
         Initializes the Lights object's collection of channels.
+        :param topology: The Topology.Topology object with the channels and the
+        OutputDevices that drive them.  default_topology() if None.
+        :param clock: The Clock object fades are timed on.  A Clock.RealClock if None.
         """
+        self.topology = topology if topology is not None else default_topology()
+        self.clock = clock if clock is not None else Clock.RealClock()
+        # The PwmEngine thread writes the pins too, so writes are done under this lock.
+        self._lock = threading.RLock()
+        # The brightness of the dimmed channels (1 to 254), keyed by channel number.
+        self._levels = {}
+        # Bitmasks of the dimmed channels, and of those dimmed by the PwmEngine.
+        self._dimmed = 0
+        self._software = 0
+        # The bitmask the PwmEngine last wrote for its channels.
+        self._pwm_state = 0
+        # The channels the PwmProcess writes instead of us, and those of them that
+        # are on OutputDevices it took over whole.
+        self._owned = 0
+        self._owned_devices = 0
+        # The bitmask of the channels of each OutputDevice, keyed by OutputDevice.
+        self._device_masks = self.topology.device_masks()
+        # The fades in progress as (from level, to level, start_ns, end_ns), keyed
+        # by channel number, and a bitmask of their channels.
+        self._fades = {}
+        self._fading = 0
+        # The PwmEngine or PwmProcess, created when it is first needed.
+        self.pwm = None
         self._channel = {}
-        for i in range(1, 17):
-            self._channel[i] = LED(map_to_gpio(i))
+        # A bitmask with the bit of every channel set.
+        self._all_mask = 0
+        for i in self.topology.channel_numbers:
+            self._channel[i] = Channel(self, i)
+            self._all_mask |= channel_bit(i)
+        # A bitmask of the channels that are on.  None until the first reset()
+        # so that the first frame touches every channel.
+        self._state = None
         self.reset()
 
     def channel(self, num: int):
         """
         Returns a reference to the requested channel.
         :param num: The number of the channel to return.
-        :return: A reference to the requested channel object.  What this actually
-        is changes between an LED object (when on a Raspberry Pi) to a fake LED
-        object from Simulator.py (when on a PC).
+        :return: A reference to the requested Channel object.
         """
         return self._channel[num]
 
+    @property
+    def channel_numbers(self):
+        """
+        :return: A sorted list of the channel numbers.
+        """
+        return self.topology.channel_numbers
+
+    @property
+    def state(self):
+        """
+        :return: A bitmask of the channels that are on.  Channel 1 is the least
+        significant bit.
+        """
+        return self._state
+
+    def set_frame(self, mask: int, selected: int = -1):
+        """
+        Turns every channel on or off to match a bitmask.  Only the channels that
+        are different from the current state are touched.
+        :param mask: A bitmask of the channels that should be on.  Channel 1 is the
+        least significant bit.  Bits for channels that do not exist are ignored.
+        :param selected: A bitmask of the channels to set.  The others are left as
+        they are, dimmed or not.  Every channel by default.
+        :return: None
+        """
+        if self._state is None:
+            changed = self._all_mask & selected
+        else:
+            # Dimmed and fading channels are rewritten too, to end their dimming.
+            changed = ((mask ^ self._state) | self._dimmed | self._fading) & self._all_mask & selected
+        self._write(changed, mask)
+
+    def apply(self, states: dict):
+        """
+        Turns some of the channels on or off.  Channels that are already in the
+        requested state are not touched.
+        :param states: A dictionary of channel number to True (on) or False (off).
+        :return: None
+        """
+        selected = 0
+        mask = 0
+        for num, state in states.items():
+            bit = channel_bit(num)
+            selected |= bit
+            if state:
+                mask |= bit
+        selected &= self._all_mask
+        if self._state is None:
+            changed = selected
+        else:
+            changed = ((mask ^ self._state) | self._dimmed | self._fading) & selected
+        self._write(changed, mask)
+
+    def _write(self, changed: int, mask: int):
+        """
+        Writes the changed channels to their OutputDevices, one write() per device,
+        and updates the channel bitmask.
+        :param changed: A bitmask of the channels to write.
+        :param mask: A bitmask with the new state of the changed channels.
+        :return: None
+        """
+        if not changed:
+            return
+        with self._lock:
+            if changed & (self._dimmed | self._fading):
+                self._undim(changed)
+            self._write_devices(changed, mask)
+            self._state = ((self._state or 0) & ~changed) | (mask & changed)
+
+    def _write_devices(self, changed: int, mask: int):
+        """
+        Writes the changed channels to their OutputDevices, one write() per device.
+        The channels the PwmProcess writes are handed to it.
+        :param changed: A bitmask of the channels to write.
+        :param mask: A bitmask with the new state of the changed channels.
+        :return: None
+        """
+        if changed & self._owned:
+            self.pwm.set_frame(changed & self._owned, mask)
+            changed &= ~self._owned
+        self.topology.write(changed, mask)
+
+    def _undim(self, channels: int):
+        """
+        Ends the dimming and the fades of some channels.  Their pins are left for
+        the caller to write.
+        :param channels: A bitmask of the channels.
+        :return: None
+        """
+        software = self._software
+        remaining = channels & (self._dimmed | self._fading)
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            num = bit.bit_length()
+            self._levels.pop(num, None)
+            self._fades.pop(num, None)
+        self._dimmed &= ~channels
+        self._fading &= ~channels
+        self._software &= ~channels
+        if self._software != software:
+            self._update_pwm()
+
+    def _update_pwm(self):
+        """
+        Hands the levels of the software dimmed channels to the PwmEngine.  Called
+        whenever the software dimmed channels or their levels change.
+        :return: None
+        """
+        # The pins that are no longer dimmed are written by the caller.
+        self._pwm_state &= self._software
+        levels = {}
+        remaining = self._software
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            levels[bit] = self._levels[bit.bit_length()]
+        pwm = self._pwm_engine()
+        owned_devices = 0
+        if pwm.owns_pins:
+            # An OutputDevice that rewrites every pin can only have one writer, so the
+            # PwmProcess takes over all of it.
+            for device, device_mask in self._device_masks.items():
+                if device.writes_every_pin and device_mask & self._software:
+                    owned_devices |= device_mask
+        released = self._owned_devices & ~owned_devices
+        self._owned = (self._software | owned_devices) if pwm.owns_pins else 0
+        self._owned_devices = owned_devices
+        pwm.set_levels(levels, self._owned, self._state or 0)
+        if released:
+            # The PwmProcess has let go of these OutputDevices, and wrote their pins
+            # from its own copy of them, so every pin is written again.
+            self.topology.write(released, self._state or 0)
+
+    def _pwm_engine(self):
+        """
+        :return: The PwmEngine (or PwmProcess), created and started if needed.
+        """
+        if self.pwm is None:
+            if use_simulator:
+                self.pwm = SoftPwm.PwmEngine(self, self.clock)
+            else:
+                self.pwm = SoftPwm.PwmProcess(self, self.clock)
+        self.pwm.start()
+        return self.pwm
+
+    def write_pwm(self, mask: int):
+        """
+        Writes one PWM slice for the software dimmed channels.  Only the PwmEngine
+        calls this.
+        :param mask: A bitmask of the channels that are on in the slice.
+        :return: None
+        """
+        with self._lock:
+            changed = (mask ^ self._pwm_state) & self._software
+            self._write_devices(changed, mask)
+            self._pwm_state = (self._pwm_state & ~changed) | (mask & changed)
+
+    def level(self, num: int):
+        """
+        :param num: The channel number.
+        :return: The brightness of the channel from 0 (off) to 255 (on).
+        """
+        if num in self._levels:
+            return self._levels[num]
+        return SoftPwm.MAX_LEVEL if (self._state or 0) & channel_bit(num) else 0
+
+    def set_level(self, num: int, level: int):
+        """
+        Sets the brightness of a channel, ending any fade it is in.
+        :param num: The channel number.
+        :param level: The brightness from 0 (off) to 255 (on).
+        :return: None
+        """
+        with self._lock:
+            bit = channel_bit(num)
+            if self._fading & bit:
+                self._fades.pop(num)
+                self._fading &= ~bit
+            self._set_level(num, level)
+
+    def _set_level(self, num: int, level: int):
+        """
+        Sets the brightness of a channel.  0 and 255 turn it off and on.  In between,
+        the channel's OutputDevice dims it if it can, otherwise the PwmEngine does.
+        If neither can (the PwmEngine needs a clock that moves by itself), the
+        channel is on from half brightness up.
+        :param num: The channel number.
+        :param level: The brightness from 0 (off) to 255 (on).
+        :return: None
+        """
+        level = max(0, min(SoftPwm.MAX_LEVEL, int(level)))
+        bit = channel_bit(num)
+        if level == 0 or level == SoftPwm.MAX_LEVEL:
+            state = bit if level else 0
+            if self._dimmed & bit:
+                # The pin was dimmed, so it is written even if the state is the same.
+                self._levels.pop(num)
+                self._dimmed &= ~bit
+                if self._software & bit:
+                    self._software &= ~bit
+                    self._update_pwm()
+            elif not ((self._state or 0) ^ state) & bit:
+                return
+            self._write_devices(bit, state)
+            self._state = ((self._state or 0) & ~bit) | state
+            return
+        if self._levels.get(num) == level:
+            return
+        device, pin = self.topology.locate(num)
+        self._levels[num] = level
+        self._dimmed |= bit
+        if device.supports_pwm:
+            device.write_levels({pin: level})
+            self._state = (self._state or 0) | bit
+        elif self.clock.realtime:
+            self._software |= bit
+            self._update_pwm()
+            self._state = (self._state or 0) | bit
+        else:
+            state = bit if level >= SoftPwm.MAX_LEVEL // 2 + 1 else 0
+            self._write_devices(bit, state)
+            self._state = ((self._state or 0) & ~bit) | state
+
+    def fade(self, num: int, level: int, seconds: float):
+        """
+        Fades a channel from its brightness now to another brightness.  The fade is
+        stepped by the PwmEngine, or by flush() when the clock does not move by
+        itself.
+        :param num: The channel number.
+        :param level: The brightness to end at, from 0 (off) to 255 (on).
+        :param seconds: How many seconds the fade takes.
+        :return: None
+        """
+        if seconds <= 0:
+            self.set_level(num, level)
+            return
+        with self._lock:
+            start_ns = self.clock.monotonic_ns()
+            self._fades[num] = (self.level(num), level, start_ns, start_ns + int(seconds * Clock.NS_PER_SECOND))
+            self._fading |= channel_bit(num)
+        if self.clock.realtime:
+            self._pwm_engine().wake()
+
+    def fading(self):
+        """
+        :return: True if any channel is fading.
+        """
+        return self._fading != 0
+
+    def update_fades(self):
+        """
+        Sets the brightness of every fading channel for the time now, and ends the
+        fades that are done.
+        :return: None
+        """
+        with self._lock:
+            now_ns = self.clock.monotonic_ns()
+            for num, (from_level, to_level, start_ns, end_ns) in list(self._fades.items()):
+                if now_ns >= end_ns:
+                    del self._fades[num]
+                    self._fading &= ~channel_bit(num)
+                    self._set_level(num, to_level)
+                else:
+                    self._set_level(num, from_level + (to_level - from_level) * (now_ns - start_ns) // (end_ns - start_ns))
+
+    def flush(self):
+        """
+        Lets the OutputDevices finish showing the current frame.  The PatternDriver
+        calls this just before it sleeps.  Only the simulator needs it, to repaint
+        its window.  Fades are stepped here too, for clocks that only move when the
+        show sleeps.
+        :return: None
+        """
+        if self._fading and not self.clock.realtime:
+            self.update_fades()
+        for device in self.topology.devices:
+            device.flush()
+
+    def close(self):
+        """
+        Turns off all of the channels and closes the OutputDevices.
+        :return: None
+        """
+        self.reset()
+        if self.pwm is not None:
+            self.pwm.stop()
+        self.topology.close()
+
     def reset(self):
         """
         Turns off all of the channels.
         :return: None
         """
-        for item in self._channel.values():
-            item.off()
+        self.set_frame(0)
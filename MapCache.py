@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import pickle
+
+# Bump this whenever the layout of a compiled map changes, so old cache files
+# are recompiled instead of misread.
+CACHE_VERSION = 4
+
+# The compiled map is stored beside the JSON file with this added to its name.
+CACHE_SUFFIX = '.cache'
+
+# The kinds of shapes in a compiled map.
+TRIANGLE = 0
+CIRCLE = 1
+RECTANGLE = 2
+LINE = 3
+
+SHAPE_KINDS = {'triangle': TRIANGLE, 'circle': CIRCLE, 'rectangle': RECTANGLE, 'line': LINE}
+
+# The extra keys each kind of shape needs from its JSON entry, in the order the
+# GShape classes in GraphicsJson.py take them.
+SHAPE_KEYS = {
+    TRIANGLE: ('height', 'width'),
+    CIRCLE: ('radius',),
+    RECTANGLE: ('height', 'width'),
+    LINE: ('x2', 'y2'),
+}
+
+
+def geometry(kind: int, x: float, y: float, extra: tuple):
+    """
+    Works out the points a shape is drawn with.
+    :param kind: One of the shape constants above.
+    :param x: The x coordinate of the shape, see the GShape classes in GraphicsJson.py.
+    :param y: The y coordinate of the shape.
+    :param extra: The values named in SHAPE_KEYS for the kind.
+    :return: A tuple of (x, y) points: the corners of a triangle, the center of a
+    circle, the opposite corners of a rectangle or the ends of a line.
+    """
+    if kind == TRIANGLE:
+        height, width = extra
+        return (x, y + height), (x + width / 2, y), (x + width, y + height)
+    if kind == CIRCLE:
+        radius, = extra
+        return (x + radius / 2, y + radius / 2),
+    if kind == RECTANGLE:
+        height, width = extra
+        return (x, y), (x + width, y + height)
+    x2, y2 = extra
+    return (x, y), (x2, y2)
+
+
+def compile_entry(channel_entry: dict, color_to_rgb: object = None):
+    """
+    Compiles one member of the "channels" array of a map JSON file.
+    :param channel_entry: A dictionary member from the "channels" array in the JSON file.
+    :param color_to_rgb: A function that takes an X11 color name and returns an
+    (r, g, b) tuple, raising an exception for unknown colors.  Colors are not
+    checked if None.
+    :return: A tuple of (kind, name, channel, x, y, color, rgb, extra, points) where
+    kind is one of the shape constants above, rgb is the (r, g, b) tuple of the
+    color (or None), extra is a tuple of the values named in SHAPE_KEYS for the
+    kind, and points are the shape's points, ready to draw (see geometry()).
+    """
+    name = channel_entry['name']
+    kind = SHAPE_KINDS.get(channel_entry['shape'].lower())
+    if kind is None:
+        raise Exception('Unknown shape "%s" for "%s" in the map.' % (channel_entry['shape'], name))
+    channel = channel_entry['channel']
+    if channel < 0:
+        channel = 0
+    color = channel_entry['color']
+    rgb = None
+    if color_to_rgb is not None:
+        try:
+            rgb = tuple(color_to_rgb(color))
+        except Exception:
+            raise Exception('Unknown color "%s" for "%s" in the map.' % (color, name))
+    extra = tuple(channel_entry[key] for key in SHAPE_KEYS[kind])
+    x = channel_entry['x']
+    y = channel_entry['y']
+    return (kind, name, channel, x, y, color, rgb, extra, geometry(kind, x, y, extra))
+
+
+def compile_map(json_data: dict, color_to_rgb: object = None):
+    """
+    Compiles the data from a map JSON file.
+    :param json_data: The parsed JSON file.
+    :param color_to_rgb: A function that checks colors, see compile_entry().
+    :return: A dictionary with the "name", "window_width", "window_height" and
+    "bg_color" of the map, the compiled "entries" (see compile_entry()) and
+    "channels", the indexes of the entries grouped by channel number and then by
+    color, the way GraphicsJson.ChannelCollection keeps its shapes.
+    """
+    entries = [compile_entry(one_channel, color_to_rgb) for one_channel in json_data['channels']]
+    channels = {}
+    for index, entry in enumerate(entries):
+        channels.setdefault(entry[2], {}).setdefault(entry[5], []).append(index)
+    return {
+        'name': json_data['name'],
+        'window_width': json_data['window_width'],
+        'window_height': json_data['window_height'],
+        'bg_color': json_data['bg_color'],
+        'entries': entries,
+        'channels': channels,
+    }
+
+
+def cache_filename(filename: str):
+    """
+    :param filename: The filename of the map JSON file.
+    :return: The filename of the compiled map beside it.
+    """
+    return filename + CACHE_SUFFIX
+
+
+def load(filename: str, color_to_rgb: object = None):
+    """
+    Loads a compiled map.  The compiled map is read from the cache file beside the
+    JSON file if the cache was made from the same JSON file contents by the same
+    CACHE_VERSION.  Otherwise the JSON file is compiled and the cache is rewritten.
+    :param filename: The filename of the map JSON file.
+    :param color_to_rgb: A function that checks colors, see compile_entry().
+    :return: The compiled map, see compile_map().
+    """
+    with open(filename, 'rb') as json_file:
+        raw = json_file.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    cache_name = cache_filename(filename)
+    try:
+        with open(cache_name, 'rb') as cache_file:
+            cached = pickle.load(cache_file)
+        if cached.get('version') == CACHE_VERSION and cached.get('digest') == digest:
+            return cached['map']
+    except Exception:
+        # A missing or damaged cache (or one pickled by an incompatible Python) is
+        # just rebuilt.
+        pass
+    compiled = compile_map(json.loads(raw), color_to_rgb)
+    temp_name = cache_name + '.tmp'
+    try:
+        with open(temp_name, 'wb') as cache_file:
+            pickle.dump({'version': CACHE_VERSION, 'digest': digest, 'map': compiled}, cache_file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_name, cache_name)
+    except OSError:
+        # A read-only directory just means no cache.
+        pass
+    return compiled
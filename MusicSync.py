@@ -0,0 +1,463 @@
+import bisect
+import os
+import pickle
+import sys
+import wave
+
+try:
+    # The audio analysis needs numpy, which is not part of the standard library.
+    import numpy
+except ImportError:
+    numpy = None
+
+import Pattern
+
+# Bump this whenever the analysis changes, so old cache files are redone
+# instead of reused.
+ANALYSIS_VERSION = 2
+
+# The analysis is stored beside the audio file with this added to its name.
+CACHE_SUFFIX = '.beats.cache'
+
+# How many audio frames are read from the WAV file at a time.  Only this much
+# of the track (plus the onset envelope, one number per HOP_SIZE samples) is
+# ever in memory.
+CHUNK_FRAMES = 65536
+
+# The number of samples in each analysis frame, and how many samples apart the
+# frames start, at REFERENCE_RATE.  Other sample rates scale both, so the onset
+# envelope has the same number of values per second for every track.
+FRAME_SIZE = 2048
+HOP_SIZE = 512
+REFERENCE_RATE = 44100
+
+# The range of tempos the beat tracker looks for.
+MIN_BPM = 60
+MAX_BPM = 200
+
+# The beat tracker favors tempos near PRIOR_BPM, falling off like a bell curve
+# over the octaves (log2 of the tempo ratio) with this standard deviation, so
+# that it does not settle on half or double the tempo.
+PRIOR_BPM = 120
+PRIOR_OCTAVES = 1
+
+# How many times the beat grid is refit to the onsets near its beats, and how
+# far from a beat (as a fraction of the beat) an onset can be to count.
+REFIT_PASSES = 3
+REFIT_WINDOW = .25
+
+# How far above the local average of the onset envelope (in standard deviations)
+# a peak must be to count as an onset.
+ONSET_THRESHOLD = .5
+
+# How many seconds the local average of the onset envelope is taken over.
+ONSET_WINDOW_SEC = .5
+
+
+def _need_numpy():
+    """
+    Raises an exception if numpy is not installed.
+    :return: None
+    """
+    if numpy is None:
+        raise Exception('The numpy module is needed to analyze audio.')
+
+
+def _samples(data: bytes, sample_width: int, channels: int):
+    """
+    Converts frames read from a WAV file to mono samples.
+    :param data: The bytes from wave.readframes().
+    :param sample_width: The number of bytes per sample.
+    :param channels: The number of channels.
+    :return: A numpy float array of samples from -1 to 1.
+    """
+    if sample_width == 1:
+        samples = (numpy.frombuffer(data, numpy.uint8).astype(numpy.float32) - 128) / 128
+    elif sample_width == 2:
+        samples = numpy.frombuffer(data, '<i2').astype(numpy.float32) / 32768
+    elif sample_width == 3:
+        raw = numpy.frombuffer(data, numpy.uint8).reshape(-1, 3).astype(numpy.int32)
+        samples = ((raw[:, 0] | raw[:, 1] << 8 | raw[:, 2] << 16) << 8 >> 8).astype(numpy.float32) / 8388608
+    elif sample_width == 4:
+        samples = numpy.frombuffer(data, '<i4').astype(numpy.float32) / 2147483648
+    else:
+        raise Exception('WAV files with %d bytes per sample are not supported.' % (sample_width))
+    return samples.reshape(-1, channels).mean(axis=1)
+
+
+def onset_envelope(filename: str):
+    """
+    Computes the spectral flux of a WAV file: for every hop of HOP_SIZE samples,
+    how much louder each frequency got in the FRAME_SIZE samples from there
+    since the frame before.  The file is read CHUNK_FRAMES at a time.
+    :param filename: The filename of the WAV file.
+    :return: A tuple of the envelope (a numpy array), its rate in values per
+    second, and the length of the track in seconds.  Value i of the envelope
+    is the onset strength at i / rate seconds.
+    """
+    _need_numpy()
+    pieces = []
+    with wave.open(filename, 'rb') as wav:
+        sample_rate = wav.getframerate()
+        sample_width = wav.getsampwidth()
+        channels = wav.getnchannels()
+        duration = wav.getnframes() / sample_rate
+        hop = max(1, round(HOP_SIZE * sample_rate / REFERENCE_RATE))
+        frame_size = hop * (FRAME_SIZE // HOP_SIZE)
+        window = numpy.hanning(frame_size).astype(numpy.float32)
+        # Samples left over from the last chunk, and the spectrum of the last frame.
+        # As the frames move along, a sound comes in at the end of the window, and
+        # its flux peaks between the two frames that have it about three quarters
+        # of the way in, where the window rises fastest.  Starting the frames that
+        # far before the track lines each value up with the time of its sound.
+        carry = numpy.zeros(3 * frame_size // 4 - hop // 2, numpy.float32)
+        previous = None
+        while True:
+            data = wav.readframes(CHUNK_FRAMES)
+            if not data:
+                break
+            samples = numpy.concatenate((carry, _samples(data, sample_width, channels)))
+            count = (len(samples) - frame_size) // hop + 1 if len(samples) >= frame_size else 0
+            carry = samples[count * hop:]
+            if count == 0:
+                continue
+            frames = numpy.lib.stride_tricks.sliding_window_view(samples, frame_size)[::hop][:count] * window
+            spectrum = numpy.log1p(numpy.abs(numpy.fft.rfft(frames, axis=1)))
+            if previous is None:
+                previous = spectrum[:1]
+            flux = numpy.maximum(0, numpy.diff(numpy.concatenate((previous, spectrum)), axis=0)).sum(axis=1)
+            pieces.append(flux)
+            previous = spectrum[-1:]
+    envelope = numpy.concatenate(pieces) if pieces else numpy.zeros(0)
+    return envelope, sample_rate / hop, duration
+
+
+def _onset_threshold(envelope: object, rate: float):
+    """
+    :param envelope: The onset envelope from onset_envelope().
+    :param rate: The number of envelope values per second.
+    :return: A numpy array of how high each value of the envelope must be to be
+    an onset: ONSET_THRESHOLD standard deviations above the local average.
+    """
+    width = max(1, int(ONSET_WINDOW_SEC * rate))
+    average = numpy.convolve(envelope, numpy.ones(width) / width, mode='same')
+    return average + ONSET_THRESHOLD * envelope.std()
+
+
+def _peak_offsets(envelope: object, indexes: object):
+    """
+    Fits a parabola through each peak of the envelope and its neighbors, for the
+    time of the peak between two envelope values.
+    :param envelope: The onset envelope from onset_envelope().
+    :param indexes: A numpy array of the indexes of peaks, not at either end.
+    :return: A numpy array of how far each peak is from its index, from -0.5 to 0.5.
+    """
+    left = envelope[indexes - 1]
+    peak = envelope[indexes]
+    right = envelope[indexes + 1]
+    bend = left - 2 * peak + right
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        offsets = numpy.where(bend < 0, .5 * (left - right) / bend, 0)
+    return numpy.clip(offsets, -.5, .5)
+
+
+def find_onsets(envelope: object, rate: float):
+    """
+    Picks the peaks of an onset envelope that stand out from their surroundings.
+    :param envelope: The onset envelope from onset_envelope().
+    :param rate: The number of envelope values per second.
+    :return: A numpy array of the onset times in seconds.
+    """
+    _need_numpy()
+    if len(envelope) < 3:
+        return numpy.zeros(0)
+    threshold = _onset_threshold(envelope, rate)
+    middle = envelope[1:-1]
+    peaks = (middle >= envelope[:-2]) & (middle > envelope[2:]) & (middle > threshold[1:-1])
+    indexes = numpy.nonzero(peaks)[0] + 1
+    return (indexes + _peak_offsets(envelope, indexes)) / rate
+
+
+def _refit(envelope: object, rate: float, period: float, offset: float, beat_count: int):
+    """
+    Fits the beat grid to the onsets.  The strongest onset within REFIT_WINDOW
+    beats of every beat is found, and the period and offset are fit to their
+    times by least squares, REFIT_PASSES times.  Beats with no onset near them
+    are left out of the fit.
+    :param envelope: The onset envelope from onset_envelope().
+    :param rate: The number of envelope values per second.
+    :param period: The first guess at the beat period in seconds.
+    :param offset: The first guess at the time of beat 0 in seconds.
+    :param beat_count: The number of beats in the track.
+    :return: A tuple of the fitted period and offset in seconds.
+    """
+    threshold = _onset_threshold(envelope, rate)
+    last = len(envelope) - 2
+    for _ in range(REFIT_PASSES):
+        numbers = []
+        indexes = []
+        for number in range(beat_count):
+            beat = (offset + number * period) * rate
+            low = max(1, int(numpy.ceil(beat - REFIT_WINDOW * period * rate)))
+            high = min(last, int(beat + REFIT_WINDOW * period * rate))
+            if high < low:
+                continue
+            index = low + int(numpy.argmax(envelope[low:high + 1]))
+            if envelope[index] > threshold[index]:
+                numbers.append(number)
+                indexes.append(index)
+        if len(numbers) < 2:
+            break
+        indexes = numpy.array(indexes)
+        times = (indexes + _peak_offsets(envelope, indexes)) / rate
+        period, offset = numpy.polyfit(numpy.array(numbers, dtype=float), times, 1)
+    return period, offset
+
+
+def find_beats(envelope: object, rate: float, duration: float):
+    """
+    Finds the tempo of a track from the autocorrelation of its onset envelope,
+    weighted toward PRIOR_BPM, then the phase of the beat that lines up with the
+    most onset energy, and then fits both to the onsets (see _refit()).
+    :param envelope: The onset envelope from onset_envelope().
+    :param rate: The number of envelope values per second.
+    :param duration: The length of the track in seconds.
+    :return: A tuple of the beats per minute and a numpy array of the beat times
+    in seconds.
+    """
+    _need_numpy()
+    min_lag = int(60 * rate / MAX_BPM)
+    max_lag = int(60 * rate / MIN_BPM) + 1
+    if len(envelope) <= max_lag + 1:
+        return 0, numpy.zeros(0)
+    centered = envelope - envelope.mean()
+    spectrum = numpy.fft.rfft(centered, 2 * len(centered))
+    correlation = numpy.fft.irfft(spectrum * numpy.conj(spectrum))[:len(centered)]
+    bpms = 60 * rate / numpy.arange(min_lag, max_lag)
+    prior = numpy.exp(-.5 * (numpy.log2(bpms / PRIOR_BPM) / PRIOR_OCTAVES) ** 2)
+    lag = min_lag + int(numpy.argmax(numpy.maximum(correlation[min_lag:max_lag], 0) * prior))
+    # Fit a parabola through the peak for a lag between two envelope values, so
+    # the beat does not drift over a long track.
+    if 0 < lag < len(correlation) - 1:
+        left, peak, right = correlation[lag - 1:lag + 2]
+        bend = left - 2 * peak + right
+        fraction = .5 * (left - right) / bend if bend != 0 else 0
+    else:
+        fraction = 0
+    period = (lag + fraction) / rate
+    # Try every phase one envelope value apart, and keep the one whose beats land
+    # on the most onset energy.
+    beat_count = int(duration / period)
+    offsets = numpy.arange(int(period * rate))
+    indexes = numpy.rint(offsets[:, None] + numpy.arange(beat_count)[None, :] * period * rate).astype(int)
+    indexes = numpy.minimum(indexes, len(envelope) - 1)
+    offset = offsets[int(numpy.argmax(envelope[indexes].sum(axis=1)))] / rate
+    period, offset = _refit(envelope, rate, period, offset, beat_count)
+    # The fit can move the first beat, so the beats are counted from the start again.
+    first = int(numpy.ceil(-offset / period))
+    beats = offset + numpy.arange(first, int((duration - offset) / period) + 1) * period
+    return 60 / period, beats[(beats >= 0) & (beats < duration)]
+
+
+def analyze(filename: str):
+    """
+    Analyzes a WAV file.
+    :param filename: The filename of the WAV file.
+    :return: A dictionary with the "bpm", the "beats" and "onsets" (lists of
+    seconds) and the "duration" in seconds.
+    """
+    envelope, rate, duration = onset_envelope(filename)
+    bpm, beats = find_beats(envelope, rate, duration)
+    return {
+        'bpm': float(bpm),
+        'beats': [float(beat) for beat in beats],
+        'onsets': [float(onset) for onset in find_onsets(envelope, rate)],
+        'duration': duration,
+    }
+
+
+def cache_filename(filename: str):
+    """
+    :param filename: The filename of the WAV file.
+    :return: The filename of the analysis beside it.
+    """
+    return filename + CACHE_SUFFIX
+
+
+class BeatGrid:
+    """
+    The beats and onsets of a track, for PatternKits to schedule frames against.
+    Times are in seconds from the start of the track.
+    """
+    def __init__(self, bpm: float, beats: list, onsets: list, duration: float):
+        """
+        Initializes the BeatGrid.
+        :param bpm: The tempo in beats per minute.
+        :param beats: The beat times, sorted.
+        :param onsets: The onset times (drum hits, notes, etc.), sorted.
+        :param duration: The length of the track.
+        """
+        self.bpm = bpm
+        self.beats = beats
+        self.onsets = onsets
+        self.duration = duration
+
+    def beat_index(self, seconds: float):
+        """
+        :param seconds: A time in the track.
+        :return: The index of the last beat at or before that time, or -1 if it is
+        before the first beat.
+        """
+        return bisect.bisect_right(self.beats, seconds) - 1
+
+    def next_beat(self, seconds: float, beats: int = 1):
+        """
+        :param seconds: A time in the track.
+        :param beats: Which beat after that time, 1 for the very next one.
+        :return: The time of the beat.  Past the last beat, the beats carry on at
+        the same tempo.
+        """
+        if not self.beats:
+            raise Exception('No beat was found in the track.')
+        index = self.beat_index(seconds) + beats
+        if index < len(self.beats):
+            return self.beats[index]
+        # Carry on from the last beat, even past the end of the track, so a
+        # PatternKit waiting for beats never stops moving.
+        period = 60 / self.bpm
+        last = self.beats[-1]
+        if seconds >= last:
+            index = int((seconds - last) // period) + beats
+        else:
+            index = beats - (len(self.beats) - 1 - self.beat_index(seconds))
+        return last + index * period
+
+    def next_onset(self, seconds: float):
+        """
+        :param seconds: A time in the track.
+        :return: The time of the first onset after that time, or of the next beat
+        if there are no more.
+        """
+        index = bisect.bisect_right(self.onsets, seconds)
+        if index >= len(self.onsets):
+            return self.next_beat(seconds)
+        return self.onsets[index]
+
+    def subdivide(self, parts: int):
+        """
+        :param parts: How many parts to split each beat into (2 for eighth notes
+        in 4/4, etc.).
+        :return: A new BeatGrid with parts times as many beats.
+        """
+        beats = []
+        for index, beat in enumerate(self.beats):
+            following = self.beats[index + 1] if index + 1 < len(self.beats) else beat + 60 / self.bpm
+            beats.extend(beat + (following - beat) * part / parts for part in range(parts))
+        return BeatGrid(self.bpm * parts, [beat for beat in beats if beat < self.duration], self.onsets, self.duration)
+
+
+def load(filename: str):
+    """
+    Loads the BeatGrid of a WAV file.  The analysis is read from the cache file
+    beside the WAV file if the WAV file has not changed since, otherwise the WAV
+    file is analyzed and the cache is rewritten.
+    :param filename: The filename of the WAV file.
+    :return: A BeatGrid object.
+    """
+    status = os.stat(filename)
+    key = (ANALYSIS_VERSION, status.st_size, status.st_mtime_ns)
+    cache_name = cache_filename(filename)
+    analysis = None
+    try:
+        with open(cache_name, 'rb') as cache_file:
+            cached = pickle.load(cache_file)
+        if cached.get('key') == key:
+            analysis = cached['analysis']
+    except Exception:
+        # A missing or damaged cache (or one pickled by an incompatible Python) is
+        # just redone.
+        pass
+    if analysis is None:
+        analysis = analyze(filename)
+        temp_name = cache_name + '.tmp'
+        try:
+            with open(temp_name, 'wb') as cache_file:
+                pickle.dump({'key': key, 'analysis': analysis}, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_name, cache_name)
+        except OSError:
+            # A read-only directory just means no cache.
+            pass
+    return BeatGrid(analysis['bpm'], analysis['beats'], analysis['onsets'], analysis['duration'])
+
+
+class MusicPattern(Pattern.Pattern):
+    """
+    Parent class for PatternKit objects that play along with a track.  The
+    track's BeatGrid is loaded the first time it is needed.  The PatternKit
+    keeps track of where it is in the track by adding up its sleeps, which the
+    Scheduler keeps to absolute deadlines, so it stays on the beat.  Playing
+    the audio itself, starting when start_track() is called, is up to the show.
+    """
+    # The filename of the WAV file, set by each subclass.
+    audio_filename = None
+
+    def __init__(self, name: str, lights: object, clock: object = None):
+        """
+        A parent class for PatternKit objects that play along with a track.
+        :param name: The name of this PatternKit as a string.
+        :param lights: A reference to the Lights object.
+        :param clock: The Clock object this PatternKit runs on.
+        """
+        super().__init__(name, lights, clock)
+        self._beat_grid = None
+        # How many seconds into the track this PatternKit is.
+        self.track_time = 0
+
+    @property
+    def beat_grid(self):
+        """
+        :return: The BeatGrid of audio_filename.
+        """
+        if self._beat_grid is None:
+            self._beat_grid = load(self.audio_filename)
+        return self._beat_grid
+
+    def start_track(self):
+        """
+        Marks the start of the track.
+        :return: None
+        """
+        self.track_time = 0
+
+    def sleep(self, seconds: float):
+        """
+        Waits before the next change to the lights, and moves along the track.
+        :param seconds: Number of seconds to wait, measured from the end of the
+        previous sleep().
+        :return: None
+        """
+        self.track_time += seconds
+        super().sleep(seconds)
+
+    def sleep_beats(self, beats: int = 1):
+        """
+        Waits until a beat.
+        :param beats: Which beat to wait for, 1 for the very next one.
+        :return: None
+        """
+        self.sleep(self.beat_grid.next_beat(self.track_time, beats) - self.track_time)
+
+    def sleep_onset(self):
+        """
+        Waits until the next onset (drum hit, note, etc.).
+        :return: None
+        """
+        self.sleep(self.beat_grid.next_onset(self.track_time) - self.track_time)
+
+
+if __name__ == '__main__':
+    # Analyzes the WAV file given on the command line (or loads its cached
+    # analysis) and prints the tempo and the first beats.
+    grid = load(sys.argv[1])
+    print('%.1f BPM, %d beats, %d onsets in %.1f seconds' % (grid.bpm, len(grid.beats), len(grid.onsets), grid.duration))
+    print('first beats: %s' % (', '.join('%.3f' % (beat) for beat in grid.beats[:8])))
@@ -1,5 +1,3 @@
-import time
-
 import Pattern
 
 class PatternKit(Pattern.Pattern):
@@ -37,7 +35,7 @@ class PatternKit(Pattern.Pattern):
         self.lights.channel(14).off()
         self.lights.channel(15).on()
         self.lights.channel(16).off()
-        time.sleep(.5)
+        self.sleep(.5)
         self.lights.channel(1).off()
         self.lights.channel(2).off()
         self.lights.channel(3).on()
@@ -54,4 +52,4 @@ class PatternKit(Pattern.Pattern):
         self.lights.channel(14).on()
         self.lights.channel(15).off()
         self.lights.channel(16).on()
-        time.sleep(.5)
\ No newline at end of file
+        self.sleep(.5)
\ No newline at end of file
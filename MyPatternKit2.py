@@ -1,5 +1,3 @@
-import time
-
 import Pattern
 
 class PatternKit(Pattern.Pattern):
@@ -23,5 +21,5 @@ class PatternKit(Pattern.Pattern):
         """
         for i in range(1, 17):
             self.lights.channel(i).on()
-            time.sleep(.3)
+            self.sleep(.3)
             self.lights.channel(i).off()
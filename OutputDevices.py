@@ -0,0 +1,400 @@
+try:
+    # The I2C expander backend needs the smbus2 module, which is only on the
+    # Raspberry Pi.
+    from smbus2 import SMBus
+except ImportError:
+    SMBus = None
+
+try:
+    # The shift register backend can clock its frames out of the SPI port with
+    # the spidev module, which is only on the Raspberry Pi.
+    import spidev
+except ImportError:
+    spidev = None
+
+try:
+    from gpiozero import DigitalOutputDevice, PWMLED
+except ImportError:
+    DigitalOutputDevice = None
+    PWMLED = None
+
+
+class OutputDevice:
+    """
+    Parent class for everything that can turn outlets on and off.  An OutputDevice
+    has a number of pins (numbered 0 and up), and the Lights object writes all of
+    a frame's changes for one OutputDevice in one write() call.
+    """
+    # True for OutputDevices that can dim their pins with write_levels().  The
+    # Lights object dims the pins of the others with its software PwmEngine.
+    supports_pwm = False
+
+    # True for OutputDevices whose write() rewrites every pin from their own copy
+    # of the pins' state (shift registers, I2C expanders), so only one process may
+    # write them.  The SoftPwm.PwmProcess takes over the whole of such a device
+    # while it dims any of its pins, and only the dimmed pins of the others.
+    writes_every_pin = False
+
+    def __init__(self, name: str, pin_count: int):
+        """
+        A parent class for all OutputDevice objects.
+        :param name: The name of this OutputDevice as a string.
+        :param pin_count: The number of pins (outlets) on this OutputDevice.
+        """
+        self.name = name
+        self.pin_count = pin_count
+
+    def write(self, changes: dict):
+        """
+        A virtual method that turns pins on and off.
+        :param changes: A dictionary of pin number to True (on) or False (off).
+        Only pins that changed are in it.
+        :return: None
+        """
+        pass
+
+    def write_levels(self, levels: dict):
+        """
+        A virtual method that dims pins, for OutputDevices with supports_pwm.
+        :param levels: A dictionary of pin number to brightness (0 to 255).
+        :return: None
+        """
+        pass
+
+    def flush(self):
+        """
+        A virtual method called when the show is about to sleep.  Devices that need to
+        finish a frame (the simulator repaints its window) do it here.
+        :return: None
+        """
+        pass
+
+    def led(self, pin: int):
+        """
+        Returns the LED object for a pin, for devices that have them.
+        :param pin: The pin number.
+        :return: None, unless overridden.
+        """
+        return None
+
+    def close(self):
+        """
+        A virtual method that releases whatever the OutputDevice holds.
+        :return: None
+        """
+        pass
+
+
+class LedDevice(OutputDevice):
+    """
+    An OutputDevice with one LED object per pin.  This is a set of GPIO pins on
+    the Raspberry Pi (gpiozero LED or PWMLED objects), or the simulators' LED
+    objects.
+    """
+    def __init__(self, name: str, led_numbers: list, led_class: object, pwm: bool = False):
+        """
+        Initializes this LedDevice.
+        :param name: The name of this OutputDevice as a string.
+        :param led_numbers: The number to create each pin's LED object with, in pin
+        order.  These are GPIO pin numbers for gpiozero, channel numbers for the
+        simulators.
+        :param led_class: The LED class (from gpiozero, Simulator.py or
+        HeadlessSimulator.py).
+        :param pwm: True if the LED objects can be dimmed through their value (gpiozero
+        PWMLED objects).  LED classes with an apply_levels() hook can always be dimmed.
+        """
+        super().__init__(name, len(led_numbers))
+        self._led_class = led_class
+        self._leds = [led_class(number) for number in led_numbers]
+        self.supports_pwm = pwm or hasattr(led_class, 'apply_levels')
+
+    def led(self, pin: int):
+        """
+        Returns the LED object for a pin.
+        :param pin: The pin number.
+        :return: The LED object.
+        """
+        return self._leds[pin]
+
+    def write(self, changes: dict):
+        """
+        Turns pins on and off.  If the LED class has an apply_frame() hook, all of the
+        changes are handed to it in one call.  Otherwise each LED object is turned on
+        or off by itself.
+        :param changes: A dictionary of pin number to True (on) or False (off).
+        :return: None
+        """
+        apply_frame = getattr(self._led_class, 'apply_frame', None)
+        if apply_frame is not None:
+            apply_frame([(self._leds[pin], state) for pin, state in changes.items()])
+            return
+        for pin, state in changes.items():
+            if state:
+                self._leds[pin].on()
+            else:
+                self._leds[pin].off()
+
+    def write_levels(self, levels: dict):
+        """
+        Dims pins.  If the LED class has an apply_levels() hook, all of the levels are
+        handed to it in one call.  Otherwise each LED object's value is set.
+        :param levels: A dictionary of pin number to brightness (0 to 255).
+        :return: None
+        """
+        apply_levels = getattr(self._led_class, 'apply_levels', None)
+        if apply_levels is not None:
+            apply_levels([(self._leds[pin], level) for pin, level in levels.items()])
+            return
+        for pin, level in levels.items():
+            self._leds[pin].value = level / 255
+
+    def flush(self):
+        """
+        Lets the LED class finish showing the frame, if it has a flush() hook.
+        :return: None
+        """
+        flush = getattr(self._led_class, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def close(self):
+        """
+        Closes the LED objects that can be closed (gpiozero's can).
+        :return: None
+        """
+        for led in self._leds:
+            close = getattr(led, 'close', None)
+            if close is not None:
+                close()
+
+
+class I2CExpanderDevice(OutputDevice):
+    """
+    An MCP23017 16-pin I2C port expander.  A whole frame is written as one block
+    write of both output latch registers.
+    """
+    # Every write() sends both output latch registers.
+    writes_every_pin = True
+
+    # MCP23017 registers (with the default IOCON.BANK = 0 layout).
+    IODIRA = 0x00
+    OLATA = 0x14
+
+    def __init__(self, name: str, address: int, bus: int = 1, pin_count: int = 16):
+        """
+        Initializes this I2CExpanderDevice and makes all of its pins outputs.
+        :param name: The name of this OutputDevice as a string.
+        :param address: The I2C address of the expander.
+        :param bus: The I2C bus number.
+        :param pin_count: The number of pins used (up to 16).
+        """
+        super().__init__(name, pin_count)
+        if SMBus is None:
+            raise Exception('The smbus2 module is needed for the I2C expander "%s".' % (name))
+        self._address = address
+        self._bus = SMBus(bus)
+        # The bits of the output latches, pin 0 is the least significant bit of port A.
+        self._port = 0
+        self._bus.write_i2c_block_data(self._address, self.IODIRA, [0x00, 0x00])
+        self._write_port()
+
+    def _write_port(self):
+        """
+        Writes both output latch registers in one block write.
+        :return: None
+        """
+        self._bus.write_i2c_block_data(self._address, self.OLATA, [self._port & 0xff, (self._port >> 8) & 0xff])
+
+    def write(self, changes: dict):
+        """
+        Turns pins on and off.
+        :param changes: A dictionary of pin number to True (on) or False (off).
+        :return: None
+        """
+        for pin, state in changes.items():
+            if state:
+                self._port |= 1 << pin
+            else:
+                self._port &= ~(1 << pin)
+        self._write_port()
+
+    def close(self):
+        """
+        Turns off every pin and closes the I2C bus.
+        :return: None
+        """
+        self._port = 0
+        self._write_port()
+        self._bus.close()
+
+
+class RecordingShiftOutput:
+    """
+    A software stand-in for the pins of a shift register chain.  Instead of
+    clocking bits out, it records every frame's bytes.
+    """
+    def __init__(self):
+        """
+        Initializes the RecordingShiftOutput with no frames.
+        """
+        # The bytes of every frame shifted out, in order.
+        self.frames = []
+
+    def shift_out(self, data: bytes):
+        """
+        Records one frame.
+        :param data: The frame's bytes in the order they are shifted out.
+        :return: None
+        """
+        self.frames.append(bytes(data))
+
+    def bitstream(self):
+        """
+        :return: A string of "0" and "1" for every bit of every frame, in the order
+        they were shifted out.
+        """
+        return ''.join('{:08b}'.format(byte) for frame in self.frames for byte in frame)
+
+    def close(self):
+        """
+        Nothing to release.
+        :return: None
+        """
+        pass
+
+
+class GpioShiftOutput:
+    """
+    Bit-bangs a shift register chain on three GPIO pins.
+    """
+    def __init__(self, data_pin: int, clock_pin: int, latch_pin: int):
+        """
+        Initializes the GpioShiftOutput.
+        :param data_pin: The GPIO pin connected to the serial data input (DS).
+        :param clock_pin: The GPIO pin connected to the shift clock (SHCP).
+        :param latch_pin: The GPIO pin connected to the storage (latch) clock (STCP).
+        """
+        if DigitalOutputDevice is None:
+            raise Exception('The gpiozero module is needed to drive a shift register on GPIO pins.')
+        self._data = DigitalOutputDevice(data_pin)
+        self._clock = DigitalOutputDevice(clock_pin)
+        self._latch = DigitalOutputDevice(latch_pin)
+
+    def shift_out(self, data: bytes):
+        """
+        Clocks a frame into the chain, most significant bit first, and then latches
+        it to the outputs all at once.
+        :param data: The frame's bytes in the order they are shifted out.
+        :return: None
+        """
+        self._latch.off()
+        for byte in data:
+            for bit in range(7, -1, -1):
+                self._data.value = (byte >> bit) & 1
+                self._clock.on()
+                self._clock.off()
+        self._latch.on()
+
+    def close(self):
+        """
+        Releases the GPIO pins.
+        :return: None
+        """
+        for pin in (self._data, self._clock, self._latch):
+            pin.close()
+
+
+class SpiShiftOutput:
+    """
+    Clocks a shift register chain from the SPI port (MOSI to DS, SCLK to SHCP) in
+    one transfer per frame, with a GPIO pin for the latch.
+    """
+    def __init__(self, latch_pin: int, bus: int = 0, device: int = 0, speed_hz: int = 1000000):
+        """
+        Initializes the SpiShiftOutput.
+        :param latch_pin: The GPIO pin connected to the storage (latch) clock (STCP).
+        :param bus: The SPI bus number.
+        :param device: The SPI chip select number.
+        :param speed_hz: The SPI clock rate.
+        """
+        if spidev is None or DigitalOutputDevice is None:
+            raise Exception('The spidev and gpiozero modules are needed to drive a shift register from SPI.')
+        self._spi = spidev.SpiDev()
+        self._spi.open(bus, device)
+        self._spi.max_speed_hz = speed_hz
+        self._spi.mode = 0
+        self._latch = DigitalOutputDevice(latch_pin)
+
+    def shift_out(self, data: bytes):
+        """
+        Clocks a frame into the chain in one SPI transfer and then latches it to the
+        outputs all at once.
+        :param data: The frame's bytes in the order they are shifted out.
+        :return: None
+        """
+        self._latch.off()
+        self._spi.writebytes2(data)
+        self._latch.on()
+
+    def close(self):
+        """
+        Releases the SPI port and the latch pin.
+        :return: None
+        """
+        self._spi.close()
+        self._latch.close()
+
+
+class ShiftRegisterDevice(OutputDevice):
+    """
+    A chain of 74HC595-style shift registers.  Every write() shifts the state of
+    the whole chain out in one burst and latches it, so any number of outlets
+    change together no matter how many pins changed.  Pin 0 is output Q0 of the
+    register nearest the Raspberry Pi.
+    """
+    writes_every_pin = True
+
+    def __init__(self, name: str, pin_count: int, output: object):
+        """
+        Initializes this ShiftRegisterDevice and turns every pin off.
+        :param name: The name of this OutputDevice as a string.
+        :param pin_count: The number of pins (outlets), 8 per register.
+        :param output: The object that shifts the bytes out: a GpioShiftOutput,
+        SpiShiftOutput or RecordingShiftOutput.
+        """
+        super().__init__(name, pin_count)
+        self._output = output
+        self._byte_count = (pin_count + 7) // 8
+        # The state of every pin, pin 0 is the least significant bit.
+        self._bits = 0
+        self._shift_out()
+
+    def _shift_out(self):
+        """
+        Shifts the state of every pin out.  The byte for the register farthest from
+        the Raspberry Pi goes first, so it ends up in the last register.
+        :return: None
+        """
+        self._output.shift_out(self._bits.to_bytes(self._byte_count, 'big'))
+
+    def write(self, changes: dict):
+        """
+        Turns pins on and off with one burst for the whole chain.
+        :param changes: A dictionary of pin number to True (on) or False (off).
+        :return: None
+        """
+        for pin, state in changes.items():
+            if state:
+                self._bits |= 1 << pin
+            else:
+                self._bits &= ~(1 << pin)
+        self._shift_out()
+
+    def close(self):
+        """
+        Turns off every pin and releases the output.
+        :return: None
+        """
+        self._bits = 0
+        self._shift_out()
+        self._output.close()
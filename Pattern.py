@@ -1,21 +1,93 @@
+import Clock
+
+
+def create_pattern_kit(module: object, lights: object, clock: object, scheduler: object):
+    """
+    Creates the PatternKit object of a PatternKit module.  PatternKits written
+    before there were clocks only take the Lights object, so the clock is handed
+    over afterwards, the same way as the scheduler.
+    :param module: The imported PatternKit module.
+    :param lights: The Lights object (or a stand-in) for the PatternKit.
+    :param clock: The Clock object the PatternKit runs on.
+    :param scheduler: The Scheduler object that paces the PatternKit.
+    :return: The PatternKit object.
+    """
+    pattern_object = module.PatternKit(lights)
+    pattern_object.clock = clock
+    pattern_object.scheduler = scheduler
+    return pattern_object
+
+
 class Pattern:
     """
     Parent class for all of the PatternKit objects.  Holds some shared members.
     Provides a pure-virtual play() method.
     """
 
-    def __init__(self, name: str, lights: object):
+    def __init__(self, name: str, lights: object, clock: object = None):
         """
         A parent class for all PatternKit objects.
         :param name: The name of this PatternKit as a string.
         :param lights: A reference to the Lights object.  The lights object contains
         all of the channels that can be turned on or off.
+        :param clock: The Clock object this PatternKit runs on.  A Clock.RealClock
+        if None.
         """
         self.name = name
         self.lights = lights
+        self.clock = clock if clock is not None else Clock.RealClock()
+        # The Scheduler object that paces this PatternKit.  The PatternDriver
+        # sets this when it loads the PatternKit.
+        self.scheduler = None
+
+    def sleep(self, seconds: float):
+        """
+        Waits before the next change to the lights.  PatternKits should call this
+        instead of time.sleep() so that they can run on any clock and so that the
+        PatternDriver can keep them on time and stop them when their turn is over.
+        :param seconds: Number of seconds to wait, measured from the end of the
+        previous sleep().
+        :return: None
+        """
+        if self.scheduler is None:
+            self.clock.sleep(seconds)
+        else:
+            self.scheduler.sleep(seconds)
+
+    def now(self):
+        """
+        :return: The current time in seconds on this PatternKit's clock.
+        """
+        return self.clock.now()
 
     def play(self):
         """
         A virtual method that all PatternKit objects will implement to blink the lights.
         """
-        pass
\ No newline at end of file
+        pass
+
+
+class AsyncPattern(Pattern):
+    """
+    Parent class for PatternKit objects that play with asyncio.  Other tasks
+    (a control socket, sensors, logging, etc.) keep running while an AsyncPattern
+    waits between changes to the lights.  Needs the AsyncPatternDriver.
+    """
+
+    async def sleep(self, seconds: float):
+        """
+        Waits before the next change to the lights without blocking other tasks.
+        :param seconds: Number of seconds to wait, measured from the end of the
+        previous sleep().
+        :return: None
+        """
+        if self.scheduler is None:
+            await self.clock.async_sleep(seconds)
+        else:
+            await self.scheduler.async_sleep(seconds)
+
+    async def play(self):
+        """
+        A virtual coroutine that all asyncio PatternKit objects will implement to blink the lights.
+        """
+        pass
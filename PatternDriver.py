@@ -1,57 +1,207 @@
-import importlib
+import datetime
 import os
 import time
 
+import Clock
+import HeadlessSimulator
+import KitRegistry
 import Lights
+import Playlist
+import Scheduler
 
 FIVE_MINUTES_IN_SECONDS = 300
 
-PATTERN_KIT = 'PatternKit'
+PATTERN_KIT = KitRegistry.PATTERN_KIT
+
+# The name the lateness of the dark time between turns of a Playlist is kept under.
+DARK = '(dark)'
 
 class PatternDriver():
     """
     A class that loads numerous "PatternKit"s and runs them until a timeout.
     """
-    def __init__(self):
+    def __init__(self, clock: object = None, kit_directories: list = None):
         """
         Sets up the PatternDriver by creating the Lights objects and loading
         the PatternKit files.
+        :param clock: The Clock object to run the show on.  If None, the headless
+        simulator's VirtualClock when it is in use, otherwise a Clock.RealClock.
+        :param kit_directories: A list of directories to find PatternKit files in.
+        See KitRegistry.default_directories() if None.
         """
-        self.lights = Lights.Lights()
-        # A list of PatternKit objects that derive from Pattern objects.
+        if clock is None:
+            clock = HeadlessSimulator.CLOCK if Lights.use_headless else Clock.RealClock()
+        self.clock = clock
+        self.lights = Lights.Lights(clock=self.clock)
+        self.scheduler = Scheduler.Scheduler(self.clock)
+        # Let the Lights finish each frame (repaint the simulator) before sleeping.
+        self.scheduler.add_idle_callback(self.lights.flush)
+        # LatenessStats objects for each PatternKit, keyed by PatternKit name.
+        self.lateness = {}
+        # The index of the PatternKit files, read without importing them.
+        self.registry = KitRegistry.KitRegistry(kit_directories)
+        # A dictionary of PatternKit objects that derive from Pattern objects, keyed by name.
         self.pattern_objects = {}
+        # The KitRegistry.KitWatcher that finds edited PatternKit files, once watch_kits() is called.
+        self.watcher = None
         self.load_pattern_kits()
         if len(self.pattern_objects) == 0:
-            raise Exception('No patterns found.  There must be one module in the current directory with "%s" in its name.'%(PATTERN_KIT))
+            raise Exception('No patterns found.  There must be one module in %s with "%s" in its name.'%(
+                os.pathsep.join(self.registry.directories), PATTERN_KIT))
 
     def load_pattern_kits(self):
         """
-        Imports PatternKit files and stores them in a list to be executed.
+        Makes the PatternKits in the registry ready to be executed.  Each one is
+        only imported and created the first time it is about to play.
+        :return: None
+        """
+        self.pattern_objects = KitRegistry.LazyKits(self.registry, self.lights, self.clock, self.scheduler)
+
+    def watch_kits(self):
+        """
+        Starts watching the PatternKit files, so that reload_kits() picks up the
+        ones that are edited, added or removed while the show runs.
         :return: None
         """
-        all_files = os.listdir('.')
-        for item in all_files:
-            # Add files that contain the word 'PatternKit' in their name to the list of Patterns.
-            if os.path.isfile(item) and (PATTERN_KIT in item):
-                # Get the filename without the extension.
-                module_name = os.path.splitext(item)[0]
-                pattern_kit = importlib.import_module(module_name)
-                pattern_object = pattern_kit.PatternKit(self.lights)
-                self.pattern_objects[module_name] = pattern_object
+        if self.watcher is None:
+            self.watcher = KitRegistry.KitWatcher(self.registry)
+
+    def reload_kits(self):
+        """
+        Swaps in new PatternKit objects for the PatternKit files that changed since
+        the last call.  Called between play() calls, so a PatternKit is never
+        swapped in the middle of one.  Does nothing unless watch_kits() was called.
+        :return: A set of the names of the PatternKits that were replaced or removed.
+        """
+        if self.watcher is None:
+            return set()
+        names = self.watcher.changes()
+        if not names:
+            return set()
+        self.registry.scan()
+        return self.pattern_objects.reload(names)
+
+    def lateness_stats(self, name: str):
+        """
+        Returns the LatenessStats object for a PatternKit, creating it if needed.
+        :param name: The name of the PatternKit module.
+        :return: A Scheduler.LatenessStats object.
+        """
+        if name not in self.lateness:
+            self.lateness[name] = Scheduler.LatenessStats()
+        return self.lateness[name]
 
-    def run(self, timeout_sec : int = FIVE_MINUTES_IN_SECONDS):
+    def run(self, timeout_sec : int = FIVE_MINUTES_IN_SECONDS, cycles: int = None):
         """
         Loops forever, running each of the PatternKits in succession for
         timeout_sec seconds each.
         :param timeout_sec: Number of seconds to run a PatternKit before
         starting another PatternKit
-        :return: None (Never returns)
+        :param cycles: Number of times to run through all of the PatternKits, or
+        None to loop forever.
+        :return: None (Never returns unless cycles is given)
         """
-        while True:
+        cycle = 0
+        while cycles is None or cycle < cycles:
+            cycle += 1
+            played = False
             for pattern_object in self.pattern_objects.keys():
-                # Loop running this pattern_kit until the requested timeout expires.
-                # The pattern_kit will complete, it will not be interrupted at timeout.
-                self.lights.reset()
-                end_time = time.time() + timeout_sec
-                while end_time > time.time():
-                    self.pattern_objects[pattern_object].play()
\ No newline at end of file
+                self.reload_kits()
+                if pattern_object not in self.pattern_objects:
+                    # Its file was removed.
+                    continue
+                if self.play_turn(pattern_object, timeout_sec) is not False:
+                    played = True
+            if not played:
+                # Every PatternKit failed to load.  Wait a turn for a fix instead of
+                # trying them all over again right away.
+                self.sleep_dark(timeout_sec)
+
+    def play_turn(self, name: str, timeout_sec: float):
+        """
+        Runs one PatternKit for timeout_sec seconds.
+        :param name: The name of the PatternKit module.
+        :param timeout_sec: Number of seconds the PatternKit's turn lasts.
+        :return: False if the PatternKit could not be loaded, so its turn was
+        skipped (the error is in pattern_objects.reload_errors), otherwise None.
+        """
+        # Loop running this pattern_kit until the requested timeout expires.
+        # The Scheduler interrupts the pattern_kit in its sleep() at timeout.
+        self.lights.reset()
+        self.scheduler.stats = self.lateness_stats(name)
+        self.scheduler.start(timeout_sec)
+        try:
+            while not self.scheduler.expired():
+                # Look the PatternKit up every time, in case it was reloaded.
+                self.pattern_objects[name].play()
+                self.reload_kits()
+                if name not in self.pattern_objects:
+                    break
+        except Scheduler.KitTimeout:
+            pass
+        except KitRegistry.KitLoadError:
+            return False
+
+    def run_schedule(self, playlist: object, start_time: float = None):
+        """
+        Runs the show a Playlist lays out instead of taking turns in order, and
+        keeps the lights dark between its shows.  The turns are worked out ahead of
+        time into a Playlist.Schedule, so finding the next one is a binary search.
+        :param playlist: The Playlist.Playlist object.
+        :param start_time: The time, in seconds since the epoch, that the show's
+        clock starts at.  Now if None.  Handy with a faster clock to preview an
+        evening's show.
+        :return: None (Never returns unless the playlist has a season)
+        """
+        unknown = [kit[0] for kit in playlist.kits if kit[0] not in self.pattern_objects]
+        if unknown:
+            raise Exception('The playlist "%s" has kits that were not found: %s' % (playlist.name, ', '.join(unknown)))
+        # The time of day is worked out from the show's clock, so the show follows
+        # an accelerated or virtual clock too.
+        if start_time is None:
+            start_time = time.time()
+        base_ns = self.scheduler.now_ns()
+        schedule = None
+        planned_until = 0
+        while True:
+            now = start_time + (self.scheduler.now_ns() - base_ns) / Scheduler.NS_PER_SECOND
+            slot = None if schedule is None else schedule.next_slot(now)
+            if slot is None:
+                if now < planned_until:
+                    self.sleep_dark(planned_until - now)
+                    continue
+                if schedule is not None and playlist.last_date is not None:
+                    # The season is over.
+                    return
+                # Plan from the day before, in case its show runs past midnight.
+                first_date = datetime.date.fromtimestamp(now) - datetime.timedelta(days=1)
+                if playlist.first_date is not None:
+                    first_date = max(first_date, playlist.first_date)
+                days = Playlist.DEFAULT_DAYS
+                if playlist.last_date is not None:
+                    days = (playlist.last_date - first_date).days + 1
+                if days <= 0:
+                    return
+                schedule = playlist.schedule(first_date, days)
+                planned_until = Playlist.local_time(first_date + datetime.timedelta(days=days), 0)
+                continue
+            start, end, name = slot
+            self.reload_kits()
+            if start > now:
+                self.sleep_dark(start - now)
+            elif name not in self.pattern_objects:
+                # Its file was removed.
+                self.sleep_dark(end - now)
+            elif self.play_turn(name, end - now) is False:
+                # It could not be loaded, so its time is dark.
+                self.sleep_dark(end - now)
+
+    def sleep_dark(self, seconds: float):
+        """
+        Turns the lights off for a while between turns.
+        :param seconds: How many seconds to stay dark.
+        :return: None
+        """
+        self.lights.reset()
+        self.scheduler.stats = self.lateness_stats(DARK)
+        self.scheduler.sleep_until(self.scheduler.now_ns() + int(seconds * Scheduler.NS_PER_SECOND))
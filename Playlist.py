@@ -0,0 +1,335 @@
+import bisect
+import datetime
+import json
+import math
+import sys
+
+# How long a PatternKit plays when neither it nor the playlist says, in seconds.
+DEFAULT_DURATION_SEC = 300
+
+# How many days a Schedule covers when the playlist has no season.
+DEFAULT_DAYS = 7
+
+# The sun is down when its center is this many degrees below the horizon, which
+# allows for refraction and the size of the sun.
+SUNSET_ALTITUDE = -0.833
+
+# The tilt of the earth's axis, in degrees.
+AXIAL_TILT = 23.4397
+
+# The Julian date of 2000-01-01 12:00 UTC, and of the Unix epoch.
+J2000 = 2451545.0
+UNIX_EPOCH_JD = 2440587.5
+
+SECONDS_PER_DAY = 86400
+
+
+def sun_times(date: object, latitude: float, longitude: float):
+    """
+    Works out when the sun rises and sets with the sunrise equation, which is
+    good to a minute or two away from the poles.
+    :param date: The datetime.date.
+    :param latitude: The latitude in degrees, north positive.
+    :param longitude: The longitude in degrees, east positive.
+    :return: A tuple of the sunrise and sunset times, in seconds since the epoch.
+    Where the sun does not set (or rise) that day, both are solar noon.
+    """
+    # Days since J2000 at noon UTC on the date, moved to local solar noon.
+    days = date.toordinal() + 1721425 - J2000 - longitude / 360
+    anomaly = math.radians((357.5291 + 0.98560028 * days) % 360)
+    center = 1.9148 * math.sin(anomaly) + 0.02 * math.sin(2 * anomaly) + 0.0003 * math.sin(3 * anomaly)
+    ecliptic = math.radians((math.degrees(anomaly) + center + 180 + 102.9372) % 360)
+    transit = J2000 + days + 0.0053 * math.sin(anomaly) - 0.0069 * math.sin(2 * ecliptic)
+    declination = math.asin(math.sin(ecliptic) * math.sin(math.radians(AXIAL_TILT)))
+    latitude = math.radians(latitude)
+    cos_hour_angle = ((math.sin(math.radians(SUNSET_ALTITUDE)) - math.sin(latitude) * math.sin(declination)) /
+                      (math.cos(latitude) * math.cos(declination)))
+    hour_angle = math.degrees(math.acos(min(1, max(-1, cos_hour_angle))))
+    if abs(cos_hour_angle) > 1:
+        hour_angle = 0
+    sunrise = transit - hour_angle / 360
+    sunset = transit + hour_angle / 360
+    return (sunrise - UNIX_EPOCH_JD) * SECONDS_PER_DAY, (sunset - UNIX_EPOCH_JD) * SECONDS_PER_DAY
+
+
+def local_time(date: object, seconds: float):
+    """
+    :param date: The datetime.date.
+    :param seconds: Seconds since local midnight of the date.  More than a day
+    runs into the next day.
+    :return: The time in seconds since the epoch, in the local time zone.
+    """
+    midnight = datetime.datetime.combine(date, datetime.time()) + datetime.timedelta(seconds=seconds)
+    return midnight.astimezone().timestamp()
+
+
+def parse_clock(text: str):
+    """
+    Parses a clock time or offset.
+    :param text: "HH:MM", "HH:MM:SS" or a number of minutes.
+    :return: The number of seconds.
+    """
+    if ':' not in text:
+        return float(text) * 60
+    seconds = 0
+    for part in text.split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds * 60 ** (3 - len(text.split(':')))
+
+
+class Playlist:
+    """
+    What a display plays when, read from a JSON file:
+
+        {
+          "name": "Front yard",
+          "latitude": 39.74, "longitude": -104.99,
+          "season": ["2026-11-27", "2027-01-06"],
+          "start": "sunset-0:15", "end": "23:00",
+          "blackout": [["21:00", "21:05"]],
+          "duration": 300,
+          "kits": [
+            {"name": "MyPatternKit", "weight": 2},
+            {"name": "MyPatternKit2", "duration": 60, "window": ["sunset", "21:00"]}
+          ]
+        }
+
+    Times are "HH:MM" local time, or "sunrise"/"sunset" with an optional +/- offset
+    (which needs the latitude and longitude).  A window or show whose end is not
+    after its start runs past midnight.  Every key but "kits" can be left out: the
+    show then runs all day, every day from today, and each PatternKit plays for
+    "duration" seconds at a time with a weight of 1 within its window.
+    """
+    def __init__(self, playlist: dict):
+        """
+        Initializes the Playlist.
+        :param playlist: The parsed JSON, see above.
+        """
+        self.name = playlist.get('name', '')
+        self.latitude = playlist.get('latitude')
+        self.longitude = playlist.get('longitude')
+        season = playlist.get('season')
+        self.first_date = datetime.date.fromisoformat(season[0]) if season else None
+        self.last_date = datetime.date.fromisoformat(season[1]) if season else None
+        self.start = playlist.get('start', '0:00')
+        self.end = playlist.get('end', '0:00')
+        self.blackouts = playlist.get('blackout', [])
+        duration = playlist.get('duration', DEFAULT_DURATION_SEC)
+        # Tuples of (name, duration, weight, window) for each PatternKit.
+        self.kits = []
+        for kit in playlist['kits']:
+            weight = kit.get('weight', 1)
+            if weight < 0:
+                raise Exception('The weight of "%s" in the playlist cannot be negative.' % (kit['name']))
+            if kit.get('duration', duration) <= 0:
+                raise Exception('The duration of "%s" in the playlist must be more than 0.' % (kit['name']))
+            self.kits.append((kit['name'], kit.get('duration', duration), weight, kit.get('window')))
+        if not self.kits:
+            raise Exception('The playlist "%s" has no kits.' % (self.name))
+        # Check every time now rather than in the middle of the show.
+        for text in [self.start, self.end] + [text for blackout in self.blackouts for text in blackout] + \
+                [text for kit in self.kits if kit[3] for text in kit[3]]:
+            self.resolve(text, datetime.date(2000, 6, 21))
+
+    @classmethod
+    def load(cls, filename: str):
+        """
+        :param filename: The filename of a playlist JSON file.
+        :return: A Playlist object.
+        """
+        with open(filename) as playlist_file:
+            return cls(json.load(playlist_file))
+
+    def resolve(self, text: str, date: object):
+        """
+        :param text: A time from the playlist, "HH:MM" or "sunset+HH:MM" for example.
+        :param date: The datetime.date it is on.
+        :return: The time in seconds since the epoch.
+        """
+        text = text.strip().lower()
+        for event, index in (('sunrise', 0), ('sunset', 1)):
+            if text.startswith(event):
+                if self.latitude is None or self.longitude is None:
+                    raise Exception('The playlist "%s" needs a latitude and longitude for "%s".' % (self.name, text))
+                offset = text[len(event):].strip()
+                seconds = 0
+                if offset:
+                    if offset[0] not in '+-':
+                        raise Exception('Cannot read the time "%s" in the playlist "%s".' % (text, self.name))
+                    seconds = parse_clock(offset[1:]) * (-1 if offset[0] == '-' else 1)
+                return sun_times(date, self.latitude, self.longitude)[index] + seconds
+        try:
+            return local_time(date, parse_clock(text))
+        except ValueError:
+            raise Exception('Cannot read the time "%s" in the playlist "%s".' % (text, self.name))
+
+    def window(self, pair: list, date: object):
+        """
+        :param pair: A [start, end] pair of times from the playlist.
+        :param date: The datetime.date the window starts on.
+        :return: A tuple of the start and end in seconds since the epoch.  An end
+        that is not after the start is moved to the next day.
+        """
+        start = self.resolve(pair[0], date)
+        end = self.resolve(pair[1], date)
+        if end <= start:
+            end = self.resolve(pair[1], date + datetime.timedelta(days=1))
+        return start, end
+
+    def kit_windows(self, pair: list, date: object):
+        """
+        :param pair: A PatternKit's [start, end] window from the playlist.
+        :param date: The datetime.date of a show.
+        :return: A sorted list of (start, end) tuples of when the window is open
+        around that show.  The windows that start the day before and the day after
+        are included, because a window or a show can run past midnight, and windows
+        that touch are joined into one.
+        """
+        intervals = []
+        for day in (date - datetime.timedelta(days=1), date, date + datetime.timedelta(days=1)):
+            start, end = self.window(pair, day)
+            if intervals and start <= intervals[-1][1]:
+                intervals[-1] = (intervals[-1][0], max(intervals[-1][1], end))
+            else:
+                intervals.append((start, end))
+        return intervals
+
+    def _show_intervals(self, date: object):
+        """
+        :param date: The datetime.date the show starts on.
+        :return: A list of (start, end) tuples of when the show is on that day, with
+        the blackouts taken out.
+        """
+        intervals = [self.window([self.start, self.end], date)]
+        for blackout in self.blackouts:
+            # A blackout from the day before can run past midnight into this show.
+            for day in (date - datetime.timedelta(days=1), date, date + datetime.timedelta(days=1)):
+                dark_start, dark_end = self.window(blackout, day)
+                cut = []
+                for start, end in intervals:
+                    if dark_end <= start or dark_start >= end:
+                        cut.append((start, end))
+                        continue
+                    if start < dark_start:
+                        cut.append((start, dark_start))
+                    if dark_end < end:
+                        cut.append((dark_end, end))
+                intervals = cut
+        return intervals
+
+    def schedule(self, first_date: object = None, days: int = None):
+        """
+        Works out every turn of the show ahead of time.  The PatternKits take turns
+        by smooth weighted round robin among the ones whose windows are open, so the
+        order is the same every time the Schedule is built.
+        :param first_date: The datetime.date of the first show.  The start of the
+        season, or today, if None.
+        :param days: How many days of shows to plan.  To the end of the season, or
+        DEFAULT_DAYS, if None.
+        :return: A Schedule object.
+        """
+        if first_date is None:
+            first_date = self.first_date or datetime.date.today()
+        if days is None:
+            days = (self.last_date - first_date).days + 1 if self.last_date else DEFAULT_DAYS
+        starts, ends, names = [], [], []
+        # The smooth weighted round robin credit of each PatternKit, carried from day to day.
+        credit = [0] * len(self.kits)
+        for day in range(days):
+            date = first_date + datetime.timedelta(days=day)
+            windows = [self.kit_windows(kit[3], date) if kit[3] else [(-math.inf, math.inf)] for kit in self.kits]
+            for show_start, show_end in self._show_intervals(date):
+                # Never overlap a show from the day before that ran past midnight.
+                time = max(show_start, ends[-1] if ends else show_start)
+                edges = sorted({edge for intervals in windows for window in intervals for edge in window
+                                if show_start < edge < show_end})
+                edges.append(show_end)
+                # The PatternKits whose windows are open only change at an edge.
+                next_edge = -math.inf
+                while time < show_end:
+                    if time >= next_edge:
+                        next_edge = edges[bisect.bisect_right(edges, time)]
+                        # The end of each open PatternKit's window, keyed by its index.
+                        open_until = {index: end for index, kit in enumerate(self.kits) if kit[2] > 0
+                                      for start, end in windows[index] if start <= time < end}
+                        open_kits = sorted(open_until)
+                    if not open_kits:
+                        # Dark until the next window opens.
+                        time = next_edge
+                        continue
+                    total = 0
+                    for index in open_kits:
+                        credit[index] += self.kits[index][2]
+                        total += self.kits[index][2]
+                    pick = max(open_kits, key=lambda index: credit[index])
+                    credit[pick] -= total
+                    end = min(time + self.kits[pick][1], show_end, open_until[pick])
+                    starts.append(time)
+                    ends.append(end)
+                    names.append(self.kits[pick][0])
+                    time = end
+        return Schedule(starts, ends, names)
+
+
+class Schedule:
+    """
+    Every turn of a show, worked out ahead of time by Playlist.schedule() and
+    kept as sorted lists, so finding the turn at any moment of the season is a
+    binary search.
+    """
+    def __init__(self, starts: list, ends: list, names: list):
+        """
+        Initializes the Schedule.
+        :param starts: A sorted list of the start of each turn, in seconds since the epoch.
+        :param ends: A list of the end of each turn.  No turn overlaps the next.
+        :param names: A list of the name of the PatternKit of each turn.
+        """
+        self.starts = starts
+        self.ends = ends
+        self.names = names
+
+    def __len__(self):
+        """
+        :return: The number of turns.
+        """
+        return len(self.starts)
+
+    @property
+    def end(self):
+        """
+        :return: The end of the last turn, in seconds since the epoch.
+        """
+        return self.ends[-1] if self.ends else -math.inf
+
+    def slot_at(self, time: float):
+        """
+        :param time: A time in seconds since the epoch.
+        :return: A tuple of the (start, end, name) of the turn at that time, or
+        None if the show is dark then.
+        """
+        index = bisect.bisect_right(self.starts, time) - 1
+        if index >= 0 and time < self.ends[index]:
+            return self.starts[index], self.ends[index], self.names[index]
+        return None
+
+    def next_slot(self, time: float):
+        """
+        :param time: A time in seconds since the epoch.
+        :return: A tuple of the (start, end, name) of the turn at that time, or of
+        the next turn if the show is dark then, or None if there are no more turns.
+        """
+        index = bisect.bisect_right(self.starts, time) - 1
+        if index < 0 or time >= self.ends[index]:
+            index += 1
+        if index < len(self.starts):
+            return self.starts[index], self.ends[index], self.names[index]
+        return None
+
+
+if __name__ == '__main__':
+    # Prints the turns of a playlist's first show.
+    playlist = Playlist.load(sys.argv[1])
+    schedule = playlist.schedule(days=1)
+    for slot_start, slot_end, slot_name in zip(schedule.starts, schedule.ends, schedule.names):
+        print('%s - %s %s' % (datetime.datetime.fromtimestamp(slot_start).strftime('%a %H:%M:%S'),
+                              datetime.datetime.fromtimestamp(slot_end).strftime('%H:%M:%S'), slot_name))
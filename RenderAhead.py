@@ -0,0 +1,230 @@
+import multiprocessing
+import time
+
+import FrameRing
+import KitProcess
+import KitRegistry
+import PatternDriver
+import Scheduler
+
+# How many seconds of frames the PatternKits can render ahead of the lights.
+BUFFER_SEC = 1
+
+# The most frames the FrameRing holds, however close together they are.
+RING_CAPACITY = 1024
+
+
+class BufferedLights(KitProcess.RingLights):
+    """
+    The RingLights object the PatternKits draw on in a RenderAheadDriver.  Frames
+    are only pushed up to BUFFER_SEC ahead of the frame the lights are showing.
+    """
+    def __init__(self, ring: object, clock: object, channel_numbers: list, position: object,
+                 buffer_sec: float = BUFFER_SEC):
+        """
+        Initializes the BufferedLights object.
+        :param ring: The FrameRing to push frames into.
+        :param clock: The VirtualClock the PatternKits run on.
+        :param channel_numbers: The channel numbers of the real Lights object.
+        :param position: A function that returns how far into the show the lights
+        are, in nanoseconds of the PatternKits' VirtualClock.
+        :param buffer_sec: How many seconds of frames can be pushed ahead.
+        """
+        super().__init__(ring, clock, channel_numbers)
+        self._position = position
+        self._buffer_ns = int(buffer_sec * Scheduler.NS_PER_SECOND)
+
+    def flush(self):
+        """
+        Waits until the finished frame is no more than buffer_sec ahead of the
+        lights and pushes it into the FrameRing.  A frame is never held back while
+        the FrameRing is empty, because then the lights have nothing to wait on.
+        :return: None
+        """
+        if self._pending:
+            time_ns = self._clock.monotonic_ns()
+            while len(self._ring) > 0 and time_ns - self._position() > self._buffer_ns:
+                time.sleep(KitProcess.POLL_SEC)
+        super().flush()
+
+
+def _render_worker(kit_directories: list, watch: bool, ring_name: str, capacity: int, mask_bytes: int,
+                   channel_numbers: list, position: object, end: object, buffer_sec: float,
+                   timeout_sec: float, cycles: int):
+    """
+    The body of the render process.  Plays each of the PatternKits in succession
+    for timeout_sec seconds of VirtualClock time, pushing their frames into the
+    FrameRing no more than buffer_sec ahead of the lights.
+    :param kit_directories: The directories to find PatternKit files in.
+    :param watch: If True, PatternKit files edited while the show runs are reloaded.
+    :param ring_name: The name of the FrameRing's shared memory.
+    :param capacity: The number of frames the FrameRing holds.
+    :param mask_bytes: The number of bytes in each frame's channel bitmask.
+    :param channel_numbers: The channel numbers of the real Lights object.
+    :param position: A shared integer the output loop keeps set to how far into
+    the show the lights are, in nanoseconds of the VirtualClock.
+    :param end: A shared integer set to the VirtualClock time the show ends at.
+    :param buffer_sec: How many seconds of frames can be pushed ahead.
+    :param timeout_sec: Number of seconds to run a PatternKit.
+    :param cycles: Number of times to run through all of the PatternKits, or
+    None to loop forever.
+    :return: None
+    """
+    lights, clock, scheduler = KitProcess.setup_worker(ring_name, capacity, mask_bytes, channel_numbers,
+                                                       BufferedLights, lambda: position.value, buffer_sec)
+    registry = KitRegistry.KitRegistry(kit_directories)
+    pattern_objects = KitRegistry.LazyKits(registry, lights, clock, scheduler)
+    watcher = KitRegistry.KitWatcher(registry) if watch else None
+
+    def reload_kits():
+        if watcher is not None:
+            names = watcher.changes()
+            if names:
+                registry.scan()
+                pattern_objects.reload(names)
+
+    cycle = 0
+    while cycles is None or cycle < cycles:
+        cycle += 1
+        for name in pattern_objects.keys():
+            reload_kits()
+            if name not in pattern_objects:
+                continue
+            lights.reset()
+            turn_end_ns = scheduler.now_ns() + int(timeout_sec * Scheduler.NS_PER_SECOND)
+            scheduler.start(timeout_sec)
+            try:
+                while not scheduler.expired():
+                    pattern_objects[name].play()
+                    reload_kits()
+                    if name not in pattern_objects:
+                        break
+            except Scheduler.KitTimeout:
+                pass
+            except KitRegistry.KitLoadError:
+                # Dark for its turn.  The VirtualClock has to move on, or a show of
+                # nothing but broken PatternKits would spin without rendering a frame.
+                scheduler.sleep_until(turn_end_ns)
+    lights.flush()
+    end.value = clock.monotonic_ns()
+
+
+class RenderAheadDriver(PatternDriver.PatternDriver):
+    """
+    A PatternDriver that splits the show into two loops.  The PatternKits play in
+    a process of their own against a VirtualClock, rendering frames up to
+    BUFFER_SEC ahead into a FrameRing.  The output loop in the calling process
+    pops the frames and writes them to the Lights at their deadlines, so a
+    PatternKit that pauses (garbage collection, a slow SD card) does not stall
+    the lights as long as the buffer lasts, and the PatternKits never hold the
+    output loop's GIL.
+    """
+    def __init__(self, clock: object = None, buffer_sec: float = BUFFER_SEC):
+        """
+        Sets up the RenderAheadDriver.
+        :param clock: The Clock object the lights are paced on.
+        :param buffer_sec: How many seconds of frames the PatternKits can render ahead.
+        """
+        self.buffer_sec = buffer_sec
+        # How far into the show the lights are, and the VirtualClock time the render
+        # process ended at, shared with the render process.
+        self._position = multiprocessing.RawValue('q', 0)
+        self._end = multiprocessing.RawValue('q', 0)
+        self._process = None
+        super().__init__(clock)
+
+    def load_pattern_kits(self):
+        """
+        Indexes the PatternKit files the same way as the PatternDriver, so the
+        playlist and the PatternKit names can be checked, and creates the FrameRing.
+        The PatternKits are only ever imported by the render process.
+        :return: None
+        """
+        super().load_pattern_kits()
+        self.ring = FrameRing.FrameRing(RING_CAPACITY, (max(self.lights.channel_numbers, default=1) + 7) // 8)
+
+    def position_ns(self):
+        """
+        :return: How far into the show the lights are, in nanoseconds of the
+        render process's VirtualClock.
+        """
+        return self._position.value
+
+    def run(self, timeout_sec: int = PatternDriver.FIVE_MINUTES_IN_SECONDS, cycles: int = None):
+        """
+        Starts the render process and runs the output loop until the render
+        process is done and every frame has been played.
+        :param timeout_sec: Number of seconds to run a PatternKit before
+        starting another PatternKit
+        :param cycles: Number of times to run through all of the PatternKits, or
+        None to loop forever.
+        :return: None (Never returns unless cycles is given)
+        """
+        self._position.value = 0
+        self._end.value = 0
+        self.ring.clear()
+        self._process = multiprocessing.Process(
+            target=_render_worker, name='RenderAhead', daemon=True,
+            args=(self.registry.directories, self.watcher is not None, self.ring.name, self.ring.capacity,
+                  self.ring.mask_bytes, self.lights.channel_numbers, self._position, self._end,
+                  self.buffer_sec, timeout_sec, cycles))
+        self._process.start()
+        # The show time of frame 0, set when the first frame is played.
+        base_ns = None
+        try:
+            while True:
+                # Look at the process before popping, so a frame pushed just before
+                # the render process finished is not missed.
+                done = not self._process.is_alive()
+                frame = self.ring.pop()
+                if frame is None:
+                    if done:
+                        break
+                    time.sleep(KitProcess.POLL_SEC)
+                    continue
+                time_ns, mask = frame
+                if base_ns is None:
+                    base_ns = self.scheduler.now_ns() - time_ns
+                self.scheduler.sleep_until(base_ns + time_ns)
+                self.lights.set_frame(mask)
+                self._position.value = time_ns
+            self._process.join()
+            if self._process.exitcode != 0:
+                raise Exception('The render process failed with exit code %s.' % (self._process.exitcode))
+            if base_ns is not None:
+                self.scheduler.sleep_until(base_ns + self._end.value)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Stops the render process, killing it if it does not exit right away.
+        :return: None
+        """
+        if self._process is not None:
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join(KitProcess.STOP_TIMEOUT_SEC)
+                if self._process.is_alive():
+                    self._process.kill()
+                    self._process.join()
+            self._process = None
+
+    def run_schedule(self, playlist: object, start_time: float = None):
+        """
+        Not supported: the render process would have to know the Playlist's turns
+        ahead of the lights.
+        :param playlist: The Playlist.Playlist object.
+        :param start_time: The time the show's clock starts at.
+        :return: None
+        """
+        raise Exception('The RenderAheadDriver cannot run a playlist.')
+
+    def close(self):
+        """
+        Stops the render process and frees the FrameRing.  The RenderAheadDriver
+        cannot run after this.
+        :return: None
+        """
+        self.stop()
+        self.ring.close()
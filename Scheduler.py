@@ -0,0 +1,200 @@
+import Clock
+
+NS_PER_SECOND = Clock.NS_PER_SECOND
+
+NS_PER_MILLISECOND = 1000000
+
+
+class KitTimeout(Exception):
+    """
+    Raised out of Scheduler.sleep() when a PatternKit reaches the end of its turn.
+    The PatternDriver catches it to preempt the PatternKit.
+    """
+    pass
+
+
+class LatenessStats:
+    """
+    Keeps track of how late the Scheduler woke up for each frame.
+    """
+    def __init__(self):
+        """
+        Initializes the LatenessStats with no frames.
+        """
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets every frame recorded so far.
+        :return: None
+        """
+        self.frames = 0
+        self.late_frames = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, late_ns: int):
+        """
+        Records how late one frame was.
+        :param late_ns: How many nanoseconds after its deadline the frame started.
+        :return: None
+        """
+        self.frames += 1
+        if late_ns > 0:
+            self.late_frames += 1
+            self.total_ns += late_ns
+            if late_ns > self.max_ns:
+                self.max_ns = late_ns
+
+    def mean_ms(self):
+        """
+        :return: The average lateness of all the frames in milliseconds.
+        """
+        if self.frames == 0:
+            return 0.0
+        return self.total_ns / self.frames / NS_PER_MILLISECOND
+
+    def max_ms(self):
+        """
+        :return: The lateness of the latest frame in milliseconds.
+        """
+        return self.max_ns / NS_PER_MILLISECOND
+
+    def __str__(self):
+        """
+        :return: A one line summary of the lateness of the frames.
+        """
+        return '%d frames, %d late, mean %.3f ms, max %.3f ms' % (
+            self.frames, self.late_frames, self.mean_ms(), self.max_ms())
+
+
+class Scheduler:
+    """
+    Paces PatternKits against absolute deadlines.  Every sleep() is measured from
+    the deadline of the previous sleep() rather than from when it was called, so
+    the time spent turning channels on and off never adds up into drift.
+    """
+    def __init__(self, clock: object = None, spin_ns: int = None):
+        """
+        Initializes the Scheduler.
+        :param clock: The Clock object to pace against.  A Clock.RealClock if None.
+        :param spin_ns: How many nanoseconds before a deadline to stop sleeping and
+        start spinning on the clock.  Defaults to the clock's spin_ns.
+        """
+        self.clock = clock if clock is not None else Clock.RealClock()
+        self.spin_ns = spin_ns if spin_ns is not None else self.clock.spin_ns
+        self.stats = LatenessStats()
+        # The deadline the next sleep() is measured from.
+        self._cursor_ns = None
+        # When the current PatternKit's turn ends, or None for no limit.
+        self._end_ns = None
+        # Functions to call each time the Scheduler is about to sleep.
+        self._idle_callbacks = []
+
+    def add_idle_callback(self, callback: object):
+        """
+        Adds a function to call each time the Scheduler is about to sleep, which is
+        when a frame is finished.  The time it takes is taken out of the sleep.
+        :param callback: A function that takes no arguments.
+        :return: None
+        """
+        self._idle_callbacks.append(callback)
+
+    def now_ns(self):
+        """
+        :return: The current time from the clock in nanoseconds.
+        """
+        return self.clock.monotonic_ns()
+
+    def start(self, timeout_sec: float = None):
+        """
+        Starts a new turn.  The next sleep() is measured from now.
+        :param timeout_sec: Number of seconds until the turn ends, or None for no limit.
+        :return: None
+        """
+        self._cursor_ns = self.now_ns()
+        if timeout_sec is None:
+            self._end_ns = None
+        else:
+            self._end_ns = self._cursor_ns + int(timeout_sec * NS_PER_SECOND)
+
+    def expired(self):
+        """
+        :return: True if the current turn has ended.
+        """
+        return self._end_ns is not None and self.now_ns() >= self._end_ns
+
+    def preempt(self):
+        """
+        Ends the current turn now.  The next sleep() raises KitTimeout.
+        :return: None
+        """
+        self._end_ns = self.now_ns()
+
+    def sleep(self, seconds: float):
+        """
+        Sleeps until seconds after the previous deadline.  If the turn ends first,
+        sleeps until the end of the turn and raises KitTimeout.
+        :param seconds: Number of seconds after the previous deadline to wake up.
+        :return: None
+        """
+        if self._cursor_ns is None:
+            self.start()
+        deadline_ns = self._cursor_ns + int(seconds * NS_PER_SECOND)
+        if self._end_ns is not None and deadline_ns >= self._end_ns:
+            self.sleep_until(self._end_ns)
+            self._cursor_ns = self._end_ns
+            raise KitTimeout()
+        self.sleep_until(deadline_ns)
+        self._cursor_ns = deadline_ns
+
+    def sleep_until(self, deadline_ns: int):
+        """
+        Sleeps until an absolute deadline.  Calls the idle callbacks, sleeps on the
+        clock until the last spin_ns nanoseconds, then spins on the clock.  Records
+        how late it woke up.
+        :param deadline_ns: The now_ns() value to wake up at.
+        :return: None
+        """
+        for callback in self._idle_callbacks:
+            callback()
+        remaining_ns = deadline_ns - self.now_ns()
+        if remaining_ns > self.spin_ns:
+            self.clock.sleep((remaining_ns - self.spin_ns) / NS_PER_SECOND)
+        now_ns = self.now_ns()
+        while now_ns < deadline_ns:
+            now_ns = self.now_ns()
+        self.stats.record(now_ns - deadline_ns)
+
+    async def async_sleep(self, seconds: float):
+        """
+        The asyncio version of sleep().  Other tasks keep running while this waits.
+        Only the last spin_ns nanoseconds are spent spinning on the clock.
+        :param seconds: Number of seconds after the previous deadline to wake up.
+        :return: None
+        """
+        if self._cursor_ns is None:
+            self.start()
+        deadline_ns = self._cursor_ns + int(seconds * NS_PER_SECOND)
+        if self._end_ns is not None and deadline_ns >= self._end_ns:
+            await self.async_sleep_until(self._end_ns)
+            self._cursor_ns = self._end_ns
+            raise KitTimeout()
+        await self.async_sleep_until(deadline_ns)
+        self._cursor_ns = deadline_ns
+
+    async def async_sleep_until(self, deadline_ns: int):
+        """
+        The asyncio version of sleep_until().
+        :param deadline_ns: The now_ns() value to wake up at.
+        :return: None
+        """
+        for callback in self._idle_callbacks:
+            callback()
+        remaining_ns = deadline_ns - self.now_ns()
+        if remaining_ns > self.spin_ns:
+            await self.clock.async_sleep((remaining_ns - self.spin_ns) / NS_PER_SECOND)
+        now_ns = self.now_ns()
+        while now_ns < deadline_ns:
+            now_ns = self.now_ns()
+        self.stats.record(now_ns - deadline_ns)
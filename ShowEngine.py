@@ -0,0 +1,435 @@
+import bisect
+
+import Clock
+import KitRegistry
+import Lights
+import PatternDriver
+import Scheduler
+
+# Channel changes that happen closer together than this while recording are
+# folded into one frame.  A PatternKit normally flips all of its channels
+# back to back and then sleeps, so everything between two sleeps ends up in
+# the same frame.
+MERGE_WINDOW_SEC = .005
+
+
+class Timeline:
+    """
+    A recorded PatternKit.  A Timeline is a list of (offset, mask) frames, where
+    offset is the number of seconds from the start of the recording and mask
+    is a bitmask of the channels that are on from that moment until the next
+    frame.
+    """
+    def __init__(self, frames: list, duration: float):
+        """
+        Initializes this Timeline.  Frames that do not change any channel are
+        dropped.
+        :param frames: A list of (offset, mask) tuples sorted by offset.
+        :param duration: The length of the recording in seconds.  This is how long
+        the last frame stays up before the Timeline starts over.
+        """
+        self.frames = []
+        self.duration = duration
+        last_mask = None
+        for offset, mask in frames:
+            if mask != last_mask:
+                self.frames.append((offset, mask))
+                last_mask = mask
+
+    def __len__(self):
+        """
+        :return: The number of frames in this Timeline.
+        """
+        return len(self.frames)
+
+    def mask_at(self, offset: float):
+        """
+        :param offset: A number of seconds from the start of the Timeline.  Past the
+        end, the Timeline is taken to start over.
+        :return: The bitmask of the channels that are on at that moment.
+        """
+        if not self.frames:
+            return 0
+        if self.duration > 0:
+            offset %= self.duration
+        index = bisect.bisect_right(self.frames, (offset, float('inf'))) - 1
+        return self.frames[index][1] if index >= 0 else 0
+
+    def __iter__(self):
+        """
+        :return: An iterator over the (offset, mask) frames of this Timeline.
+        """
+        return iter(self.frames)
+
+
+class RecordingChannel:
+    """
+    A stand-in for one channel of the Lights object.  Instead of turning anything
+    on or off, it tells the RecordingLights object what happened.
+    """
+    def __init__(self, recorder: object, num: int):
+        """
+        Initializes this RecordingChannel.
+        :param recorder: The RecordingLights object that owns this channel.
+        :param num: The channel number.
+        """
+        self._recorder = recorder
+        self._num = num
+
+    def on(self):
+        """
+        Records that this channel was turned on.
+        :return: None
+        """
+        self._recorder.set_channel(self._num, True)
+
+    def off(self):
+        """
+        Records that this channel was turned off.
+        :return: None
+        """
+        self._recorder.set_channel(self._num, False)
+
+
+class RecordingLights:
+    """
+    A stand-in for the Lights object that a PatternKit plays into while it is
+    being recorded.  It has the same channel()/set_frame()/apply()/reset()
+    interface as Lights.
+    """
+    def __init__(self, clock: object, merge_window: float = MERGE_WINDOW_SEC):
+        """
+        Initializes the RecordingLights object and starts the recording.
+        :param clock: The Clock object the PatternKit is played on while recording.
+        :param merge_window: Changes closer together than this many seconds are
+        folded into the same frame.
+        """
+        self._clock = clock
+        # RecordingChannel objects are created the first time they are asked for.
+        self._channel = {}
+        self._merge_window = merge_window
+        self._mask = 0
+        self._start = clock.now()
+        self._frames = [(0.0, 0)]
+
+    def channel(self, num: int):
+        """
+        Returns a reference to the requested channel.
+        :param num: The number of the channel to return.
+        :return: A RecordingChannel object.
+        """
+        if num not in self._channel:
+            self._channel[num] = RecordingChannel(self, num)
+        return self._channel[num]
+
+    def reset(self):
+        """
+        Records that all of the channels were turned off.
+        :return: None
+        """
+        self._set_mask(0)
+
+    def set_channel(self, num: int, state: bool):
+        """
+        Records that one channel was turned on or off.
+        :param num: The channel number.
+        :param state: True if the channel was turned on, False if it was turned off.
+        :return: None
+        """
+        if state:
+            self._set_mask(self._mask | Lights.channel_bit(num))
+        else:
+            self._set_mask(self._mask & ~Lights.channel_bit(num))
+
+    def set_frame(self, mask: int):
+        """
+        Records that every channel was turned on or off to match a bitmask.
+        :param mask: A bitmask of the channels that are on.
+        :return: None
+        """
+        self._set_mask(mask)
+
+    def apply(self, states: dict):
+        """
+        Records that some of the channels were turned on or off.
+        :param states: A dictionary of channel number to True (on) or False (off).
+        :return: None
+        """
+        mask = self._mask
+        for num, state in states.items():
+            if state:
+                mask |= Lights.channel_bit(num)
+            else:
+                mask &= ~Lights.channel_bit(num)
+        self._set_mask(mask)
+
+    def _set_mask(self, mask: int):
+        """
+        Records a new channel mask, merging it into the last frame if the last
+        frame started less than merge_window seconds ago.
+        :param mask: The new bitmask of channels that are on.
+        :return: None
+        """
+        if mask == self._mask:
+            return
+        self._mask = mask
+        offset = self._clock.now() - self._start
+        last_offset = self._frames[-1][0]
+        if offset - last_offset < self._merge_window:
+            self._frames[-1] = (last_offset, mask)
+        else:
+            self._frames.append((offset, mask))
+
+    def timeline(self):
+        """
+        Ends the recording.
+        :return: A Timeline object holding everything recorded so far.
+        """
+        return Timeline(self._frames, self._clock.now() - self._start)
+
+    def split(self):
+        """
+        Ends the recording so far and starts the next one from now, carrying on
+        with the channels as they are.  Changes from now on are never folded into
+        the frames before now.
+        :return: A Timeline object holding everything recorded before now.
+        """
+        timeline = self.timeline()
+        self._start = self._clock.now()
+        self._frames = [(0.0, self._mask)]
+        return timeline
+
+
+def record(pattern_object: object, seconds: float = None):
+    """
+    Records one play() of a PatternKit into a Timeline.  The PatternKit is
+    played on a VirtualClock, so the recording takes no time as long as the
+    PatternKit waits with its sleep() method.
+    :param pattern_object: The PatternKit object to record.
+    :param seconds: If given, play() is called over and over (the way the
+    PatternDriver does) and the recording is stopped after this many seconds.
+    :return: A Timeline object.
+    """
+    lights = pattern_object.lights
+    clock = pattern_object.clock
+    scheduler = pattern_object.scheduler
+    virtual_clock = Clock.VirtualClock()
+    recorder = RecordingLights(virtual_clock)
+    pattern_object.lights = recorder
+    pattern_object.clock = virtual_clock
+    # A Scheduler of its own, so the recording has no timeout unless one is asked for.
+    pattern_object.scheduler = Scheduler.Scheduler(virtual_clock)
+    try:
+        if seconds is None:
+            pattern_object.play()
+        else:
+            pattern_object.scheduler.start(seconds)
+            try:
+                while not pattern_object.scheduler.expired():
+                    pattern_object.play()
+            except Scheduler.KitTimeout:
+                pass
+    finally:
+        pattern_object.lights = lights
+        pattern_object.clock = clock
+        pattern_object.scheduler = scheduler
+    return recorder.timeline()
+
+
+class TimelinePlayer:
+    """
+    Plays Timelines on a Lights object.  Every frame is put up at an absolute
+    deadline measured from the start of the Timeline, so slow channel writes
+    never push later frames back.
+    """
+    def __init__(self, lights: object, scheduler: object = None):
+        """
+        Initializes this TimelinePlayer.
+        :param lights: A reference to the Lights object.
+        :param scheduler: The Scheduler object that paces the frames.  A new one
+        is created if None.
+        """
+        self.lights = lights
+        self.scheduler = scheduler if scheduler is not None else Scheduler.Scheduler()
+
+    def reset(self):
+        """
+        Turns off all of the channels.
+        :return: None
+        """
+        self.lights.reset()
+
+    def apply(self, mask: int):
+        """
+        Puts up one frame.  The Lights object only touches the channels that changed.
+        :param mask: The bitmask of channels that should be on.
+        :return: None
+        """
+        self.lights.set_frame(mask)
+
+    def play(self, timeline: Timeline, start_ns: int, stop_ns: int = None, from_ns: int = None):
+        """
+        Plays a Timeline once.
+        :param timeline: The Timeline to play.
+        :param start_ns: The Scheduler.now_ns() value that the Timeline starts at.
+        :param stop_ns: A Scheduler.now_ns() value to stop at, or None to play the
+        whole Timeline.  Frames at or after stop_ns are not put up.
+        :param from_ns: A Scheduler.now_ns() value to start at, or None to play from
+        the start of the Timeline.  Frames before from_ns are not put up.
+        :return: The Scheduler.now_ns() value that the Timeline ends at.
+        """
+        for offset, mask in timeline:
+            deadline_ns = start_ns + int(offset * Scheduler.NS_PER_SECOND)
+            if from_ns is not None and deadline_ns < from_ns:
+                continue
+            if stop_ns is not None and deadline_ns >= stop_ns:
+                return stop_ns
+            self.scheduler.sleep_until(deadline_ns)
+            self.apply(mask)
+        return start_ns + int(timeline.duration * Scheduler.NS_PER_SECOND)
+
+
+class ShowEngine(PatternDriver.PatternDriver):
+    """
+    A PatternDriver that records each PatternKit into a Timeline the first time
+    it plays, and after that replays the Timeline instead of calling play().
+    A PatternKit that does something different every time play() is called
+    (random patterns, etc.) will repeat its first recording.
+    """
+    def __init__(self, clock: object = None, transition: object = None):
+        """
+        Sets up the ShowEngine the same way as the PatternDriver.
+        :param clock: The Clock object to run the show on.
+        :param transition: The Transition.Transition that blends each PatternKit into
+        the next, or None to go dark between them.
+        """
+        super().__init__(clock)
+        # Timelines that have already been recorded, keyed by PatternKit name.
+        self.timelines = {}
+        self.player = TimelinePlayer(self.lights, self.scheduler)
+        self.transition = transition
+        # The Timeline that played last and the Scheduler.now_ns() value its last
+        # loop started at, for the Transition into the next one.
+        self._outgoing = None
+
+    def timeline(self, name: str):
+        """
+        Returns the Timeline for a PatternKit, recording it first if needed.
+        :param name: The name of the PatternKit module.
+        :return: A Timeline object.
+        """
+        if name not in self.timelines:
+            self.timelines[name] = record(self.pattern_objects[name])
+        return self.timelines[name]
+
+    def reload_kits(self):
+        """
+        Swaps in new PatternKit objects for the PatternKit files that changed, and
+        forgets their Timelines so they are recorded again.
+        :return: A set of the names of the PatternKits that were replaced or removed.
+        """
+        names = super().reload_kits()
+        for name in names:
+            self.timelines.pop(name, None)
+        return names
+
+    def run(self, timeout_sec: int = PatternDriver.FIVE_MINUTES_IN_SECONDS):
+        """
+        Loops forever, replaying each of the PatternKits in succession for
+        timeout_sec seconds each.  Unlike the PatternDriver, a PatternKit is
+        stopped exactly at the timeout.
+        :param timeout_sec: Number of seconds to run a PatternKit before
+        starting another PatternKit
+        :return: None (Never returns)
+        """
+        while True:
+            played = False
+            for name in self.pattern_objects.keys():
+                self.reload_kits()
+                if name not in self.pattern_objects:
+                    continue
+                if self.play_turn(name, timeout_sec) is not False:
+                    played = True
+            if not played:
+                self.sleep_dark(timeout_sec)
+
+    def play_turn(self, name: str, timeout_sec: float):
+        """
+        Replays one PatternKit's Timeline for timeout_sec seconds.
+        :param name: The name of the PatternKit module.
+        :param timeout_sec: Number of seconds the PatternKit's turn lasts.
+        :return: False if the PatternKit could not be loaded, so its turn was
+        skipped, otherwise None.
+        """
+        try:
+            timeline = self.timeline(name)
+        except KitRegistry.KitLoadError:
+            return False
+        self.play_timeline(timeline, timeout_sec, name)
+
+    def play_timeline(self, timeline: Timeline, timeout_sec: float, name: str, reset: bool = True):
+        """
+        Replays a Timeline for timeout_sec seconds, after the Transition from the
+        last one if there is a Transition.
+        :param timeline: The Timeline to play.
+        :param timeout_sec: Number of seconds the turn lasts.
+        :param name: The name to keep the lateness of the turn under.
+        :param reset: False to go straight on from the last Timeline, without a
+        Transition or turning the lights off.
+        :return: None
+        """
+        self.scheduler.stats = self.lateness_stats(name)
+        start_ns = self.scheduler.now_ns()
+        end_ns = start_ns + int(timeout_sec * Scheduler.NS_PER_SECOND)
+        from_ns = None
+        if reset and self.transition is not None and self._outgoing is not None and \
+                self.transition.seconds <= timeout_sec:
+            # The Transition takes the first seconds of this turn, and the
+            # Timeline carries on from where the Transition left it.
+            outgoing, outgoing_ns = self._outgoing
+            from_ns = min(end_ns, self.transition.play(self.lights, self.scheduler, outgoing, outgoing_ns, timeline,
+                                                       start_ns))
+        elif reset:
+            self.player.reset()
+        while True:
+            self._outgoing = (timeline, start_ns)
+            start_ns = self.player.play(timeline, start_ns, end_ns, from_ns)
+            # A Timeline with no duration has nothing to pace against,
+            # so its first frame is held until the timeout.
+            if start_ns >= end_ns or timeline.duration <= 0:
+                break
+        # Hold the last frame until the timeout.
+        self.scheduler.sleep_until(end_ns)
+
+    def play_layers(self, compositor: object, timeout_sec: float, reset: bool = True):
+        """
+        Plays several PatternKits at once for timeout_sec seconds.  They are
+        rendered ahead for the whole turn and composited into one Timeline.  To
+        play them for longer, use run_layers(), which renders while they play.
+        :param compositor: The Compositor.Compositor with the PatternKits' Layers.
+        :param timeout_sec: Number of seconds the turn lasts.
+        :param reset: False to go straight on from the last turn, see play_timeline().
+        :return: None
+        """
+        self.reload_kits()
+        self.play_timeline(compositor.render(self.pattern_objects, timeout_sec), timeout_sec, compositor.name, reset)
+
+    def run_layers(self, compositor: object, timeout_sec: int = PatternDriver.FIVE_MINUTES_IN_SECONDS):
+        """
+        Loops forever, playing the Layers of a Compositor timeout_sec seconds at a
+        time.  Each block is rendered in a process of its own while the one before
+        it plays, and every PatternKit carries on from where it was at the end of
+        the last block.
+        :param compositor: The Compositor.Compositor with the PatternKits' Layers.
+        :param timeout_sec: Number of seconds to render at a time.
+        :return: None (Never returns)
+        """
+        renderer = compositor.renderer(self.registry.directories, self.watcher is not None, timeout_sec)
+        renderer.start()
+        try:
+            reset = True
+            while True:
+                self.play_timeline(renderer.next_block(), timeout_sec, compositor.name, reset)
+                reset = False
+        finally:
+            renderer.stop()
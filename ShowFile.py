@@ -0,0 +1,611 @@
+import mmap
+import os
+import struct
+import sys
+
+import KitRegistry
+import Lights
+import Scheduler
+import ShowEngine
+
+# The first bytes of every show file.
+MAGIC = b'XLSH'
+
+VERSION = 2
+
+# The number of frames per second shows are compiled at, unless asked otherwise.
+DEFAULT_FPS = 100
+
+# magic, version, flags, fps, mask_bytes, channel_count, record_count,
+# cue_count, total_ticks, data_bytes.  The counts are filled in when the
+# ShowWriter is closed.
+HEADER = struct.Struct('<4sHHIHHIIQQ')
+
+# Version 1 files have no data_bytes, and always hold runs.
+HEADER_V1 = struct.Struct('<4sHHIHHIIQ')
+
+# The magic and version at the start of every header.
+HEADER_START = struct.Struct('<4sH')
+
+# The header flag for a show stored as channel events and keyframes instead of runs.
+DELTAS = 1
+
+# How often a show stored as channel events has a keyframe.
+KEYFRAME_SEC = 10
+
+# The channel map is one of these per channel: the channel numbers in the show.
+CHANNEL = struct.Struct('<H')
+
+# A show is stored one of two ways.
+#
+# As runs: every run starts with the tick it starts at, followed by the bytes
+# of the channel bitmask that is up from that tick until the next run starts.
+# The runs are all the same size, so run n is found without reading the runs
+# before it.
+#
+# As channel events: every frame is a varint of the ticks since the previous
+# frame, followed by a varint of (channel map index << 2 | state << 1 | last)
+# for every channel that turned on or off, with last set on the frame's final
+# channel.  Most frames change one or two channels, so most frames are two or
+# three bytes.  After the events comes a table of keyframes, each the tick it
+# is at, the offset of the first event after it, and the bytes of the whole
+# channel bitmask at that tick.
+RUN_TICK = struct.Struct('<Q')
+KEYFRAME_TICK = struct.Struct('<QQ')
+
+# Every cue is the tick it starts at and the length of its name, followed by
+# the name in UTF-8.
+CUE = struct.Struct('<QH')
+
+
+def _varint(value: int):
+    """
+    :param value: A number, 0 or more.
+    :return: The bytes of the number as a varint: 7 bits per byte, least
+    significant first, with the top bit set on every byte but the last.
+    """
+    data = bytearray()
+    while value > 0x7f:
+        data.append((value & 0x7f) | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+def _read_varint(buffer: object, offset: int):
+    """
+    Reads a varint written by _varint().
+    :param buffer: The bytes (or mmap) to read from.
+    :param offset: Where the varint starts.
+    :return: A (value, offset after the varint) tuple.
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class ShowWriter:
+    """
+    Writes a show file as it goes, so a show of any length can be compiled
+    without holding it in memory.  Frames are counted in ticks of 1/fps
+    seconds.  The show is stored as channel events with a keyframe every
+    keyframe_sec seconds, or as runs of identical ticks.
+    """
+    def __init__(self, filename: str, channel_numbers: list, fps: int = DEFAULT_FPS, deltas: bool = True,
+                 keyframe_sec: float = KEYFRAME_SEC):
+        """
+        Creates the show file.
+        :param filename: The filename of the show file.
+        :param channel_numbers: The channel numbers in the show.  Other channels
+        are left out.
+        :param fps: The number of ticks per second.
+        :param deltas: True to store the show as channel events, False for runs.
+        :param keyframe_sec: How often a show stored as channel events has a keyframe.
+        """
+        self.filename = filename
+        self.fps = fps
+        self.deltas = deltas
+        self.channel_numbers = sorted(channel_numbers)
+        self.mask_bytes = (max(self.channel_numbers, default=1) + 7) // 8
+        # The index of each channel in the channel map, keyed by channel bit.
+        self._index = {}
+        self._all_mask = 0
+        for index, num in enumerate(self.channel_numbers):
+            self._index[Lights.channel_bit(num)] = index
+            self._all_mask |= Lights.channel_bit(num)
+        # The number of ticks written so far.
+        self.ticks = 0
+        # The number of runs or keyframes, and the bytes of runs or events written.
+        self._record_count = 0
+        self._data_bytes = 0
+        # The run that is still growing, as (start tick, mask), or None.
+        self._run = None
+        # The mask the events written so far end at, and the tick of the last event.
+        self._mask = 0
+        self._event_tick = 0
+        # A list of (tick, event offset, mask) tuples.  There is one per
+        # keyframe_sec, so even a long show has few.
+        self._keyframes = []
+        self._keyframe_ticks = max(1, round(keyframe_sec * fps))
+        # A list of (tick, name) tuples.
+        self._cues = []
+        self._file = open(filename, 'wb')
+        self._write_header()
+        for num in self.channel_numbers:
+            self._file.write(CHANNEL.pack(num))
+
+    def _write_header(self):
+        """
+        Writes the header with the counts so far.
+        :return: None
+        """
+        self._file.write(HEADER.pack(MAGIC, VERSION, DELTAS if self.deltas else 0, self.fps, self.mask_bytes,
+                                     len(self.channel_numbers), self._record_count, len(self._cues), self.ticks,
+                                     self._data_bytes))
+
+    def _write_run(self):
+        """
+        Writes the run that is still growing.
+        :return: None
+        """
+        start_tick, mask = self._run
+        self._file.write(RUN_TICK.pack(start_tick) + mask.to_bytes(self.mask_bytes, 'little'))
+        self._record_count += 1
+        self._data_bytes += RUN_TICK.size + self.mask_bytes
+
+    def _write_events(self, mask: int):
+        """
+        Writes an event for every channel that is different in mask, and a keyframe
+        after them if one is due.
+        :param mask: The bitmask of the channels that are on from this tick.
+        :return: None
+        """
+        changed = mask ^ self._mask
+        if not changed and self._keyframes:
+            return
+        data = bytearray()
+        if changed:
+            data += _varint(self.ticks - self._event_tick)
+            self._event_tick = self.ticks
+        remaining = changed
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            last = 0 if remaining else 1
+            data += _varint(self._index[bit] << 2 | bool(mask & bit) << 1 | last)
+        self._file.write(data)
+        self._data_bytes += len(data)
+        self._mask = mask
+        if not self._keyframes or self.ticks - self._keyframes[-1][0] >= self._keyframe_ticks:
+            self._keyframes.append((self.ticks, self._data_bytes, mask))
+
+    def add(self, mask: int, ticks: int):
+        """
+        Adds ticks to the end of the show.
+        :param mask: The bitmask of the channels that are on.
+        :param ticks: How many ticks the mask is up for.
+        :return: None
+        """
+        if ticks <= 0:
+            return
+        mask &= self._all_mask
+        if self.deltas:
+            self._write_events(mask)
+        elif self._run is None or self._run[1] != mask:
+            if self._run is not None:
+                self._write_run()
+            self._run = (self.ticks, mask)
+        self.ticks += ticks
+
+    def cue(self, name: str):
+        """
+        Marks the current end of the show, so a player can start from here.
+        :param name: The name of the cue (the PatternKit's name, etc.).
+        :return: None
+        """
+        self._cues.append((self.ticks, name))
+
+    def add_timeline(self, timeline: object, name: str = None):
+        """
+        Adds a Timeline to the end of the show, rounding its frames to ticks.
+        Frames shorter than one tick are dropped.
+        :param timeline: A ShowEngine.Timeline object.
+        :param name: If given, a cue with this name is added at the start of the Timeline.
+        :return: None
+        """
+        if name is not None:
+            self.cue(name)
+        start_tick = self.ticks
+        end_tick = start_tick + round(timeline.duration * self.fps)
+        frames = list(timeline)
+        for index, (offset, mask) in enumerate(frames):
+            frame_tick = start_tick + round(offset * self.fps)
+            if index + 1 < len(frames):
+                next_tick = start_tick + round(frames[index + 1][0] * self.fps)
+            else:
+                next_tick = end_tick
+            self.add(mask, min(next_tick, end_tick) - max(frame_tick, self.ticks))
+
+    def close(self):
+        """
+        Writes the last run or the keyframes, and the cue index, and fills in the
+        header.
+        :return: None
+        """
+        if self._run is not None:
+            self._write_run()
+            self._run = None
+        for tick, offset, mask in self._keyframes:
+            self._file.write(KEYFRAME_TICK.pack(tick, offset) + mask.to_bytes(self.mask_bytes, 'little'))
+        self._record_count += len(self._keyframes)
+        for tick, name in self._cues:
+            encoded = name.encode('utf-8')
+            self._file.write(CUE.pack(tick, len(encoded)) + encoded)
+        self._file.seek(0)
+        self._write_header()
+        self._file.close()
+
+
+class ShowReader:
+    """
+    Reads a show file through mmap.  Everything is read straight from the mapped
+    file when it is asked for, so only the pages being played are in memory.
+    Finding the frame at any tick is a binary search of the runs or keyframes,
+    followed (for channel events) by the events since the keyframe.
+    """
+    def __init__(self, filename: str):
+        """
+        Opens and maps the show file.
+        :param filename: The filename of the show file.
+        """
+        self.filename = filename
+        self._file = open(filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._map, 'madvise'):
+            # Shows are played front to back, so read ahead and drop pages behind.
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+        magic, version = HEADER_START.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise Exception('"%s" is not a show file.' % (filename))
+        if version == VERSION:
+            magic, version, flags, self.fps, self.mask_bytes, channel_count, self.record_count, cue_count, \
+                self.ticks, data_bytes = HEADER.unpack_from(self._map, 0)
+            offset = HEADER.size
+        elif version == 1:
+            magic, version, flags, self.fps, self.mask_bytes, channel_count, self.record_count, cue_count, \
+                self.ticks = HEADER_V1.unpack_from(self._map, 0)
+            data_bytes = self.record_count * (RUN_TICK.size + self.mask_bytes)
+            offset = HEADER_V1.size
+        else:
+            raise Exception('"%s" is a version %d show file, only versions 1 to %d can be played.' % (
+                filename, version, VERSION))
+        self.deltas = bool(flags & DELTAS)
+        self.channel_numbers = [CHANNEL.unpack_from(self._map, offset + i * CHANNEL.size)[0] for i in range(channel_count)]
+        # The channel bit of each index in the channel map.
+        self._bits = [Lights.channel_bit(num) for num in self.channel_numbers]
+        offset += channel_count * CHANNEL.size
+        self._data_offset = offset
+        self._data_end = offset + data_bytes
+        if self.deltas:
+            # The keyframes follow the events.
+            self._records_offset = self._data_end
+            self._record_size = KEYFRAME_TICK.size + self.mask_bytes
+            offset = self._data_end + self.record_count * self._record_size
+        else:
+            self._records_offset = self._data_offset
+            self._record_size = RUN_TICK.size + self.mask_bytes
+            offset = self._data_end
+        # The cue index is small, so it is read into memory as (tick, name) tuples.
+        self.cues = []
+        for i in range(cue_count):
+            tick, length = CUE.unpack_from(self._map, offset)
+            offset += CUE.size
+            self.cues.append((tick, bytes(self._map[offset:offset + length]).decode('utf-8')))
+            offset += length
+
+    @property
+    def duration(self):
+        """
+        :return: The length of the show in seconds.
+        """
+        return self.ticks / self.fps
+
+    def _mask(self, offset: int):
+        """
+        :param offset: Where a channel bitmask starts in the file.
+        :return: The channel bitmask.
+        """
+        return int.from_bytes(self._map[offset:offset + self.mask_bytes], 'little')
+
+    def record_tick(self, index: int):
+        """
+        :param index: The index of a run or keyframe.
+        :return: The tick the run or keyframe is at.
+        """
+        return RUN_TICK.unpack_from(self._map, self._records_offset + index * self._record_size)[0]
+
+    def find_record(self, tick: int):
+        """
+        Finds the last run or keyframe at or before a tick with a binary search.
+        :param tick: The tick.
+        :return: The index of the run or keyframe.
+        """
+        low = 0
+        high = self.record_count
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self.record_tick(middle) <= tick:
+                low = middle
+            else:
+                high = middle
+        return low
+
+    def run(self, index: int):
+        """
+        Reads one run of a show stored as runs.
+        :param index: The index of the run, from 0 to record_count - 1.
+        :return: A (start tick, mask) tuple.
+        """
+        offset = self._records_offset + index * self._record_size
+        return RUN_TICK.unpack_from(self._map, offset)[0], self._mask(offset + RUN_TICK.size)
+
+    def keyframe(self, index: int):
+        """
+        Reads one keyframe of a show stored as channel events.
+        :param index: The index of the keyframe, from 0 to record_count - 1.
+        :return: A (tick, event offset, mask) tuple.
+        """
+        offset = self._records_offset + index * self._record_size
+        tick, event_offset = KEYFRAME_TICK.unpack_from(self._map, offset)
+        return tick, event_offset, self._mask(offset + KEYFRAME_TICK.size)
+
+    def _events(self, tick: int, offset: int):
+        """
+        Decodes channel events one at a time.
+        :param tick: The tick of the frame before offset.
+        :param offset: The offset of the first event, from the start of the events.
+        :return: An iterator over (tick, channel bit, state) tuples.
+        """
+        position = self._data_offset + offset
+        while position < self._data_end:
+            delta, position = _read_varint(self._map, position)
+            tick += delta
+            while True:
+                code, position = _read_varint(self._map, position)
+                yield tick, self._bits[code >> 2], code >> 1 & 1
+                if code & 1:
+                    break
+
+    def frames(self, start_tick: int = 0):
+        """
+        Decodes the show from a tick on, only as far as it is read.
+        :param start_tick: The tick to start at.
+        :return: An iterator over (tick, mask) frames.  The first frame is the one up
+        at start_tick, and every frame after it changes at least one channel.
+        """
+        if self.record_count == 0:
+            yield start_tick, 0
+            return
+        index = self.find_record(start_tick)
+        if not self.deltas:
+            yield start_tick, self.run(index)[1]
+            for index in range(index + 1, self.record_count):
+                yield self.run(index)
+            return
+        tick, offset, mask = self.keyframe(index)
+        events = self._events(tick, offset)
+        event = next(events, None)
+        while event is not None and event[0] <= start_tick:
+            tick, bit, state = event
+            mask = mask | bit if state else mask & ~bit
+            event = next(events, None)
+        yield start_tick, mask
+        while event is not None:
+            frame_tick = event[0]
+            while event is not None and event[0] == frame_tick:
+                tick, bit, state = event
+                mask = mask | bit if state else mask & ~bit
+                event = next(events, None)
+            yield frame_tick, mask
+
+    def tick(self, seconds: float):
+        """
+        :param seconds: A time in the show, in seconds from its start.
+        :return: The tick at that time, kept inside the show.
+        """
+        return max(0, min(self.ticks, round(seconds * self.fps)))
+
+    def cue_tick(self, name: str):
+        """
+        :param name: The name of a cue.
+        :return: The tick the cue starts at.
+        """
+        for tick, cue_name in self.cues:
+            if cue_name == name:
+                return tick
+        raise Exception('There is no cue "%s" in "%s".' % (name, self.filename))
+
+    def position(self, text: str):
+        """
+        Finds a position in the show from text, such as a command line argument.
+        :param text: A number of seconds from the start of the show ("600"), a cue
+        name ("MyPatternKit2"), or a cue name and the seconds into it
+        ("MyPatternKit2+30").
+        :return: The tick of the position.
+        """
+        name, plus, seconds = text.rpartition('+')
+        if not plus:
+            name, seconds = text, ''
+        try:
+            offset = float(seconds) if seconds else 0
+        except ValueError:
+            name, offset = text, 0
+        if not name:
+            return self.tick(offset)
+        try:
+            return self.tick(float(name) + offset)
+        except ValueError:
+            return self.tick(self.cue_tick(name) / self.fps + offset)
+
+    def mask_at(self, tick: int):
+        """
+        :param tick: A tick.
+        :return: The bitmask of the channels that are on at the tick.
+        """
+        return next(self.frames(tick))[1]
+
+    def close(self):
+        """
+        Unmaps and closes the show file.
+        :return: None
+        """
+        self._map.close()
+        self._file.close()
+
+
+def compile_show(filename: str, pattern_objects: dict, seconds: float, fps: int = DEFAULT_FPS, channel_numbers: list = None,
+                 deltas: bool = True):
+    """
+    Records PatternKits into a show file, one after another, with a cue at the
+    start of each.  Each PatternKit is written as soon as it is recorded, so only
+    one PatternKit's Timeline is in memory at a time.
+    :param filename: The filename of the show file.
+    :param pattern_objects: A dictionary of PatternKit objects keyed by name, in
+    the order they are played (PatternDriver.pattern_objects).  A PatternKit that
+    fails to load (KitRegistry.KitLoadError) is recorded dark.
+    :param seconds: How many seconds each PatternKit plays for.
+    :param fps: The number of ticks per second.
+    :param channel_numbers: The channel numbers in the show.  Every channel of the
+    Lights object the PatternKits draw on if None.
+    :param deltas: True to store the show as channel events, False for runs.
+    :return: None
+    """
+    if channel_numbers is None:
+        channel_numbers = []
+        for name in pattern_objects:
+            try:
+                channel_numbers = pattern_objects[name].lights.channel_numbers
+                break
+            except KitRegistry.KitLoadError:
+                continue
+    writer = ShowWriter(filename, channel_numbers, fps, deltas)
+    try:
+        for name in pattern_objects:
+            try:
+                timeline = ShowEngine.record(pattern_objects[name], seconds)
+            except KitRegistry.KitLoadError:
+                # Dark for its turn, the same as in PatternDriver.run_schedule().
+                timeline = ShowEngine.Timeline([(0, 0)], seconds)
+            writer.add_timeline(timeline, name)
+    finally:
+        # Whatever was recorded is left as a show file that can be read.
+        writer.close()
+
+
+class ShowPlayer:
+    """
+    Plays a show file on a Lights object, streaming the frames from the mapped
+    file.  Every frame is put up at an absolute deadline measured from the start
+    of the show.
+    """
+    def __init__(self, lights: object, scheduler: object = None):
+        """
+        Initializes this ShowPlayer.
+        :param lights: A reference to the Lights object.
+        :param scheduler: The Scheduler object that paces the frames.  A new one
+        is created if None.
+        """
+        self.lights = lights
+        self.scheduler = scheduler if scheduler is not None else Scheduler.Scheduler()
+
+    def play(self, reader: object, start_ns: int = None, stop_ns: int = None, start_tick: int = 0,
+             end_tick: int = None):
+        """
+        Plays a show, or part of it, once.  Starting in the middle puts up the frame
+        that is up at start_tick right away, rebuilt from the nearest keyframe.
+        :param reader: The ShowReader of the show file.
+        :param start_ns: The Scheduler.now_ns() value to play start_tick at.  Now if None.
+        :param stop_ns: A Scheduler.now_ns() value to stop at, or None to play up to
+        end_tick.
+        :param start_tick: The tick of the show to start at.
+        :param end_tick: The tick of the show to end at.  The end of the show if None.
+        :return: The Scheduler.now_ns() value that the part played ends at.
+        """
+        if start_ns is None:
+            start_ns = self.scheduler.now_ns()
+        if end_tick is None:
+            end_tick = reader.ticks
+        ns_per_tick = Scheduler.NS_PER_SECOND / reader.fps
+        end_ns = start_ns + int((end_tick - start_tick) * ns_per_tick)
+        if stop_ns is not None:
+            end_ns = min(end_ns, stop_ns)
+        for tick, mask in reader.frames(start_tick):
+            deadline_ns = start_ns + int((tick - start_tick) * ns_per_tick)
+            if deadline_ns >= end_ns:
+                break
+            self.scheduler.sleep_until(deadline_ns)
+            self.lights.set_frame(mask)
+        self.scheduler.sleep_until(end_ns)
+        return end_ns
+
+    def loop(self, reader: object, start_tick: int, end_tick: int, start_ns: int = None, stop_ns: int = None,
+             count: int = None):
+        """
+        Plays part of a show over and over.  Each pass starts exactly where the one
+        before it ended, so the passes do not drift.
+        :param reader: The ShowReader of the show file.
+        :param start_tick: The tick of the show the part starts at.
+        :param end_tick: The tick of the show the part ends at.
+        :param start_ns: The Scheduler.now_ns() value to start at.  Now if None.
+        :param stop_ns: A Scheduler.now_ns() value to stop at, or None to stop after
+        count passes.
+        :param count: The number of passes, or None to loop until stop_ns (or forever).
+        :return: The Scheduler.now_ns() value that the last pass ends at.
+        """
+        if end_tick <= start_tick:
+            raise Exception('The part of the show to loop is empty.')
+        if start_ns is None:
+            start_ns = self.scheduler.now_ns()
+        passes = 0
+        while (count is None or passes < count) and (stop_ns is None or start_ns < stop_ns):
+            start_ns = self.play(reader, start_ns, stop_ns, start_tick, end_tick)
+            passes += 1
+        return start_ns
+
+
+if __name__ == '__main__':
+    # python ShowFile.py compile <show file> [seconds per PatternKit]
+    #   records the PatternKits in the current directory into a show file.
+    # python ShowFile.py play <show file> [from] [to]
+    #   plays a show file, or the part of it between two positions.
+    # python ShowFile.py loop <show file> <from> <to>
+    #   plays the part of a show file between two positions over and over.
+    # A position is a number of seconds from the start of the show, a cue (the
+    # name of a PatternKit), or a cue and the seconds into it ("MyPatternKit2+30").
+    import PatternDriver
+    command = sys.argv[1]
+    show_filename = sys.argv[2]
+    pattern_driver = PatternDriver.PatternDriver()
+    if command == 'compile':
+        seconds_each = float(sys.argv[3]) if len(sys.argv) > 3 else PatternDriver.FIVE_MINUTES_IN_SECONDS
+        compile_show(show_filename, pattern_driver.pattern_objects, seconds_each,
+                     channel_numbers=pattern_driver.lights.channel_numbers)
+        print('%s: %d bytes' % (show_filename, os.path.getsize(show_filename)))
+    elif command in ('play', 'loop'):
+        show = ShowReader(show_filename)
+        start = show.position(sys.argv[3]) if len(sys.argv) > 3 else 0
+        end = show.position(sys.argv[4]) if len(sys.argv) > 4 else show.ticks
+        player = ShowPlayer(pattern_driver.lights, pattern_driver.scheduler)
+        if command == 'play':
+            player.play(show, start_tick=start, end_tick=end)
+        else:
+            player.loop(show, start, end)
+        show.close()
+    else:
+        raise Exception('Unknown command "%s".' % (command))
@@ -41,6 +41,29 @@ class WindowSingleton:
             """
             self._channels.off(num)
 
+        def apply(self, states: dict):
+            """
+            Turns on or off all objects for several channels in one pass.
+            :param states: A dictionary of channel number to True (on) or False (off).
+            :return: None
+            """
+            self._channels.apply(states)
+
+        def apply_levels(self, levels: dict):
+            """
+            Dims all objects for several channels in one pass.
+            :param levels: A dictionary of channel number to brightness (0 to 255).
+            :return: None
+            """
+            self._channels.apply_levels(levels)
+
+        def flush(self):
+            """
+            Repaints the window if anything changed since the last repaint.
+            :return: None
+            """
+            self._channels.flush()
+
     # A static variable for this class to hold the one instance of the Singleton.
     _instance = None
 
@@ -84,6 +107,29 @@ class WindowSingleton:
         """
         WindowSingleton._instance.off(num)
 
+    def apply(self, states: dict):
+        """
+        Turns on or off several channels in one pass.
+        :param states: A dictionary of channel number to True (on) or False (off).
+        :return: None
+        """
+        WindowSingleton._instance.apply(states)
+
+    def apply_levels(self, levels: dict):
+        """
+        Dims several channels in one pass.
+        :param levels: A dictionary of channel number to brightness (0 to 255).
+        :return: None
+        """
+        WindowSingleton._instance.apply_levels(levels)
+
+    def flush(self):
+        """
+        Repaints the window if anything changed since the last repaint.
+        :return: None
+        """
+        WindowSingleton._instance.flush()
+
 
 class LED:
     """
@@ -114,3 +160,44 @@ class LED:
         """
         print('led %d is off'%(self._num))
         self._window_singleton.off(self._num)
+
+    @staticmethod
+    def apply_frame(changes: list):
+        """
+        Turns on or off several LED objects at once.  Lights.Lights calls this
+        instead of on()/off() on each LED object so that a whole frame is drawn
+        in one pass.
+        :param changes: A list of (LED object, state) tuples, where state is True
+        for on and False for off.
+        :return: None
+        """
+        states = {}
+        for led, state in changes:
+            states[led._num] = state
+        print('leds %s' % (', '.join('%d %s' % (num, 'on' if state else 'off') for num, state in states.items())))
+        WindowSingleton().apply(states)
+
+    @staticmethod
+    def apply_levels(changes: list):
+        """
+        Dims several LED objects at once by blending the colors of their channels
+        toward gray.  Lights.Lights calls this for channels that are neither all the
+        way on nor off.
+        :param changes: A list of (LED object, level) tuples, where level is the
+        brightness from 0 to 255.
+        :return: None
+        """
+        levels = {}
+        for led, level in changes:
+            levels[led._num] = level
+        print('leds %s' % (', '.join('%d at %d' % (num, level) for num, level in levels.items())))
+        WindowSingleton().apply_levels(levels)
+
+    @staticmethod
+    def flush():
+        """
+        Repaints the window with every change since the last repaint.  Lights.Lights
+        calls this when the show is about to sleep.
+        :return: None
+        """
+        WindowSingleton().flush()
@@ -0,0 +1,531 @@
+import multiprocessing
+import os
+import struct
+import threading
+from multiprocessing import shared_memory
+
+import Clock
+import Scheduler
+
+# How many times per second every dimmed channel goes through a whole PWM period.
+PWM_HZ = 100
+
+# The number of bits in a brightness level (0 to 255).
+LEVEL_BITS = 8
+
+# The highest brightness level.
+MAX_LEVEL = (1 << LEVEL_BITS) - 1
+
+# The real-time (SCHED_FIFO) priority the engine's thread (or process) asks
+# for.  Without permission for it, it runs at normal priority.
+PRIORITY = 50
+
+# How long to wait for the PwmProcess to let go of pins handed back, or to exit.
+STOP_TIMEOUT_SEC = .5
+
+# The header of a PwmTable holds three 32-bit words, which even a 32-bit
+# Raspberry Pi reads and writes in one go: the table's sequence number, which is
+# odd while the table is being written and wraps around, the sequence number the
+# PwmProcess last read, and a flag that asks the PwmProcess to stop.
+HEADER = struct.Struct('<III')
+
+# The sequence numbers count modulo this.
+SEQUENCE_MODULO = 1 << 32
+
+# After the header come the bitmasks of the channels the PwmProcess dims, of the
+# channels it writes, and of the channels that are on (for the pins it writes
+# but does not dim), then the LEVEL_BITS slice bitmasks.
+MASK_COUNT = 3 + LEVEL_BITS
+
+
+def bcm_slices(levels: dict):
+    """
+    Splits the brightness of some channels into binary code modulation slices.
+    :param levels: A dictionary of channel bit to brightness (1 to MAX_LEVEL - 1).
+    :return: A tuple of (the bitmask of the channels, a list of LEVEL_BITS
+    bitmasks of the channels that are on in each slice).
+    """
+    slices = [0] * LEVEL_BITS
+    channels = 0
+    for bit, level in levels.items():
+        channels |= bit
+        for k in range(LEVEL_BITS):
+            if level & (1 << k):
+                slices[k] |= bit
+    return channels, slices
+
+
+def raise_priority():
+    """
+    Asks for real-time priority for the calling thread so that a busy Raspberry
+    Pi does not make the PWM flicker.  Needs root (or CAP_SYS_NICE).
+    :return: None
+    """
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(PRIORITY))
+    except (AttributeError, OSError):
+        pass
+
+
+class PwmEngine:
+    """
+    Dims the channels on OutputDevices that cannot dim by themselves, with
+    binary code modulation: each PWM period is split into LEVEL_BITS slices that
+    last 1, 2, 4, ... 128 255ths of the period, and in slice k every channel
+    whose level has bit k set is on.  That is LEVEL_BITS writes per period no
+    matter how many channels are dimmed, all from one thread paced by a
+    Scheduler, so its lateness is the PWM jitter.  The engine also steps the
+    Lights' fades once per period.
+
+    Being a thread, it shares the GIL with the show, so its slices are late when
+    the show is busy.  The Lights object only uses it with the simulator; on the
+    Raspberry Pi the slices are written by a PwmProcess instead.
+    """
+    # The engine writes the dimmed pins through Lights.write_pwm(), and the Lights
+    # object writes every other pin itself.
+    owns_pins = False
+
+    def __init__(self, lights: object, clock: object = None, hz: int = PWM_HZ):
+        """
+        Initializes the PwmEngine.  It does not run until start() is called.
+        :param lights: The Lights object whose channels are dimmed.
+        :param clock: The Clock object to pace the slices on.  A Clock.RealClock if None.
+        :param hz: How many PWM periods per second.
+        """
+        self._lights = lights
+        self.clock = clock if clock is not None else Clock.RealClock()
+        # The lateness of the slices is the jitter of the PWM.
+        self.scheduler = Scheduler.Scheduler(self.clock)
+        self._period_ns = Scheduler.NS_PER_SECOND // hz
+        # A bitmask of the channels the engine drives.
+        self._channels = 0
+        # The bitmask of the channels that are on in each slice.
+        self._slices = [0] * LEVEL_BITS
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def set_levels(self, levels: dict, owned: int = 0, frame: int = 0):
+        """
+        Sets which channels the engine drives, and how bright.
+        :param levels: A dictionary of channel bit to brightness (1 to MAX_LEVEL - 1).
+        :param owned: Not used, see PwmProcess.set_levels().
+        :param frame: Not used, see PwmProcess.set_levels().
+        :return: None
+        """
+        self._channels, self._slices = bcm_slices(levels)
+        self._wake.set()
+
+    def start(self):
+        """
+        Starts the engine's thread, if it is not running yet.
+        :return: None
+        """
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='PwmEngine', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the engine's thread.
+        :return: None
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+
+    def wake(self):
+        """
+        Wakes up the engine's thread when it is waiting for something to do.
+        :return: None
+        """
+        self._wake.set()
+
+    def _run(self):
+        """
+        The body of the engine's thread.  Waits while there is nothing to dim or
+        fade, otherwise writes one slice after another.
+        :return: None
+        """
+        raise_priority()
+        deadline_ns = self.clock.monotonic_ns()
+        while self._running:
+            if not self._channels and not self._lights.fading():
+                self._wake.clear()
+                # Look again after clearing, in case something was added just before.
+                if not self._channels and not self._lights.fading():
+                    self._wake.wait()
+                deadline_ns = self.clock.monotonic_ns()
+                continue
+            now_ns = self.clock.monotonic_ns()
+            if now_ns - deadline_ns > self._period_ns:
+                # Fell a whole period behind (the thread was starved), so start over
+                # from now instead of rushing through the missed slices.
+                deadline_ns = now_ns
+            self._lights.update_fades()
+            for k in range(LEVEL_BITS):
+                self._lights.write_pwm(self._slices[k])
+                deadline_ns += (self._period_ns << k) // MAX_LEVEL
+                self.scheduler.sleep_until(deadline_ns)
+
+
+class PwmTable:
+    """
+    The slices of a PwmProcess, in shared memory.  One process writes the table
+    and the PwmProcess reads it.  A reader that finds the sequence number odd, or
+    changed while it was reading, has half a table, so it throws it away.
+    """
+    def __init__(self, mask_bytes: int, name: str = None):
+        """
+        Creates a new PwmTable, or attaches to an existing one.
+        :param mask_bytes: The number of bytes in each channel bitmask.
+        :param name: The name of an existing PwmTable's shared memory to attach to,
+        or None to create a new one.
+        """
+        self.mask_bytes = mask_bytes
+        self._owner = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner,
+                                               size=HEADER.size + MASK_COUNT * mask_bytes)
+        self._buf = self._shm.buf
+        if self._owner:
+            self._buf[:] = bytes(len(self._buf))
+
+    @property
+    def name(self):
+        """
+        :return: The name of the shared memory, for attaching from another process.
+        """
+        return self._shm.name
+
+    def write(self, channels: int, owned: int, frame: int, slices: list):
+        """
+        Replaces the table.  Only the writer calls this.
+        :param channels: A bitmask of the channels to dim.
+        :param owned: A bitmask of the channels the PwmProcess writes.
+        :param frame: A bitmask of the channels that are on.
+        :param slices: A list of LEVEL_BITS bitmasks of the channels that are on in each slice.
+        :return: None
+        """
+        sequence = self.sequence()
+        struct.pack_into('<I', self._buf, 0, (sequence + 1) % SEQUENCE_MODULO)
+        masks = b''.join(mask.to_bytes(self.mask_bytes, 'little') for mask in [channels, owned, frame] + slices)
+        self._buf[HEADER.size:] = masks
+        # Even again only once every mask is written.
+        struct.pack_into('<I', self._buf, 0, (sequence + 2) % SEQUENCE_MODULO)
+
+    def _read_masks(self):
+        """
+        :return: A copy of the bytes of every bitmask in the table.
+        """
+        return bytes(self._buf[HEADER.size:])
+
+    def read(self):
+        """
+        Reads the table.  A table that is being written is not waited for, the
+        reader keeps the last one it read and tries again later.
+        :return: A tuple of (sequence number, channels, owned, frame, slices), see
+        write(), or None if the table was being written.
+        """
+        sequence = self.sequence()
+        if sequence & 1:
+            return None
+        raw = self._read_masks()
+        if self.sequence() != sequence:
+            return None
+        masks = [int.from_bytes(raw[i:i + self.mask_bytes], 'little') for i in range(0, len(raw), self.mask_bytes)]
+        return (sequence, masks[0], masks[1], masks[2], masks[3:])
+
+    def sequence(self):
+        """
+        :return: The sequence number of the table.
+        """
+        return struct.unpack_from('<I', self._buf, 0)[0]
+
+    def acknowledge(self, sequence: int):
+        """
+        Records which table the PwmProcess is writing the pins from.  Only the
+        PwmProcess calls this.
+        :param sequence: The sequence number the PwmProcess last read.
+        :return: None
+        """
+        struct.pack_into('<I', self._buf, 4, sequence)
+
+    def acknowledged(self):
+        """
+        :return: The sequence number the PwmProcess last read.
+        """
+        return struct.unpack_from('<I', self._buf, 4)[0]
+
+    def caught_up(self, sequence: int):
+        """
+        :param sequence: A sequence number of the table.
+        :return: True if the PwmProcess has read that table or a later one.  The
+        sequence numbers wrap around, so they are compared by how far apart they are.
+        """
+        behind = (sequence - self.acknowledged()) % SEQUENCE_MODULO
+        return behind == 0 or behind >= SEQUENCE_MODULO // 2
+
+    def request_stop(self):
+        """
+        Asks the PwmProcess to stop.
+        :return: None
+        """
+        struct.pack_into('<I', self._buf, 8, 1)
+
+    def stopping(self):
+        """
+        :return: True if the PwmProcess was asked to stop.
+        """
+        return struct.unpack_from('<I', self._buf, 8)[0] != 0
+
+    def close(self):
+        """
+        Detaches from the shared memory.  The PwmTable that created the shared
+        memory also frees it.
+        :return: None
+        """
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _latest_table(table: object, current: tuple, acknowledged: object):
+    """
+    Reads a PwmTable for the PwmProcess.  A new table is acknowledged, and the
+    owner of the PwmProcess is told through an Event.
+    :param table: The PwmTable.
+    :param current: The last table read, see PwmTable.read().
+    :param acknowledged: The Event to set when a new table is read.
+    :return: The new table, or current if there is none or it is being written.
+    """
+    latest = table.read()
+    if latest is None or latest[0] == current[0]:
+        return current
+    table.acknowledge(latest[0])
+    acknowledged.set()
+    return latest
+
+
+def _process_worker(topology: object, clock: object, table_name: str, mask_bytes: int, period_ns: int,
+                    wake: object, acknowledged: object):
+    """
+    The body of a PwmProcess.  Writes the slices in the PwmTable one after another
+    to the pins the table says it owns, and waits while there is nothing to dim.
+    The topology is the Lights object's, inherited when the process was forked.
+    :param topology: The Topology.Topology object with the OutputDevices.
+    :param clock: The Clock object to pace the slices on.
+    :param table_name: The name of the PwmTable's shared memory.
+    :param mask_bytes: The number of bytes in each channel bitmask.
+    :param period_ns: The length of a PWM period in nanoseconds.
+    :param wake: The multiprocessing.Event that is set when the table changes.
+    :param acknowledged: The multiprocessing.Event this sets when it reads a new table.
+    :return: None
+    """
+    raise_priority()
+    table = PwmTable(mask_bytes, table_name)
+    scheduler = Scheduler.Scheduler(clock)
+    # No table has been read yet.
+    current = (None, 0, 0, 0, [0] * LEVEL_BITS)
+    # The pins this process has written, and the channels it owned when it wrote them.
+    written = 0
+    written_owned = 0
+    deadline_ns = clock.monotonic_ns()
+    try:
+        while not table.stopping():
+            current = _latest_table(table, current, acknowledged)
+            sequence, channels, owned, frame, slices = current
+            if not channels:
+                written_owned = 0
+                wake.clear()
+                # Look again after clearing, in case the table changed just before.  A
+                # table that is being written is waited for too, as the writer sets
+                # wake once it is done.
+                latest = table.sequence()
+                if (latest == sequence or latest & 1) and not table.stopping():
+                    wake.wait()
+                deadline_ns = clock.monotonic_ns()
+                continue
+            now_ns = clock.monotonic_ns()
+            if now_ns - deadline_ns > period_ns:
+                # Fell a whole period behind, so start over from now instead of
+                # rushing through the missed slices.
+                deadline_ns = now_ns
+            for k in range(LEVEL_BITS):
+                if k:
+                    # Pick up changes between slices, so pins that are handed back are
+                    # let go of within one slice.
+                    current = _latest_table(table, current, acknowledged)
+                    sequence, channels, owned, frame, slices = current
+                mask = (frame & ~channels) | (slices[k] & channels)
+                # Pins are written in full the first time they are owned.
+                changed = (((mask ^ written) & owned) | (owned & ~written_owned))
+                topology.write(changed, mask)
+                written = (written & ~changed) | (mask & changed)
+                written_owned = owned
+                deadline_ns += (period_ns << k) // MAX_LEVEL
+                scheduler.sleep_until(deadline_ns)
+    finally:
+        table.close()
+
+
+class PwmProcess:
+    """
+    Dims the channels on OutputDevices that cannot dim by themselves, the same
+    way as the PwmEngine, but from a process of its own, so the show never holds
+    up a slice.  The Lights object hands the process the slices through a
+    PwmTable in shared memory.  Every pin has one writer: the process writes the
+    pins it dims, and the Lights object writes the others.  An OutputDevice whose
+    write() rewrites every pin (see OutputDevices.OutputDevice.writes_every_pin)
+    is written only by the process while any of its pins are dimmed, its other
+    pins from the frame in the table.  The Lights' fades are stepped by a thread
+    in the Lights object's process, once per period, as only the slices need to
+    be on time.
+    """
+    # The process writes the pins it dims itself, see set_levels().
+    owns_pins = True
+
+    def __init__(self, lights: object, clock: object = None, hz: int = PWM_HZ):
+        """
+        Initializes the PwmProcess.  It does not run until start() is called.
+        :param lights: The Lights object whose channels are dimmed.
+        :param clock: The Clock object to pace the slices on.  A Clock.RealClock if None.
+        :param hz: How many PWM periods per second.
+        """
+        self._lights = lights
+        self.clock = clock if clock is not None else Clock.RealClock()
+        self._period_ns = Scheduler.NS_PER_SECOND // hz
+        self._table = PwmTable((max(lights.channel_numbers, default=1) + 7) // 8)
+        self._channels = 0
+        self._slices = [0] * LEVEL_BITS
+        self._owned = 0
+        self._frame = 0
+        # The PwmTable and the OutputDevices go to the process by forking.
+        self._context = multiprocessing.get_context('fork')
+        self._wake_process = self._context.Event()
+        # Set by the process each time it reads a new table, see release().
+        self._acknowledged = self._context.Event()
+        self._wake = threading.Event()
+        self._running = False
+        self._process = None
+        self._thread = None
+
+    def _publish(self):
+        """
+        Writes the slices, the owned channels and the frame to the PwmTable and
+        wakes the process.
+        :return: None
+        """
+        self._table.write(self._channels, self._owned, self._frame, self._slices)
+        self._wake_process.set()
+
+    def set_levels(self, levels: dict, owned: int = 0, frame: int = 0):
+        """
+        Sets which channels the process drives, and how bright.
+        :param levels: A dictionary of channel bit to brightness (1 to MAX_LEVEL - 1).
+        :param owned: A bitmask of the channels the process writes: the dimmed ones,
+        and every channel of the OutputDevices that rewrite every pin.  The Lights
+        object writes no other channels of them, see set_frame().
+        :param frame: A bitmask of the channels that are on.
+        :return: None
+        """
+        released = self._owned & ~owned
+        self._channels, self._slices = bcm_slices(levels)
+        self._owned = owned
+        self._frame = frame
+        self._publish()
+        if released:
+            self.release()
+
+    def set_frame(self, changed: int, mask: int):
+        """
+        Turns on or off pins the process writes.
+        :param changed: A bitmask of the channels to change.
+        :param mask: A bitmask with the new state of the changed channels.
+        :return: None
+        """
+        self._frame = (self._frame & ~changed) | (mask & changed)
+        self._publish()
+
+    def release(self):
+        """
+        Waits until the process has read the latest PwmTable, so it no longer
+        writes the pins that were taken away from it.  Gives up after
+        STOP_TIMEOUT_SEC.
+        :return: None
+        """
+        sequence = self._table.sequence()
+        deadline_ns = self.clock.monotonic_ns() + int(STOP_TIMEOUT_SEC * Scheduler.NS_PER_SECOND)
+        while self._process is not None and self._process.is_alive():
+            # Cleared before looking, so a table read just after is not missed.
+            self._acknowledged.clear()
+            if self._table.caught_up(sequence):
+                return
+            remaining_ns = deadline_ns - self.clock.monotonic_ns()
+            if remaining_ns <= 0:
+                return
+            self._acknowledged.wait(remaining_ns / Scheduler.NS_PER_SECOND)
+
+    def start(self):
+        """
+        Starts the process and the fade thread, if they are not running yet.
+        :return: None
+        """
+        if self._running:
+            return
+        self._running = True
+        self._process = self._context.Process(
+            target=_process_worker, name='PwmProcess', daemon=True,
+            args=(self._lights.topology, self.clock, self._table.name, self._table.mask_bytes,
+                  self._period_ns, self._wake_process, self._acknowledged))
+        self._process.start()
+        self._thread = threading.Thread(target=self._run_fades, name='PwmFades', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the process and the fade thread, and frees the PwmTable.
+        :return: None
+        """
+        if not self._running:
+            return
+        self._running = False
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self._table.request_stop()
+        self._wake_process.set()
+        self._process.join(STOP_TIMEOUT_SEC)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+        self._process = None
+        self._table.close()
+
+    def wake(self):
+        """
+        Wakes up the fade thread when it is waiting for a fade.
+        :return: None
+        """
+        self._wake.set()
+
+    def _run_fades(self):
+        """
+        The body of the fade thread.  Steps the Lights' fades once per period, and
+        waits while nothing is fading.
+        :return: None
+        """
+        while self._running:
+            if not self._lights.fading():
+                self._wake.clear()
+                # Look again after clearing, in case a fade was added just before.
+                if not self._lights.fading():
+                    self._wake.wait()
+                continue
+            self._lights.update_fades()
+            self.clock.sleep(self._period_ns / Scheduler.NS_PER_SECOND)
@@ -0,0 +1,214 @@
+import json
+
+import OutputDevices
+
+
+def _create_gpio(device_config: dict, led_class: object):
+    """
+    Creates a set of GPIO pins.
+    :param device_config: The device's dictionary from the topology file.  "pins"
+    is the list of GPIO pin numbers.
+    :param led_class: The LED class to drive the pins with.
+    :return: An OutputDevices.LedDevice object.
+    """
+    return OutputDevices.LedDevice(device_config['name'], device_config['pins'], led_class)
+
+
+def _create_pwm(device_config: dict, led_class: object):
+    """
+    Creates a set of GPIO pins that can be dimmed.
+    :param device_config: The device's dictionary from the topology file.  "pins"
+    is the list of GPIO pin numbers.
+    :param led_class: Not used, the pins are driven with gpiozero PWMLED objects.
+    :return: An OutputDevices.LedDevice object.
+    """
+    if OutputDevices.PWMLED is None:
+        raise Exception('The gpiozero module is needed for the PWM pins "%s".' % (device_config['name']))
+    return OutputDevices.LedDevice(device_config['name'], device_config['pins'], OutputDevices.PWMLED, pwm=True)
+
+
+def _create_i2c(device_config: dict, led_class: object):
+    """
+    Creates an I2C port expander.
+    :param device_config: The device's dictionary from the topology file.
+    :param led_class: Not used.
+    :return: An OutputDevices.I2CExpanderDevice object.
+    """
+    return OutputDevices.I2CExpanderDevice(device_config['name'], device_config['address'],
+                                           device_config.get('bus', 1), device_config.get('pin_count', 16))
+
+
+def _create_shift_register(device_config: dict, led_class: object):
+    """
+    Creates a shift register chain.  With "spi" in the device's dictionary (a
+    dictionary with optional "bus", "device" and "speed_hz") the chain is clocked
+    from the SPI port, otherwise it is bit-banged on "data_pin" and "clock_pin".
+    Both need a "latch_pin".  With "record" set to true, nothing is driven and the
+    frames are recorded instead.
+    :param device_config: The device's dictionary from the topology file.
+    :param led_class: Not used.
+    :return: An OutputDevices.ShiftRegisterDevice object.
+    """
+    if device_config.get('record'):
+        output = OutputDevices.RecordingShiftOutput()
+    elif 'spi' in device_config:
+        spi = device_config['spi']
+        output = OutputDevices.SpiShiftOutput(device_config['latch_pin'], spi.get('bus', 0),
+                                              spi.get('device', 0), spi.get('speed_hz', 1000000))
+    else:
+        output = OutputDevices.GpioShiftOutput(device_config['data_pin'], device_config['clock_pin'],
+                                               device_config['latch_pin'])
+    return OutputDevices.ShiftRegisterDevice(device_config['name'], device_config['pin_count'], output)
+
+
+# The function that creates each "type" of device in a topology file.
+DEVICE_TYPES = {
+    'gpio': _create_gpio,
+    'pwm': _create_pwm,
+    'i2c': _create_i2c,
+    'shift_register': _create_shift_register,
+}
+
+
+def pin_count(device_config: dict):
+    """
+    :param device_config: A device's dictionary from the topology file.
+    :return: The number of pins (outlets) the device has.
+    """
+    if 'pins' in device_config:
+        return len(device_config['pins'])
+    return device_config['pin_count']
+
+
+class Topology:
+    """
+    Which OutputDevice and pin drives each channel.  The channel numbers do not
+    have to start at 1 or be contiguous, and there can be hundreds of them.
+    Looking up a channel is one list index.
+    """
+    def __init__(self, devices: list, channels: list):
+        """
+        Initializes this Topology.
+        :param devices: A list of OutputDevice objects.
+        :param channels: A list of (channel number, device index, pin) tuples.
+        """
+        self.devices = devices
+        self.channel_numbers = sorted(channel for channel, device_index, pin in channels)
+        if len(set(self.channel_numbers)) != len(self.channel_numbers):
+            raise Exception('A channel is assigned to more than one pin in the topology.')
+        # lookup[channel number] is (OutputDevice, pin), or None for unused numbers.
+        self.lookup = [None] * (max(self.channel_numbers, default=0) + 1)
+        for channel, device_index, pin in channels:
+            self.lookup[channel] = (devices[device_index], pin)
+
+    def locate(self, num: int):
+        """
+        :param num: A channel number.
+        :return: The (OutputDevice, pin) tuple that drives the channel.
+        """
+        return self.lookup[num]
+
+    def write(self, changed: int, mask: int):
+        """
+        Writes some channels to their OutputDevices, one write() per device.
+        :param changed: A bitmask of the channels to write.  Channel 1 is the least
+        significant bit.
+        :param mask: A bitmask with the new state of the changed channels.
+        :return: None
+        """
+        lookup = self.lookup
+        device_changes = {}
+        remaining = changed
+        while remaining:
+            # Walk the set bits from the lowest channel up.
+            bit = remaining & -remaining
+            remaining ^= bit
+            device, pin = lookup[bit.bit_length()]
+            device_changes.setdefault(device, {})[pin] = bool(mask & bit)
+        for device, changes in device_changes.items():
+            device.write(changes)
+
+    def device_masks(self):
+        """
+        :return: A dictionary of OutputDevice to the bitmask of the channels it drives.
+        """
+        masks = {}
+        for num in self.channel_numbers:
+            device, pin = self.lookup[num]
+            masks[device] = masks.get(device, 0) | (1 << (num - 1))
+        return masks
+
+    def close(self):
+        """
+        Closes every OutputDevice.
+        :return: None
+        """
+        for device in self.devices:
+            device.close()
+
+    @staticmethod
+    def simulated(channel_numbers: list, led_class: object):
+        """
+        Creates a Topology with one simulator LED object per channel.
+        :param channel_numbers: The channel numbers.
+        :param led_class: The simulator's LED class.
+        :return: A Topology object.
+        """
+        device = OutputDevices.LedDevice('simulator', channel_numbers, led_class)
+        return Topology([device], [(channel, 0, pin) for pin, channel in enumerate(channel_numbers)])
+
+    @staticmethod
+    def from_config(config: dict, led_class: object, simulate: bool = False):
+        """
+        Creates a Topology from a dictionary.  config["devices"] is a list of device
+        dictionaries, each with a "name", a "type" (a key of DEVICE_TYPES) and the
+        settings for that type.  A device's pins get consecutive channel numbers,
+        starting at its "first_channel", or right after the previous device's
+        channels if it has none.  A device can list its channel numbers in
+        "channels" instead, one per pin.
+        :param config: The topology dictionary.
+        :param led_class: The LED class for GPIO pins, or the simulator's LED class.
+        :param simulate: If True, no real devices are created.  Every channel is
+        shown by the simulator instead.
+        :return: A Topology object.
+        """
+        devices = []
+        channels = []
+        next_channel = 1
+        for device_config in config['devices']:
+            count = pin_count(device_config)
+            if 'channels' in device_config:
+                numbers = device_config['channels']
+                if len(numbers) != count:
+                    raise Exception('Device "%s" has %d pins but %d channels.' % (device_config['name'], count, len(numbers)))
+            else:
+                first = device_config.get('first_channel', next_channel)
+                numbers = list(range(first, first + count))
+            # Channel n is bit n - 1 of the channel masks, so there is no channel 0.
+            for channel in numbers:
+                if not isinstance(channel, int) or channel < 1:
+                    raise Exception('Device "%s" has channel %r, but channels are numbered from 1.' % (device_config['name'], channel))
+            if not simulate:
+                device_type = device_config['type']
+                if device_type not in DEVICE_TYPES:
+                    raise Exception('Unknown device type "%s" for "%s".' % (device_type, device_config['name']))
+                devices.append(DEVICE_TYPES[device_type](device_config, led_class))
+            for pin, channel in enumerate(numbers):
+                channels.append((channel, len(devices) - 1, pin))
+            next_channel = max(numbers, default=next_channel - 1) + 1
+        if simulate:
+            return Topology.simulated(sorted(channel for channel, device_index, pin in channels), led_class)
+        return Topology(devices, channels)
+
+    @staticmethod
+    def load(filename: str, led_class: object, simulate: bool = False):
+        """
+        Creates a Topology from a JSON file.  See from_config() for the format.
+        :param filename: The filename of the JSON file.
+        :param led_class: The LED class for GPIO pins, or the simulator's LED class.
+        :param simulate: If True, every channel is shown by the simulator instead.
+        :return: A Topology object.
+        """
+        with open(filename, 'r') as json_file:
+            config = json.load(json_file)
+        return Topology.from_config(config, led_class, simulate)
@@ -0,0 +1,145 @@
+import random
+
+import Lights
+import Scheduler
+import SoftPwm
+
+# The kinds of Transitions.  A cut switches at once, a wipe hands the channels
+# over to the incoming PatternKit in channel order, a dissolve hands them over
+# in a random order, and a crossfade dims one PatternKit's frames down while the
+# other's come up.
+CUT = 'cut'
+WIPE = 'wipe'
+DISSOLVE = 'dissolve'
+CROSSFADE = 'crossfade'
+
+KINDS = (CUT, WIPE, DISSOLVE, CROSSFADE)
+
+# How many seconds a Transition takes when none is given.
+TRANSITION_SEC = 1
+
+# How many composed frames per second a Transition puts up.  In a crossfade,
+# the brightness of the channels that differ between the two frames is set
+# this often.
+FRAME_HZ = 50
+
+
+class Transition:
+    """
+    Blends the end of one PatternKit into the start of the next, a whole frame
+    (channel bitmask) at a time.  Both PatternKits must have been rendered ahead
+    into ShowEngine.Timelines, so that their frames are known at any moment of
+    the transition.
+    """
+    def __init__(self, kind: str = DISSOLVE, seconds: float = TRANSITION_SEC, channel_numbers: list = None,
+                 seed: int = None):
+        """
+        Initializes the Transition.
+        :param kind: One of KINDS.
+        :param seconds: How long the Transition takes.
+        :param channel_numbers: The channel numbers of the Lights object, which a wipe
+        or dissolve hands over one at a time.  If None, they are taken from the
+        Lights object the first time the Transition plays.
+        :param seed: The random seed of a dissolve, for one that is the same every time.
+        """
+        if kind not in KINDS:
+            raise Exception('Unknown transition "%s".  It must be one of %s.' % (kind, ', '.join(KINDS)))
+        self.kind = kind
+        self.seconds = seconds if kind != CUT else 0
+        self._seed = seed
+        # The bitmask of the channels the incoming PatternKit has after k channels
+        # were handed over, for every k.  None until the channel numbers are known.
+        self._handed_over = None
+        if channel_numbers is not None:
+            self.set_channels(channel_numbers)
+
+    def set_channels(self, channel_numbers: list):
+        """
+        Sets the channels a wipe or dissolve hands over, in channel order for a
+        wipe and in a random order for a dissolve.
+        :param channel_numbers: The channel numbers of the Lights object.
+        :return: None
+        """
+        channel_numbers = sorted(channel_numbers)
+        if self.kind == DISSOLVE:
+            random.Random(self._seed).shuffle(channel_numbers)
+        self._handed_over = [0]
+        for num in channel_numbers:
+            self._handed_over.append(self._handed_over[-1] | Lights.channel_bit(num))
+
+    def selection(self, progress: float):
+        """
+        :param progress: How far along the Transition is, from 0 to 1.
+        :return: The bitmask of the channels that show the incoming PatternKit.
+        """
+        if progress >= 1:
+            return -1
+        if self._handed_over is None:
+            raise Exception('The %s has no channels to hand over.  Give it the channel numbers first.' % (self.kind))
+        return self._handed_over[int(progress * (len(self._handed_over) - 1))]
+
+    def compose(self, outgoing_mask: int, incoming_mask: int, progress: float):
+        """
+        Composes one frame of a wipe or dissolve.
+        :param outgoing_mask: The frame of the outgoing PatternKit.
+        :param incoming_mask: The frame of the incoming PatternKit.
+        :param progress: How far along the Transition is, from 0 to 1.
+        :return: The bitmask of the channels that are on.
+        """
+        selection = self.selection(progress)
+        return (outgoing_mask & ~selection) | (incoming_mask & selection)
+
+    def crossfade(self, lights: object, outgoing_mask: int, incoming_mask: int, progress: float):
+        """
+        Puts up one frame of a crossfade.  The channels that are the same in both
+        frames are set on or off, and the ones that differ are dimmed with
+        Lights.set_level(), up for the incoming frame and down for the outgoing one.
+        :param lights: The Lights object.
+        :param outgoing_mask: The frame of the outgoing PatternKit.
+        :param incoming_mask: The frame of the incoming PatternKit.
+        :param progress: How far along the Transition is, from 0 to 1.
+        :return: None
+        """
+        differ = outgoing_mask ^ incoming_mask
+        lights.set_frame(incoming_mask, ~differ)
+        level = int(progress * SoftPwm.MAX_LEVEL)
+        remaining = differ
+        while remaining:
+            bit = remaining & -remaining
+            remaining ^= bit
+            lights.set_level(bit.bit_length(), level if incoming_mask & bit else SoftPwm.MAX_LEVEL - level)
+
+    def play(self, lights: object, scheduler: object, outgoing: object, outgoing_ns: int, incoming: object,
+             incoming_ns: int):
+        """
+        Puts up the frames of the Transition, which starts with the incoming
+        PatternKit's Timeline.  The incoming Timeline then carries on from
+        seconds in.
+        :param lights: The Lights object.
+        :param scheduler: The Scheduler that paces the frames.
+        :param outgoing: The Timeline of the outgoing PatternKit.
+        :param outgoing_ns: The Scheduler.now_ns() value the outgoing Timeline started
+        at.  It keeps looping for as long as the Transition takes.
+        :param incoming: The Timeline of the incoming PatternKit.
+        :param incoming_ns: The Scheduler.now_ns() value the incoming Timeline and the
+        Transition start at.
+        :return: The Scheduler.now_ns() value the Transition ends at.
+        """
+        if self._handed_over is None:
+            self.set_channels(lights.channel_numbers)
+        length_ns = int(self.seconds * Scheduler.NS_PER_SECOND)
+        period_ns = Scheduler.NS_PER_SECOND // FRAME_HZ
+        for time_ns in range(incoming_ns, incoming_ns + length_ns, period_ns):
+            progress = (time_ns - incoming_ns) / length_ns
+            outgoing_mask = outgoing.mask_at((time_ns - outgoing_ns) / Scheduler.NS_PER_SECOND)
+            incoming_mask = incoming.mask_at((time_ns - incoming_ns) / Scheduler.NS_PER_SECOND)
+            scheduler.sleep_until(time_ns)
+            if self.kind == CROSSFADE:
+                self.crossfade(lights, outgoing_mask, incoming_mask, progress)
+            else:
+                lights.set_frame(self.compose(outgoing_mask, incoming_mask, progress))
+        end_ns = incoming_ns + length_ns
+        scheduler.sleep_until(end_ns)
+        # Ends the dimming of the crossfade too.
+        lights.set_frame(incoming.mask_at(self.seconds))
+        return end_ns
@@ -218,7 +218,12 @@ class GraphWin(tk.Canvas):
         self.pack()
         master.resizable(0,0)
         self.foreground = "black"
-        self.items = []
+        # Drawn items keyed by Tk id, so removing one does not search a list.
+        self.items = {}
+        # Drawn items that belong to a group, keyed by group name and then Tk id.
+        self.groups = {}
+        # The group name of each grouped item, keyed by Tk id.
+        self.itemGroups = {}
         self.mouseX = None
         self.mouseY = None
         self.bind("<Button-1>", self._onClick)
@@ -387,15 +392,41 @@ class GraphWin(tk.Canvas):
             self._mouseCallback(Point(e.x, e.y))
 
     def addItem(self, item):
-        self.items.append(item)
+        self.items[item.id] = item
 
     def delItem(self, item):
-        self.items.remove(item)
-
-    def redraw(self):
-        for item in self.items[:]:
+        self.items.pop(item.id, None)
+        group = self.itemGroups.pop(item.id, None)
+        if group is not None:
+            del self.groups[group][item.id]
+
+    def addToGroup(self, group, item):
+        """Put a drawn item in a named group.  The group name is also
+        added to the item as a Tk tag, so the whole group can be
+        configured with one itemconfig(group, ...) call."""
+        self.groups.setdefault(group, {})[item.id] = item
+        self.itemGroups[item.id] = group
+        self.addtag_withtag(group, item.id)
+
+    def getGroup(self, group):
+        """Return a list of the drawn items in a group"""
+        return list(self.groups.get(group, {}).values())
+
+    def redraw(self, group=None):
+        """Redraw every item, or only the items in one group"""
+        if group is None:
+            items = list(self.items.values())
+        else:
+            items = self.getGroup(group)
+        for item in items:
+            itemGroup = self.itemGroups.get(item.id)
+            tags = self.gettags(item.id)
             item.undraw()
             item.draw(self)
+            for tag in tags:
+                self.addtag_withtag(tag, item.id)
+            if itemGroup is not None:
+                self.addToGroup(itemGroup, item)
         self.update()
         
                       
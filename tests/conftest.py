@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the top of the repository, and the tests never open the
+# simulator's window.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('CHRISTMAS_LIGHTS_SIMULATOR', 'headless')
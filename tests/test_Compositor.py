@@ -0,0 +1,79 @@
+import Compositor
+
+COUNTER_KIT = '''import Pattern
+
+class PatternKit(Pattern.Pattern):
+    def __init__(self, lights):
+        super().__init__("CounterPatternKit", lights)
+        self.count = 0
+
+    def play(self):
+        # Channel 1 flips every .3 seconds, and channel 2 is on after the first
+        # play(), so a restart from all off would show.
+        self.count += 1
+        self.lights.channel(1).on()
+        self.sleep(.3)
+        self.lights.channel(1).off()
+        if self.count > 1:
+            self.lights.channel(2).on()
+        self.sleep(.3)
+'''
+
+
+class BlinkKit:
+    """
+    A PatternKit that flips channel 1 every .3 seconds and turns channel 2 on
+    after its first play().
+    """
+    def __init__(self):
+        self.lights = None
+        self.clock = None
+        self.scheduler = None
+        self.count = 0
+
+    def play(self):
+        self.count += 1
+        self.lights.channel(1).on()
+        self.scheduler.sleep(.3)
+        self.lights.channel(1).off()
+        if self.count > 1:
+            self.lights.channel(2).on()
+        self.scheduler.sleep(.3)
+
+
+def _frames(timeline):
+    return [(round(offset, 6), mask) for offset, mask in timeline]
+
+
+def test_layer_recorder_carries_on():
+    """
+    Each block carries on from where the last one stopped, in the middle of
+    play() and with the channels as they were.
+    """
+    recorder = Compositor.LayerRecorder(BlinkKit())
+    try:
+        first = recorder.record(1)
+        second = recorder.record(1)
+    finally:
+        recorder.close()
+    assert first.duration == second.duration == 1
+    assert _frames(first) == [(0, 0b01), (.3, 0b00), (.6, 0b01), (.9, 0b10)]
+    assert _frames(second) == [(0, 0b10), (.2, 0b11), (.5, 0b10), (.8, 0b11)]
+
+
+def test_layer_renderer(tmp_path):
+    """
+    The render process hands over block after block, each carrying on from the
+    last.
+    """
+    (tmp_path / 'CounterPatternKit.py').write_text(COUNTER_KIT)
+    compositor = Compositor.Compositor([Compositor.Layer('CounterPatternKit', [1, 2])])
+    renderer = compositor.renderer([str(tmp_path)], False, 1)
+    renderer.start()
+    try:
+        first = renderer.next_block()
+        second = renderer.next_block()
+    finally:
+        renderer.stop()
+    assert _frames(first) == [(0, 0b01), (.3, 0b00), (.6, 0b01), (.9, 0b10)]
+    assert _frames(second) == [(0, 0b10), (.2, 0b11), (.5, 0b10), (.8, 0b11)]
@@ -0,0 +1,95 @@
+import multiprocessing
+import time
+
+import FrameRing
+
+
+def test_full_and_empty():
+    ring = FrameRing.FrameRing(4, 2)
+    try:
+        assert len(ring) == 0 and ring.pop() is None and ring.peek() is None
+        for i in range(4):
+            assert ring.push(i, i + 1)
+        assert ring.full()
+        assert not ring.push(99, 99)
+        assert ring.peek() == (0, 1)
+        assert ring.pop() == (0, 1)
+        assert not ring.full()
+        assert ring.push(4, 5)
+        assert [ring.pop() for i in range(4)] == [(1, 2), (2, 3), (3, 4), (4, 5)]
+        assert ring.pop() is None
+    finally:
+        ring.close()
+
+
+def test_wraparound():
+    """
+    Frames keep their order and contents across many trips round the ring, and
+    masks as wide as the ring allows come back whole.
+    """
+    ring = FrameRing.FrameRing(3, 16)
+    try:
+        wide = (1 << 128) - 1
+        for i in range(100):
+            assert ring.push(-i, wide ^ i)
+            assert ring.push(i * 10 ** 9, i)
+            assert ring.pop() == (-i, wide ^ i)
+            assert ring.pop() == (i * 10 ** 9, i)
+        assert len(ring) == 0
+    finally:
+        ring.close()
+
+
+def test_clear():
+    ring = FrameRing.FrameRing(4, 1)
+    try:
+        ring.push(1, 1)
+        ring.push(2, 2)
+        ring.clear()
+        assert len(ring) == 0 and ring.pop() is None
+        assert ring.push(3, 3) and ring.pop() == (3, 3)
+    finally:
+        ring.close()
+
+
+def _producer(name: str, capacity: int, mask_bytes: int, count: int, full_seen: object):
+    """
+    Pushes count frames from another process, waiting whenever the ring is full.
+    """
+    ring = FrameRing.FrameRing(capacity, mask_bytes, name)
+    try:
+        for i in range(count):
+            while not ring.push(i, i * 7):
+                full_seen.value = 1
+                time.sleep(.0001)
+    finally:
+        ring.close()
+
+
+def test_across_processes():
+    """
+    A producer process that is faster than the consumer fills the ring and waits,
+    and every frame arrives once, in order.
+    """
+    count = 2000
+    ring = FrameRing.FrameRing(8, 4)
+    full_seen = multiprocessing.Value('b', 0)
+    process = multiprocessing.Process(target=_producer, args=(ring.name, 8, 4, count, full_seen))
+    try:
+        process.start()
+        # Let the producer fill the ring before anything is popped.
+        while not full_seen.value and process.is_alive():
+            time.sleep(.001)
+        frames = []
+        while len(frames) < count:
+            frame = ring.pop()
+            if frame is not None:
+                frames.append(frame)
+            elif not process.is_alive() and len(ring) == 0:
+                break
+        process.join()
+        assert process.exitcode == 0
+        assert full_seen.value == 1
+        assert frames == [(i, i * 7) for i in range(count)]
+    finally:
+        ring.close()
@@ -0,0 +1,84 @@
+import Clock
+import Lights
+import OutputDevices
+import Topology
+
+
+class RecordingDevice(OutputDevices.OutputDevice):
+    """
+    An OutputDevice that records every write() instead of driving pins.
+    """
+    def __init__(self, name: str, pin_count: int):
+        super().__init__(name, pin_count)
+        self.writes = []
+
+    def write(self, changes: dict):
+        self.writes.append(dict(changes))
+
+
+def _lights():
+    """
+    :return: A Lights object with channels 1 to 4 on one RecordingDevice and 5 to 8
+    on another, and the two devices.
+    """
+    first = RecordingDevice('first', 4)
+    second = RecordingDevice('second', 4)
+    channels = [(num, 0, num - 1) for num in range(1, 5)] + [(num, 1, num - 5) for num in range(5, 9)]
+    lights = Lights.Lights(Topology.Topology([first, second], channels), Clock.VirtualClock())
+    first.writes.clear()
+    second.writes.clear()
+    return lights, first, second
+
+
+def test_set_frame_writes_only_changed_channels():
+    lights, first, second = _lights()
+    lights.set_frame(0b00000101)
+    assert first.writes == [{0: True, 2: True}]
+    assert second.writes == []
+    lights.set_frame(0b00000101)
+    assert first.writes == [{0: True, 2: True}]
+    lights.set_frame(0b00100110)
+    assert first.writes == [{0: True, 2: True}, {0: False, 1: True}]
+    assert second.writes == [{1: True}]
+    assert lights.state == 0b00100110
+
+
+def test_set_frame_writes_each_device_once():
+    lights, first, second = _lights()
+    lights.set_frame(0b11111111)
+    assert first.writes == [{0: True, 1: True, 2: True, 3: True}]
+    assert second.writes == [{0: True, 1: True, 2: True, 3: True}]
+
+
+def test_set_frame_ignores_unknown_channels():
+    lights, first, second = _lights()
+    lights.set_frame(1 << 20)
+    assert first.writes == [] and second.writes == []
+    assert lights.state == 0
+
+
+def test_set_frame_selected_channels():
+    lights, first, second = _lights()
+    lights.set_frame(0b0011)
+    lights.set_frame(0b1100, 0b0110)
+    assert first.writes == [{0: True, 1: True}, {1: False, 2: True}]
+    assert lights.state == 0b0101
+
+
+def test_apply_writes_only_changed_channels():
+    lights, first, second = _lights()
+    lights.apply({1: True, 6: True, 7: False})
+    assert first.writes == [{0: True}]
+    assert second.writes == [{1: True}]
+    lights.apply({1: True, 2: False, 6: False})
+    assert first.writes == [{0: True}]
+    assert second.writes == [{1: True}, {1: False}]
+    assert lights.state == 0b0001
+
+
+def test_channel_on_off():
+    lights, first, second = _lights()
+    lights.channel(8).on()
+    lights.channel(8).on()
+    lights.channel(8).off()
+    assert second.writes == [{3: True}, {3: False}]
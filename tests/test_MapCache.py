@@ -0,0 +1,89 @@
+import json
+import os
+import pickle
+
+import MapCache
+
+MAP = {
+    'name': 'Test', 'window_width': 200, 'window_height': 100, 'bg_color': 'black',
+    'channels': [
+        {'name': 'tree', 'shape': 'triangle', 'channel': 1, 'x': 10, 'y': 20, 'color': 'green',
+         'height': 40, 'width': 30},
+        {'name': 'star', 'shape': 'circle', 'channel': 1, 'x': 20, 'y': 5, 'color': 'yellow', 'radius': 4},
+        {'name': 'roof', 'shape': 'line', 'channel': 2, 'x': 0, 'y': 90, 'color': 'red', 'x2': 50, 'y2': 60},
+        {'name': 'door', 'shape': 'rectangle', 'channel': 1, 'x': 60, 'y': 70, 'color': 'green',
+         'height': 20, 'width': 10},
+    ],
+}
+
+
+def _write_map(tmp_path, map_data: dict):
+    """
+    :param tmp_path: The directory to write the map in.
+    :param map_data: The map JSON data.
+    :return: The filename of the map JSON file.
+    """
+    filename = str(tmp_path / 'MapData.json')
+    with open(filename, 'w') as json_file:
+        json.dump(map_data, json_file)
+    return filename
+
+
+def _fail_compile(json_data: dict, color_to_rgb: object = None):
+    raise AssertionError('The map was compiled instead of read from the cache.')
+
+
+def test_compiled_map():
+    """
+    The compiled map has each shape's points ready to draw, and the shapes
+    grouped by channel and color.
+    """
+    compiled = MapCache.compile_map(MAP)
+    points = [entry[8] for entry in compiled['entries']]
+    assert points == [((10, 60), (25, 20), (40, 60)), ((22, 7),), ((0, 90), (50, 60)), ((60, 70), (70, 90))]
+    assert compiled['channels'] == {1: {'green': [0, 3], 'yellow': [1]}, 2: {'red': [2]}}
+
+
+def test_cache_is_used(tmp_path, monkeypatch):
+    """
+    The second load reads the cache instead of compiling the map again.
+    """
+    filename = _write_map(tmp_path, MAP)
+    compiled = MapCache.load(filename)
+    assert os.path.isfile(MapCache.cache_filename(filename))
+    monkeypatch.setattr(MapCache, 'compile_map', _fail_compile)
+    assert MapCache.load(filename) == compiled
+
+
+def test_stale_cache_is_rebuilt(tmp_path, monkeypatch):
+    """
+    A cache made from other JSON contents, or by another CACHE_VERSION, is
+    compiled again and rewritten.
+    """
+    filename = _write_map(tmp_path, MAP)
+    MapCache.load(filename)
+    changed = dict(MAP, window_width=300)
+    _write_map(tmp_path, changed)
+    assert MapCache.load(filename)['window_width'] == 300
+    monkeypatch.setattr(MapCache, 'CACHE_VERSION', MapCache.CACHE_VERSION + 1)
+    compiled = []
+    compile_map = MapCache.compile_map
+
+    def counting_compile(json_data: dict, color_to_rgb: object = None):
+        compiled.append(json_data['name'])
+        return compile_map(json_data, color_to_rgb)
+    monkeypatch.setattr(MapCache, 'compile_map', counting_compile)
+    assert MapCache.load(filename)['window_width'] == 300
+    assert compiled == ['Test']
+    with open(MapCache.cache_filename(filename), 'rb') as cache_file:
+        assert pickle.load(cache_file)['version'] == MapCache.CACHE_VERSION
+
+
+def test_damaged_cache_is_rebuilt(tmp_path):
+    """
+    A cache file that cannot be read is rebuilt.
+    """
+    filename = _write_map(tmp_path, MAP)
+    with open(MapCache.cache_filename(filename), 'wb') as cache_file:
+        cache_file.write(b'not a pickle')
+    assert MapCache.load(filename) == MapCache.compile_map(MAP)
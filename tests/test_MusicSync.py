@@ -0,0 +1,48 @@
+import wave
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+import MusicSync
+
+
+def _click_track(filename: str, bpm: float, sample_rate: int, seconds: float = 30, first_sec: float = .37):
+    """
+    Writes a 16-bit mono WAV file of short clicks on every beat.
+    :param filename: The filename of the WAV file.
+    :param bpm: The beats per minute.
+    :param sample_rate: The number of samples per second.
+    :param seconds: The length of the track.
+    :param first_sec: The time of the first click.
+    :return: A numpy array of the click times in seconds.
+    """
+    rng = numpy.random.default_rng(1)
+    samples = rng.normal(0, .01, int(seconds * sample_rate))
+    length = int(.03 * sample_rate)
+    click = numpy.sin(2 * numpy.pi * 1000 * numpy.arange(length) / sample_rate) * numpy.exp(-numpy.arange(length) / (.005 * sample_rate))
+    clicks = numpy.arange(first_sec, seconds - .1, 60 / bpm)
+    for start in clicks:
+        index = int(round(start * sample_rate))
+        samples[index:index + length] += .8 * click
+    with wave.open(filename, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((numpy.clip(samples, -1, 1) * 32767).astype('<i2').tobytes())
+    return clicks
+
+
+@pytest.mark.parametrize('bpm', [120, 140, 93])
+@pytest.mark.parametrize('sample_rate', [44100, 22050])
+def test_click_track(tmp_path, bpm, sample_rate):
+    filename = str(tmp_path / 'clicks.wav')
+    clicks = _click_track(filename, bpm, sample_rate)
+    analysis = MusicSync.analyze(filename)
+    assert abs(analysis['bpm'] - bpm) <= 1
+    # The beats carry on at the same tempo after the last click, to the end of the track.
+    beats = numpy.array(analysis['beats'])
+    beats = beats[beats < clicks[-1] + 30 / bpm]
+    assert len(beats) == len(clicks)
+    # Every beat lands on its click, from the start of the track to the end.
+    assert numpy.abs(beats - clicks).max() <= .03
@@ -0,0 +1,57 @@
+import Clock
+import PatternDriver
+
+GOOD_KIT = '''import Pattern
+
+class PatternKit(Pattern.Pattern):
+    def __init__(self, lights):
+        super().__init__("GoodPatternKit", lights)
+
+    def play(self):
+        self.lights.channel(1).on()
+        self.sleep(.25)
+        self.lights.channel(1).off()
+        self.sleep(.25)
+'''
+
+IMPORT_ERROR_KIT = '''import Pattern
+
+raise RuntimeError('broken at import')
+
+class PatternKit(Pattern.Pattern):
+    pass
+'''
+
+INIT_ERROR_KIT = '''import Pattern
+
+class PatternKit(Pattern.Pattern):
+    def __init__(self, lights):
+        raise ValueError('broken at construction')
+'''
+
+
+def test_broken_kits_are_skipped(tmp_path):
+    """
+    PatternKits that fail to import or to construct lose their turn, the error
+    is recorded, and the rest of the show carries on.
+    """
+    (tmp_path / 'AGoodPatternKit.py').write_text(GOOD_KIT)
+    (tmp_path / 'BImportErrorPatternKit.py').write_text(IMPORT_ERROR_KIT)
+    (tmp_path / 'CInitErrorPatternKit.py').write_text(INIT_ERROR_KIT)
+    driver = PatternDriver.PatternDriver(Clock.VirtualClock(), [str(tmp_path)])
+    driver.run(timeout_sec=1, cycles=1)
+    assert sorted(driver.pattern_objects.reload_errors) == ['BImportErrorPatternKit', 'CInitErrorPatternKit']
+    assert isinstance(driver.pattern_objects.reload_errors['CInitErrorPatternKit'], ValueError)
+    # Only the good PatternKit's turn took time.
+    assert driver.clock.monotonic_ns() == 10 ** 9
+
+
+def test_all_kits_broken_sleeps_dark(tmp_path):
+    """
+    A show with nothing but broken PatternKits waits a turn per cycle instead of
+    spinning.
+    """
+    (tmp_path / 'ImportErrorPatternKit.py').write_text(IMPORT_ERROR_KIT)
+    driver = PatternDriver.PatternDriver(Clock.VirtualClock(), [str(tmp_path)])
+    driver.run(timeout_sec=1, cycles=2)
+    assert driver.clock.monotonic_ns() == 2 * 10 ** 9
@@ -0,0 +1,40 @@
+import datetime
+
+import Playlist
+
+
+def test_window_past_midnight():
+    """
+    A PatternKit window that runs past midnight is open after midnight, even in a
+    show that starts at midnight, where the window opened the day before.
+    """
+    playlist = Playlist.Playlist({
+        'duration': 600,
+        'kits': [{'name': 'Late', 'window': ['22:00', '02:00']}, {'name': 'Day', 'window': ['08:00', '20:00']}],
+    })
+    date = datetime.date(2026, 12, 1)
+    schedule = playlist.schedule(date, 2)
+    for day in (date, date + datetime.timedelta(days=1)):
+        for clock, name in (('00:30', 'Late'), ('01:55', 'Late'), ('03:00', None), ('12:00', 'Day'),
+                            ('21:00', None), ('23:00', 'Late')):
+            slot = schedule.slot_at(Playlist.local_time(day, Playlist.parse_clock(clock)))
+            assert (slot[2] if slot else None) == name, (day, clock)
+    # Late's first turns end with its window at 02:00, and Day's start at 08:00.
+    closing = Playlist.local_time(date, Playlist.parse_clock('02:00'))
+    assert closing in schedule.ends
+    assert schedule.next_slot(closing)[0] == Playlist.local_time(date, Playlist.parse_clock('08:00'))
+
+
+def test_all_day_window_is_not_cut_at_midnight():
+    """
+    The windows of consecutive days that touch are one window, so a turn is not
+    cut short at midnight.
+    """
+    playlist = Playlist.Playlist({
+        'start': '23:00', 'end': '01:00', 'duration': 1800,
+        'kits': [{'name': 'Always', 'window': ['0:00', '0:00']}],
+    })
+    date = datetime.date(2026, 12, 1)
+    schedule = playlist.schedule(date, 1)
+    assert len(schedule) == 4
+    assert all(end - start == 1800 for start, end in zip(schedule.starts, schedule.ends))
@@ -0,0 +1,66 @@
+import Clock
+import KitRegistry
+import RenderAhead
+
+BROKEN_KIT = 'import Pattern\n\nraise RuntimeError("broken")\n\nclass PatternKit(Pattern.Pattern):\n    pass\n'
+
+GOOD_KIT = '''import Pattern
+
+class PatternKit(Pattern.Pattern):
+    def __init__(self, lights):
+        super().__init__("GoodPatternKit", lights)
+
+    def play(self):
+        self.lights.channel(1).on()
+        self.sleep(.5)
+        self.lights.channel(1).off()
+        self.sleep(.5)
+'''
+
+
+def _run(tmp_path, monkeypatch, kits: dict, cycles: int):
+    """
+    Runs a RenderAheadDriver on a VirtualClock.
+    :param tmp_path: The directory to write the PatternKit files in.
+    :param monkeypatch: The pytest monkeypatch fixture, to point the driver at them.
+    :param kits: The source of each PatternKit, keyed by module name.
+    :param cycles: Number of times to run through all of the PatternKits.
+    :return: The frames written to the Lights, and the show time the run ended at.
+    """
+    for name, source in kits.items():
+        (tmp_path / (name + '.py')).write_text(source)
+    monkeypatch.setenv(KitRegistry.KITS_ENV, str(tmp_path))
+    driver = RenderAhead.RenderAheadDriver(Clock.VirtualClock())
+    frames = []
+    set_frame = driver.lights.set_frame
+
+    def record_frame(mask, *args):
+        frames.append((driver.clock.monotonic_ns(), mask))
+        set_frame(mask, *args)
+    driver.lights.set_frame = record_frame
+    try:
+        start_ns = driver.clock.monotonic_ns()
+        driver.run(timeout_sec=1, cycles=cycles)
+        return frames, driver.clock.monotonic_ns() - start_ns
+    finally:
+        driver.close()
+
+
+def test_broken_kit_renders_dark(tmp_path, monkeypatch):
+    """
+    A PatternKit that fails to import is dark for its turn, and the show goes on.
+    """
+    frames, length_ns = _run(tmp_path, monkeypatch, {'ABrokenPatternKit': BROKEN_KIT, 'BGoodPatternKit': GOOD_KIT}, 1)
+    assert length_ns == 2 * 10 ** 9
+    # Dark for the broken PatternKit's second, then on for half a second.
+    assert [(time_ns - frames[0][0], mask) for time_ns, mask in frames if mask] == [(10 ** 9, 1)]
+
+
+def test_all_kits_broken(tmp_path, monkeypatch):
+    """
+    A show of nothing but broken PatternKits stays dark for every turn instead
+    of spinning in the render process.
+    """
+    frames, length_ns = _run(tmp_path, monkeypatch, {'BrokenPatternKit': BROKEN_KIT}, 3)
+    assert length_ns == 3 * 10 ** 9
+    assert all(mask == 0 for time_ns, mask in frames)
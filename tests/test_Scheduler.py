@@ -0,0 +1,91 @@
+import pytest
+
+import Clock
+import Scheduler
+
+MS = 1000000
+
+
+class OversleepingClock(Clock.VirtualClock):
+    """
+    A VirtualClock whose every sleep() wakes up late, the way a real clock does.
+    """
+    def __init__(self, late_ns: int):
+        super().__init__()
+        self.late_ns = late_ns
+
+    def sleep(self, seconds: float):
+        super().sleep(seconds)
+        self._now_ns += self.late_ns
+
+
+def test_deadlines_do_not_drift():
+    """
+    Sleeps are measured from the previous deadline, so lateness and float steps
+    never add up.
+    """
+    clock = OversleepingClock(3 * MS)
+    scheduler = Scheduler.Scheduler(clock)
+    scheduler.start()
+    for i in range(1000):
+        scheduler.sleep(.1)
+    # Only the last sleep's lateness is left, not a thousand of them.
+    assert clock.monotonic_ns() == 100 * Scheduler.NS_PER_SECOND + 3 * MS
+    assert scheduler.stats.frames == 1000
+    assert scheduler.stats.max_ns == 3 * MS
+
+
+def test_time_spent_between_sleeps_is_taken_out():
+    """
+    The time a PatternKit spends between sleeps comes out of the next sleep.
+    """
+    clock = Clock.VirtualClock()
+    scheduler = Scheduler.Scheduler(clock)
+    scheduler.start()
+    for i in range(10):
+        # Turning the channels on and off takes 20 ms.
+        clock.sleep(.02)
+        scheduler.sleep(.1)
+        assert clock.monotonic_ns() == (i + 1) * 100 * MS
+
+
+def test_kit_timeout():
+    """
+    The sleep() that would reach the end of the turn sleeps until the end and
+    raises KitTimeout.
+    """
+    clock = Clock.VirtualClock()
+    scheduler = Scheduler.Scheduler(clock)
+    scheduler.start(1)
+    for i in range(3):
+        scheduler.sleep(.3)
+    assert not scheduler.expired()
+    with pytest.raises(Scheduler.KitTimeout):
+        scheduler.sleep(.3)
+    assert clock.monotonic_ns() == Scheduler.NS_PER_SECOND
+    assert scheduler.expired()
+
+
+def test_preempt():
+    """
+    After preempt() the next sleep() raises KitTimeout without sleeping.
+    """
+    clock = Clock.VirtualClock()
+    scheduler = Scheduler.Scheduler(clock)
+    scheduler.start(10)
+    scheduler.sleep(.5)
+    scheduler.preempt()
+    with pytest.raises(Scheduler.KitTimeout):
+        scheduler.sleep(.5)
+    assert clock.monotonic_ns() == Scheduler.NS_PER_SECOND // 2
+
+
+def test_idle_callbacks_run_before_sleeping():
+    clock = Clock.VirtualClock()
+    scheduler = Scheduler.Scheduler(clock)
+    calls = []
+    scheduler.add_idle_callback(lambda: calls.append(clock.monotonic_ns()))
+    scheduler.start()
+    scheduler.sleep(.25)
+    scheduler.sleep(.25)
+    assert calls == [0, 250 * MS]
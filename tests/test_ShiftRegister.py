@@ -0,0 +1,78 @@
+import OutputDevices
+
+
+def _latch(bitstream: str, chips: int):
+    """
+    Clocks bits into a chain of 74HC595 registers the way the hardware does:
+    each clock shifts Q0 to Q1 and so on, Q7 of one register into Q0 of the
+    next, and the new bit into Q0 of the register nearest the Raspberry Pi.
+    :param bitstream: The bits of one frame in the order they are shifted out.
+    :param chips: The number of registers in the chain.
+    :return: A list of the pins that are on, pin 8 * k + j being Qj of register k
+    counted from the Raspberry Pi.
+    """
+    outputs = [0] * (8 * chips)
+    for bit in bitstream:
+        outputs = [int(bit)] + outputs[:-1]
+    return [pin for pin, state in enumerate(outputs) if state]
+
+
+def _device(pin_count: int):
+    output = OutputDevices.RecordingShiftOutput()
+    device = OutputDevices.ShiftRegisterDevice('chain', pin_count, output)
+    return device, output
+
+
+def test_starts_all_off():
+    device, output = _device(24)
+    assert output.frames == [bytes(3)]
+
+
+def test_bitstream_order_three_chips():
+    device, output = _device(24)
+    output.frames.clear()
+    device.write({0: True})
+    assert output.bitstream() == '0' * 23 + '1'
+    output.frames.clear()
+    device.write({8: True, 23: True})
+    assert output.bitstream() == '10000000' + '00000001' + '00000001'
+    assert _latch(output.bitstream(), 3) == [0, 8, 23]
+
+
+def test_every_pin_lands_on_its_output():
+    device, output = _device(16)
+    for pin in range(16):
+        output.frames.clear()
+        device.write({pin: True})
+        assert _latch(output.bitstream(), 2) == list(range(pin + 1))
+
+
+def test_one_burst_per_write():
+    """
+    Any number of changes go out in one frame, with the pins that did not change
+    kept as they were.
+    """
+    device, output = _device(16)
+    output.frames.clear()
+    device.write({pin: True for pin in range(0, 16, 2)})
+    device.write({0: False, 15: True})
+    assert len(output.frames) == 2
+    assert _latch(output.bitstream()[16:], 2) == list(range(2, 16, 2)) + [15]
+
+
+def test_partial_last_chip():
+    """
+    A chain with fewer pins than its registers have still shifts whole bytes.
+    """
+    device, output = _device(12)
+    output.frames.clear()
+    device.write({11: True})
+    assert output.frames == [bytes([0b00001000, 0])]
+    assert _latch(output.bitstream(), 2) == [11]
+
+
+def test_close_turns_everything_off():
+    device, output = _device(16)
+    device.write({3: True, 12: True})
+    device.close()
+    assert output.frames[-1] == bytes(2)
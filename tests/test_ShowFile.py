@@ -0,0 +1,87 @@
+import random
+
+import Clock
+import PatternDriver
+import ShowFile
+
+CHANNEL_NUMBERS = [1, 2, 3, 5, 8, 13, 21]
+
+
+def _random_show(seed: int):
+    """
+    :param seed: The random seed.
+    :return: A list of (mask, ticks) runs, some of them repeating the one before.
+    """
+    rng = random.Random(seed)
+    runs = []
+    for i in range(300):
+        mask = rng.getrandbits(24) if not runs or rng.random() < .8 else runs[-1][0]
+        runs.append((mask, rng.randint(1, 40)))
+    return runs
+
+
+def _round_trip(tmp_path, deltas: bool):
+    """
+    Writes a random show and checks every tick, and the frames from a few
+    starting ticks, against what was written.
+    :param tmp_path: The directory to write the show file in.
+    :param deltas: True to store the show as channel events, False for runs.
+    :return: None
+    """
+    all_mask = sum(1 << (num - 1) for num in CHANNEL_NUMBERS)
+    runs = _random_show(7)
+    filename = str(tmp_path / 'show.xlsh')
+    writer = ShowFile.ShowWriter(filename, CHANNEL_NUMBERS, fps=50, deltas=deltas, keyframe_sec=1)
+    expected = []
+    for mask, ticks in runs:
+        writer.add(mask, ticks)
+        expected.extend([mask & all_mask] * ticks)
+    writer.close()
+    reader = ShowFile.ShowReader(filename)
+    try:
+        assert reader.ticks == len(expected)
+        for tick, mask in enumerate(expected):
+            assert reader.mask_at(tick) == mask, tick
+        for start in (0, 1, 49, 50, 51, 777, len(expected) - 1):
+            changes = [(start, expected[start])]
+            for tick in range(start + 1, len(expected)):
+                if expected[tick] != expected[tick - 1]:
+                    changes.append((tick, expected[tick]))
+            assert list(reader.frames(start)) == changes, start
+    finally:
+        reader.close()
+
+
+def test_round_trip_deltas(tmp_path):
+    _round_trip(tmp_path, deltas=True)
+
+
+def test_round_trip_runs(tmp_path):
+    _round_trip(tmp_path, deltas=False)
+
+
+def test_compile_show_records_broken_kits_dark(tmp_path):
+    """
+    A PatternKit that fails to load is recorded dark for its turn, and the rest
+    of the show is still compiled.
+    """
+    kits = tmp_path / 'kits'
+    kits.mkdir()
+    (kits / 'ABrokenPatternKit.py').write_text('import Pattern\n\nraise RuntimeError("broken")\n\n'
+                                               'class PatternKit(Pattern.Pattern):\n    pass\n')
+    (kits / 'BGoodPatternKit.py').write_text(
+        'import Pattern\n\nclass PatternKit(Pattern.Pattern):\n'
+        '    def __init__(self, lights):\n        super().__init__("BGoodPatternKit", lights)\n\n'
+        '    def play(self):\n        self.lights.channel(1).on()\n        self.sleep(1)\n')
+    driver = PatternDriver.PatternDriver(Clock.VirtualClock(), [str(kits)])
+    filename = str(tmp_path / 'show.xlsh')
+    ShowFile.compile_show(filename, driver.pattern_objects, 1, fps=10)
+    reader = ShowFile.ShowReader(filename)
+    try:
+        assert reader.cues == [(0, 'ABrokenPatternKit'), (10, 'BGoodPatternKit')]
+        assert reader.ticks == 20
+        assert reader.mask_at(5) == 0
+        assert reader.mask_at(15) == 1
+    finally:
+        reader.close()
+    assert 'ABrokenPatternKit' in driver.pattern_objects.reload_errors
@@ -0,0 +1,257 @@
+import struct
+import threading
+
+import Clock
+import Lights
+import OutputDevices
+import SoftPwm
+import Topology
+
+PERIOD_NS = 10000000
+
+
+class RecordingDevice(OutputDevices.OutputDevice):
+    """
+    An OutputDevice with independent pins that records every write().
+    """
+    def __init__(self, name: str, pin_count: int):
+        super().__init__(name, pin_count)
+        self.writes = []
+
+    def write(self, changes: dict):
+        self.writes.append(dict(changes))
+
+
+class TimedShiftOutput(OutputDevices.RecordingShiftOutput):
+    """
+    A RecordingShiftOutput that records the time of every frame as well.
+    """
+    def __init__(self, clock: object):
+        super().__init__()
+        self.clock = clock
+        self.times = []
+
+    def shift_out(self, data: bytes):
+        super().shift_out(data)
+        self.times.append(self.clock.monotonic_ns())
+
+
+class SliceClock(Clock.VirtualClock):
+    """
+    A VirtualClock that calls a function before every sleep, with the number of
+    sleeps so far, so a test can change the PwmTable or stop the worker.
+    """
+    def __init__(self, before_sleep: object):
+        super().__init__()
+        self.before_sleep = before_sleep
+        self.sleeps = 0
+
+    def sleep(self, seconds: float):
+        self.before_sleep(self.sleeps)
+        self.sleeps += 1
+        super().sleep(seconds)
+
+
+class RecordingPwm:
+    """
+    Stands in for a PwmProcess in a Lights object and records what it is handed.
+    """
+    owns_pins = True
+
+    def __init__(self):
+        self.owned = []
+        self.frames = []
+
+    def set_levels(self, levels: dict, owned: int = 0, frame: int = 0):
+        self.owned.append(owned)
+
+    def set_frame(self, changed: int, mask: int):
+        self.frames.append((changed, mask))
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def wake(self):
+        pass
+
+
+def _run_worker(monkeypatch, topology: object, table: object, clock: object):
+    """
+    Runs the body of a PwmProcess in this thread until the table asks it to stop.
+    :return: The Event the worker sets when it reads a new table.
+    """
+    monkeypatch.setattr(SoftPwm, 'raise_priority', lambda: None)
+    acknowledged = threading.Event()
+    SoftPwm._process_worker(topology, clock, table.name, table.mask_bytes, PERIOD_NS, threading.Event(),
+                            acknowledged)
+    return acknowledged
+
+
+def test_bcm_slices():
+    channels, slices = SoftPwm.bcm_slices({0b01: 5, 0b10: 128})
+    assert channels == 0b11
+    assert slices == [0b01, 0, 0b01, 0, 0, 0, 0, 0b10]
+
+
+def test_slice_schedule(monkeypatch):
+    """
+    A shift register is written once for each slice that differs from the one
+    before, at the start of the slice, and slice k lasts 2**k 255ths of a period.
+    """
+    table = SoftPwm.PwmTable(1)
+
+    def stop_after_a_period(sleeps: int):
+        if sleeps == SoftPwm.LEVEL_BITS - 1:
+            table.request_stop()
+    clock = SliceClock(stop_after_a_period)
+    output = TimedShiftOutput(clock)
+    device = OutputDevices.ShiftRegisterDevice('chain', 8, output)
+    topology = Topology.Topology([device], [(num, 0, num - 1) for num in range(1, 9)])
+    output.frames.clear()
+    output.times.clear()
+    try:
+        # Channel 1 at 5 (slices 0 and 2), channel 2 at 128 (slice 7), channel 3 on.
+        channels, slices = SoftPwm.bcm_slices({0b001: 5, 0b010: 128})
+        table.write(channels, 0xff, 0b100, slices)
+        acknowledged = _run_worker(monkeypatch, topology, table, clock)
+        assert acknowledged.is_set() and table.acknowledged() == table.sequence()
+    finally:
+        table.close()
+    starts = [0]
+    for k in range(SoftPwm.LEVEL_BITS):
+        starts.append(starts[-1] + (PERIOD_NS << k) // SoftPwm.MAX_LEVEL)
+    assert list(zip(output.times, output.frames)) == [
+        (starts[0], bytes([0b101])), (starts[1], bytes([0b100])), (starts[2], bytes([0b101])),
+        (starts[3], bytes([0b100])), (starts[7], bytes([0b110]))]
+    assert PERIOD_NS - SoftPwm.LEVEL_BITS <= clock.monotonic_ns() <= PERIOD_NS
+    assert clock.monotonic_ns() == starts[-1]
+
+
+def test_worker_writes_only_its_pins(monkeypatch):
+    """
+    On an OutputDevice with independent pins the worker writes only the pins it
+    owns, and lets go of a pin within one slice of it being handed back.
+    """
+    table = SoftPwm.PwmTable(1)
+    handed_back_at = []
+
+    def hand_back(sleeps: int):
+        if sleeps == 1:
+            # Channel 2 is handed back while it is on.
+            table.write(0b01, 0b01, 0, SoftPwm.bcm_slices({0b01: 0b01010101})[1])
+            handed_back_at.append(len(device.writes))
+        elif sleeps == 2 * SoftPwm.LEVEL_BITS - 1:
+            table.request_stop()
+    device = RecordingDevice('gpio', 4)
+    topology = Topology.Topology([device], [(num, 0, num - 1) for num in range(1, 5)])
+    try:
+        # Channel 1 is on in every other slice and channel 2 only in slice 1.  Channels
+        # 3 and 4 are the Lights object's.
+        table.write(0b11, 0b11, 0b1100, SoftPwm.bcm_slices({0b01: 0b01010101, 0b10: 0b10})[1])
+        _run_worker(monkeypatch, topology, table, SliceClock(hand_back))
+    finally:
+        table.close()
+    assert handed_back_at == [2]
+    assert device.writes[:2] == [{0: True, 1: False}, {0: False, 1: True}]
+    assert device.writes[2:] == [{0: True}, {0: False}] * (SoftPwm.LEVEL_BITS - 1)
+
+
+def test_torn_read_is_retried():
+    """
+    A table that changes while it is read is thrown away, and the worker keeps
+    the last whole table until the next read.
+    """
+    table = SoftPwm.PwmTable(2)
+    try:
+        table.write(0b01, 0b01, 0, [0b01] * SoftPwm.LEVEL_BITS)
+        acknowledged = threading.Event()
+        current = SoftPwm._latest_table(table, (None, 0, 0, 0, []), acknowledged)
+        assert current[:4] == (table.sequence(), 0b01, 0b01, 0)
+        read_masks = table._read_masks
+
+        def torn_read():
+            raw = read_masks()
+            table.write(0x100, 0x100, 0, [0x100] * SoftPwm.LEVEL_BITS)
+            return raw
+        table._read_masks = torn_read
+        acknowledged.clear()
+        assert table.read() is None
+        assert SoftPwm._latest_table(table, current, acknowledged) is current
+        assert not acknowledged.is_set()
+        table._read_masks = read_masks
+        # Half way through a write the sequence number is odd.
+        struct.pack_into('<I', table._shm.buf, 0, table.sequence() + 1)
+        assert table.read() is None
+        struct.pack_into('<I', table._shm.buf, 0, table.sequence() + 1)
+        latest = SoftPwm._latest_table(table, current, acknowledged)
+        assert latest[1:4] == (0x100, 0x100, 0) and latest[4] == [0x100] * SoftPwm.LEVEL_BITS
+        assert acknowledged.is_set() and table.caught_up(table.sequence())
+    finally:
+        table.close()
+
+
+def test_sequence_wraps_around():
+    table = SoftPwm.PwmTable(1)
+    try:
+        table.acknowledge(SoftPwm.SEQUENCE_MODULO - 2)
+        assert table.caught_up(SoftPwm.SEQUENCE_MODULO - 4)
+        assert table.caught_up(SoftPwm.SEQUENCE_MODULO - 2)
+        assert not table.caught_up(0)
+        struct.pack_into('<I', table._shm.buf, 0, SoftPwm.SEQUENCE_MODULO - 2)
+        table.write(0, 0, 0, [0] * SoftPwm.LEVEL_BITS)
+        assert table.sequence() == 0
+    finally:
+        table.close()
+
+
+def test_lights_hand_back_and_rewrite():
+    """
+    The PwmProcess is handed only the dimmed pins of independent OutputDevices,
+    and the whole of a shift register.  A shift register that is handed back is
+    rewritten from the Lights object's state, with the changes made meanwhile.
+    """
+    output = OutputDevices.RecordingShiftOutput()
+    chain = OutputDevices.ShiftRegisterDevice('chain', 4, output)
+    gpio = RecordingDevice('gpio', 4)
+    channels = [(num, 0, num - 1) for num in range(1, 5)] + [(num, 1, num - 5) for num in range(5, 9)]
+    lights = Lights.Lights(Topology.Topology([chain, gpio], channels), Clock.RealClock())
+    pwm = lights.pwm = RecordingPwm()
+    lights.set_frame(0b0001)
+    gpio.writes.clear()
+    lights.set_level(6, 100)
+    assert pwm.owned == [0b100000]
+    lights.set_level(2, 100)
+    assert pwm.owned[-1] == 0b101111
+    output.frames.clear()
+    # Channel 4 is on the shift register the PwmProcess writes now.
+    lights.apply({4: True})
+    assert output.frames == [] and pwm.frames == [(0b1000, 0b1000)]
+    lights.set_level(2, 0)
+    assert pwm.owned[-1] == 0b100000
+    assert output.frames == [bytes([0b1011]), bytes([0b1001])]
+    lights.set_level(6, SoftPwm.MAX_LEVEL)
+    assert pwm.owned[-1] == 0
+    assert gpio.writes == [{1: True}]
+    assert lights.state == 0b101001
+
+
+def test_release_waits_for_the_process(monkeypatch):
+    """
+    Handing pins back blocks until the forked PwmProcess has read the table that
+    no longer has them.
+    """
+    monkeypatch.setattr(SoftPwm, 'raise_priority', lambda: None)
+    gpio = RecordingDevice('gpio', 2)
+    lights = Lights.Lights(Topology.Topology([gpio], [(1, 0, 0), (2, 0, 1)]), Clock.RealClock())
+    pwm = SoftPwm.PwmProcess(lights)
+    pwm.start()
+    try:
+        pwm.set_levels({0b01: 100}, 0b01, 0)
+        pwm.set_levels({}, 0, 0)
+        assert pwm._table.caught_up(pwm._table.sequence())
+    finally:
+        pwm.stop()
+    assert pwm._process is None
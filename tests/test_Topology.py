@@ -0,0 +1,87 @@
+import pytest
+
+import Lights
+import OutputDevices
+import Topology
+
+
+def _shift_register(name: str, pin_count: int, **settings):
+    """
+    :return: The topology dictionary of a recorded shift register chain.
+    """
+    return dict(name=name, type='shift_register', pin_count=pin_count, record=True, **settings)
+
+
+def test_channels_across_devices():
+    """
+    A device's pins get consecutive channel numbers after the previous device's,
+    from its first_channel, or from its own list.
+    """
+    config = {'devices': [
+        _shift_register('porch', 8),
+        _shift_register('yard', 8, first_channel=20),
+        _shift_register('roof', 4, channels=[40, 33, 50, 45]),
+        _shift_register('garage', 2),
+    ]}
+    topology = Topology.Topology.from_config(config, Lights.LED)
+    porch, yard, roof, garage = topology.devices
+    assert topology.locate(1) == (porch, 0)
+    assert topology.locate(8) == (porch, 7)
+    assert topology.locate(9) is None
+    assert topology.locate(20) == (yard, 0)
+    assert topology.locate(27) == (yard, 7)
+    assert topology.locate(33) == (roof, 1)
+    assert topology.locate(45) == (roof, 3)
+    # After a list of channels, the next device carries on after the highest one.
+    assert topology.locate(51) == (garage, 0)
+    assert topology.channel_numbers == list(range(1, 9)) + list(range(20, 28)) + [33, 40, 45, 50, 51, 52]
+    masks = topology.device_masks()
+    assert masks[porch] == 0xff
+    assert masks[garage] == 0b11 << 50
+
+
+def test_write_one_burst_per_device():
+    config = {'devices': [_shift_register('porch', 8), _shift_register('yard', 8)]}
+    topology = Topology.Topology.from_config(config, Lights.LED)
+    porch, yard = topology.devices
+    porch._output.frames.clear()
+    yard._output.frames.clear()
+    topology.write(0b1000000110, 0b1000000010)
+    assert porch._output.frames == [bytes([0b00000010])]
+    assert yard._output.frames == [bytes([0b00000010])]
+
+
+@pytest.mark.parametrize('channels', [[0, 1], [-3, 1], [1.5, 2]])
+def test_channels_below_one_are_rejected(channels):
+    config = {'devices': [_shift_register('porch', 2, channels=channels)]}
+    with pytest.raises(Exception, match='numbered from 1'):
+        Topology.Topology.from_config(config, Lights.LED)
+
+
+def test_first_channel_zero_is_rejected():
+    config = {'devices': [_shift_register('porch', 8, first_channel=0)]}
+    with pytest.raises(Exception, match='numbered from 1'):
+        Topology.Topology.from_config(config, Lights.LED)
+
+
+def test_duplicate_channels_are_rejected():
+    config = {'devices': [_shift_register('porch', 8), _shift_register('yard', 8, first_channel=5)]}
+    with pytest.raises(Exception, match='more than one pin'):
+        Topology.Topology.from_config(config, Lights.LED)
+
+
+def test_wrong_channel_count_is_rejected():
+    config = {'devices': [_shift_register('porch', 4, channels=[1, 2])]}
+    with pytest.raises(Exception, match='4 pins but 2 channels'):
+        Topology.Topology.from_config(config, Lights.LED)
+
+
+def test_simulated():
+    """
+    Simulated, every channel is one simulator LED on a single device.
+    """
+    config = {'devices': [{'name': 'gpio', 'type': 'gpio', 'pins': [17, 18]}, _shift_register('yard', 8)]}
+    topology = Topology.Topology.from_config(config, Lights.LED, simulate=True)
+    assert len(topology.devices) == 1
+    assert isinstance(topology.devices[0], OutputDevices.LedDevice)
+    assert topology.channel_numbers == list(range(1, 11))
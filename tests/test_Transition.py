@@ -0,0 +1,70 @@
+import Clock
+import Lights
+import Scheduler
+import ShowEngine
+import SoftPwm
+import Topology
+import Transition
+
+
+def _lights():
+    """
+    :return: A Lights object with channels 1 to 4 on a VirtualClock.
+    """
+    clock = Clock.VirtualClock()
+    topology = Topology.Topology.simulated([1, 2, 3, 4], Lights.LED)
+    return Lights.Lights(topology, clock)
+
+
+def test_crossfade_dims_the_channels_that_differ():
+    """
+    A crossfade sets the brightness of the channels that differ between the
+    frames, and sets the others on or off.
+    """
+    lights = _lights()
+    transition = Transition.Transition(Transition.CROSSFADE)
+    # Channel 1 is on in both, 2 only going out, 3 only coming in, 4 in neither.
+    transition.crossfade(lights, 0b0011, 0b0101, .25)
+    level = int(.25 * SoftPwm.MAX_LEVEL)
+    assert [lights.level(num) for num in (1, 2, 3, 4)] == [SoftPwm.MAX_LEVEL, SoftPwm.MAX_LEVEL - level, level, 0]
+
+
+def test_crossfade_ends_on_the_incoming_frame():
+    """
+    After a crossfade nothing is left dimmed, and the incoming frame is up.
+    """
+    lights = _lights()
+    scheduler = Scheduler.Scheduler(lights.clock)
+    outgoing = ShowEngine.Timeline([(0, 0b0011)], 1)
+    incoming = ShowEngine.Timeline([(0, 0b0101)], 1)
+    transition = Transition.Transition(Transition.CROSSFADE, .5)
+    start_ns = scheduler.now_ns()
+    end_ns = transition.play(lights, scheduler, outgoing, start_ns, incoming, start_ns)
+    assert end_ns == start_ns + Scheduler.NS_PER_SECOND // 2
+    assert lights.state == 0b0101
+    assert [lights.level(num) for num in (1, 2, 3, 4)] == [SoftPwm.MAX_LEVEL, 0, SoftPwm.MAX_LEVEL, 0]
+
+
+def test_wipe_hands_channels_over_in_order():
+    """
+    A wipe with no channel numbers takes them from the Lights object and hands
+    them over one at a time, in channel order.
+    """
+    lights = _lights()
+    scheduler = Scheduler.Scheduler(lights.clock)
+    outgoing = ShowEngine.Timeline([(0, 0b1111)], 1)
+    incoming = ShowEngine.Timeline([(0, 0b0000)], 1)
+    transition = Transition.Transition(Transition.WIPE, 1)
+    frames = []
+    set_frame = lights.set_frame
+
+    def record_frame(mask, *args):
+        frames.append(mask)
+        set_frame(mask, *args)
+    lights.set_frame = record_frame
+    start_ns = scheduler.now_ns()
+    transition.play(lights, scheduler, outgoing, start_ns, incoming, start_ns)
+    # Each change turns off the next channel up, and nothing is left of the outgoing frame.
+    changes = [mask for index, mask in enumerate(frames) if index == 0 or mask != frames[index - 1]]
+    assert changes == [0b1111, 0b1110, 0b1100, 0b1000, 0b0000]
+    assert lights.state == 0